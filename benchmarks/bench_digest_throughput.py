@@ -0,0 +1,135 @@
+"""
+Digest throughput benchmark: Prometheus Gauge updates vs in-memory flow records.
+
+Runs three measurements:
+  - the per-digest metric writes done with Gauge.labels(...).set(...) (old hot path)
+  - the same writes done on FlowRecord attributes (current hot path)
+  - DigestManager.handle_digest_for_switch end to end on synthetic DigestList messages
+plus the cost of one scrape of the collector once all flows are populated.
+
+Usage:
+    python3 bench_digest_throughput.py [--digests 50000] [--flows 256]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+from p4.v1 import p4runtime_pb2
+
+from flow_state import FlowStateStore, FlowStateCollector, register_collector
+
+
+def report(name, count, elapsed):
+    print(f"{name:<40} {count / elapsed:>12.0f} digest/s  ({elapsed * 1e6 / count:.2f} us/digest)")
+
+
+def bench_gauges(num_digests, num_flows):
+    registry = CollectorRegistry()
+    port_labels = ['switch', 'port', 'flow']
+    flow_labels = ['switch', 'flow']
+    queue_depth = Gauge('switch_port_queue_depth', '', port_labels, registry=registry)
+    queue_time = Gauge('queue_time', '', port_labels, registry=registry)
+    gauges = [Gauge(name, '', flow_labels, registry=registry) for name in (
+        'switch_time', 'interarrival_time', 'packet_length', 'sending_rate', 'digest_timestamp',
+        'last_digest_timestamp', 'total_byte_count', 'total_packet_count', 'throughput', 'overhead')]
+
+    start = time.perf_counter()
+    for i in range(num_digests):
+        flow = i % num_flows
+        queue_depth.labels('s6', 7, flow).set(i)
+        queue_time.labels('s6', 7, flow).set(i)
+        for gauge in gauges:
+            gauge.labels('s7', flow).set(i)
+    return time.perf_counter() - start
+
+
+def bench_records(num_digests, num_flows):
+    store = FlowStateStore()
+    register_collector(FlowStateCollector(store), CollectorRegistry())
+
+    start = time.perf_counter()
+    for i in range(num_digests):
+        flow = i % num_flows
+        record = store.flow('s6', flow)
+        record.port = 7
+        record.queue_depth = i
+        record.queue_time = i
+        record = store.flow('s7', flow)
+        record.switch_time = i
+        record.interarrival_time = i
+        record.packet_length = i
+        record.sending_rate = i
+        record.digest_delta = i
+        record.last_seen = i
+        record.total_bytes = i
+        record.total_packets = i
+        record.throughput = i
+        record.overhead = i
+    return time.perf_counter() - start, store
+
+
+def build_digest(tunnel_id, seq):
+    # Field order of congestion_digest_t in advanced_tunnel.p4, every member is bit<32>
+    values = [tunnel_id, 6, 2000, 3, 1500, 1200, 1000, 1000000 + seq * 1000, 1200 * seq, seq, 0, 0,
+              5000, 80, 0x0A000101, 0x0A000202, 6]
+    message = p4runtime_pb2.StreamMessageResponse()
+    message.digest.digest_id = 1
+    member = message.digest.data.add()
+    for value in values:
+        member.struct.members.add().bitstring = value.to_bytes(4, byteorder='big')
+    return message
+
+
+class _Switch:
+    name = 's7'
+
+
+def bench_handler(num_digests, num_flows):
+    from digest_manager import DigestManager
+
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = DigestManager(None, {}, filename=os.path.join(workdir, 'digest.xlsx'),
+                                filename_time=os.path.join(workdir, 'digest_time.xlsx'))
+        # Keep the Excel writer out of the measurement, it runs on its own thread anyway
+        manager.save_to_excel = lambda *args, **kwargs: None
+        messages = [build_digest(67 + flow, flow) for flow in range(num_flows)]
+        switch = _Switch()
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for i in range(num_digests):
+                manager.handle_digest_for_switch(switch, messages[i % num_flows], time.time())
+            elapsed = time.perf_counter() - start
+        manager.stop_excel_thread()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Digest hot path throughput')
+    parser.add_argument('--digests', type=int, default=50000)
+    parser.add_argument('--flows', type=int, default=256)
+    args = parser.parse_args()
+
+    report('Gauge.labels().set', args.digests, bench_gauges(args.digests, args.flows))
+    elapsed, store = bench_records(args.digests, args.flows)
+    report('FlowRecord attributes', args.digests, elapsed)
+
+    registry = CollectorRegistry()
+    register_collector(FlowStateCollector(store), registry)
+    start = time.perf_counter()
+    generate_latest(registry)
+    print(f"{'scrape (' + str(len(store.flows)) + ' records)':<40} {(time.perf_counter() - start) * 1000:>12.2f} ms")
+
+    report('handle_digest_for_switch', args.digests, bench_handler(args.digests, args.flows))
+
+
+if __name__ == '__main__':
+    main()
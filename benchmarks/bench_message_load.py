@@ -0,0 +1,381 @@
+"""
+Load generator for the controller message path: congestion digests and ARP packet-ins
+fed at a target rate into SwitchConnection.listen_for_messages -> asyncio.Queue(maxsize=5)
+-> MessageManager.handle_messages_for_switch -> DigestManager / ArpManager.
+
+The switches are fake P4Runtime servers (utils/fake_p4runtime_switch.py), so the rule
+writes triggered by ARP handling and by malicious digests are real gRPC calls. Two feeds:
+  - grpc:       messages are injected by the fake switches and travel the StreamChannel;
+  - in-process: messages are handed straight to the listener, without serialization
+                and gRPC, to isolate the cost of the Python pipeline.
+Each switch buffers at most --buffer stream messages (like the BMv2 digest buffer);
+messages offered when the buffer is full are dropped.
+
+Reported: offered and sustained rate, end-to-end latency percentiles (injection ->
+handler return), handler service time, drops at the switch buffer and messages never
+processed by the end of the drain period.
+
+Usage:
+    python3 bench_message_load.py [--rate 2000] [--duration 10] [--switches 4]
+        [--feed grpc|in-process] [--pattern constant|burst|poisson] [--burst 50]
+        [--tunnels 8] [--flows 16] [--malicious 0.01] [--arp 0.05]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+import numpy as np
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from fake_p4runtime_switch import start_fake_switches, load_p4info
+
+P4_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../p4src/advanced_tunnel.p4')
+P4INFO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../p4src/build/advanced_tunnel.p4.p4info.txt')
+DIGEST = 'congestion_digest_t'
+
+
+def build_p4info():
+    """Digest and packet_in header of advanced_tunnel.p4, when the compiled p4info is not available."""
+    with open(P4_SOURCE) as f:
+        source = f.read()
+    body = re.search(r"struct\s+congestion_digest_t\s*\{(.*?)\}", source, re.S).group(1)
+    p4info = p4info_pb2.P4Info()
+    digest = p4info.digests.add()
+    digest.preamble.id = 385000001
+    digest.preamble.name = DIGEST
+    digest.type_spec.struct.name = DIGEST
+    struct = p4info.type_info.structs[DIGEST]
+    for width, name in re.findall(r"bit\s*<\s*(\d+)\s*>\s*(\w+)\s*;", body):
+        member = struct.members.add()
+        member.name = name
+        member.type_spec.bitstring.bit.bitwidth = int(width)
+    header = p4info.controller_packet_metadata.add()
+    header.preamble.id = 67000001
+    header.preamble.name = 'packet_in'
+    header.metadata.add(id=1, name='ingress_port', bitwidth=16)
+    return p4info
+
+
+class Workload:
+    """Deterministic digest samples and ARP frames for a set of switches."""
+
+    def __init__(self, switch_names, tunnels, flows, malicious, arp, seed=0):
+        from config import SWITCH_PORTS, MAC_IP_MAPPING
+
+        self.rng = np.random.default_rng(seed)
+        self.malicious = malicious
+        self.arp = arp
+        self.seq = itertools.count()
+        self.flows = []
+        for t in range(tunnels):
+            for f in range(flows):
+                self.flows.append((1000 + t, 0x0A000101 + t, 0x0A000201 + t, 10000 + f, 80, 6 if f % 4 else 17))
+        # in_port of a digest is the number of a neighbour switch, as in interpret_tunnel_id
+        self.neighbours = {}
+        for name in switch_names:
+            ports = [int(peer[1:]) for peer in SWITCH_PORTS.get(name, {}) if peer.startswith('s')]
+            self.neighbours[name] = ports or [int(name[1:])]
+        self.hosts = list(MAC_IP_MAPPING.values())
+        self.counters = {}
+
+    def digest_sample(self, switch_name):
+        tunnel, src_ip, dst_ip, src_port, dst_port, protocol = self.flows[self.rng.integers(len(self.flows))]
+        key = (switch_name, tunnel, src_port)
+        packets = self.counters.get(key, 0) + 1
+        self.counters[key] = packets
+        neighbours = self.neighbours[switch_name]
+        return (tunnel, neighbours[self.rng.integers(len(neighbours))],
+                int(self.rng.integers(500, 5000)),                  # switch_time
+                int(self.rng.integers(0, 64)),                      # queue_depth
+                int(self.rng.integers(100, 100000)),                # interarrival_time
+                int(self.rng.integers(64, 1500)),                   # packet_length
+                int(self.rng.integers(0, 20000)),                   # queue_time
+                (time.monotonic_ns() // 1000) & 0xFFFFFFFF,          # digest_timestamp
+                packets * 1200, packets, 1,
+                int(self.rng.random() < self.malicious),
+                src_port, dst_port, src_ip, dst_ip, protocol)
+
+    def arp_frame(self):
+        """Broadcast ARP request between two hosts, with a sequence number in the padding."""
+        seq = next(self.seq)
+        (src_mac, src_ip), (_, dst_ip) = (self.hosts[i] for i in self.rng.choice(len(self.hosts), 2, replace=False))
+        src_mac = bytes.fromhex(src_mac.replace(':', ''))
+        frame = (b'\xff' * 6 + src_mac + b'\x08\x06' +
+                 b'\x00\x01\x08\x00\x06\x04\x00\x01' + src_mac + bytes(map(int, src_ip.split('.'))) +
+                 b'\x00' * 6 + bytes(map(int, dst_ip.split('.'))))
+        return seq, frame + seq.to_bytes(8, 'big')
+
+    def is_arp(self):
+        return self.rng.random() < self.arp
+
+
+class LocalFeed:
+    """Bounded iterator that replaces the gRPC response stream of a SwitchConnection."""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size or 0)
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.queue.put(StopIteration)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = self.queue.get()
+        if message is StopIteration:
+            raise StopIteration
+        return message
+
+
+def schedule(rate, duration, pattern, burst, rng):
+    """Send offsets (seconds from the start) of every message."""
+    count = int(rate * duration)
+    if pattern == 'constant':
+        return np.arange(count) / rate
+    if pattern == 'burst':
+        # `burst` back-to-back messages, bursts spaced to keep the average rate
+        return (np.arange(count) // burst) * (burst / rate)
+    if pattern == 'poisson':
+        return np.cumsum(rng.exponential(1 / rate, count))
+    raise ValueError(f"unknown pattern {pattern}")
+
+
+class Recorder:
+    """Send times and completion latencies, keyed by (switch, kind, id)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.latency = []
+        self.service = []
+        self.unknown = 0
+
+    def sent_at(self, key, t):
+        with self.lock:
+            self.sent[key] = t
+
+    def done(self, key, started):
+        now = time.perf_counter()
+        with self.lock:
+            t = self.sent.pop(key, None)
+            self.service.append(now - started)
+            if t is None:
+                self.unknown += 1
+            else:
+                self.latency.append(now - t)
+
+
+def instrument(recorder, digest_manager, arp_manager):
+    handle_digest = digest_manager.handle_digest_for_switch
+    handle_packet = arp_manager.handle_packet_for_switch
+
+    def on_digest(switch, message, timestamp_received):
+        started = time.perf_counter()
+        handle_digest(switch, message, timestamp_received)
+        recorder.done((switch.name, 'digest', message.digest.list_id), started)
+
+    def on_packet(switch, message):
+        started = time.perf_counter()
+        handle_packet(switch, message)
+        recorder.done((switch.name, 'packet', int.from_bytes(message.packet.payload[-8:], 'big')), started)
+
+    digest_manager.handle_digest_for_switch = on_digest
+    arp_manager.handle_packet_for_switch = on_packet
+
+
+def send(recorder, workload, fake, local_feed):
+    """Offers one message to a switch; False if its buffer dropped it."""
+    if workload.is_arp():
+        seq, frame = workload.arp_frame()
+        message = fake.build_packet_in(frame, {'ingress_port': workload.neighbours[fake.name][0]})
+        key = (fake.name, 'packet', seq)
+    else:
+        sample = workload.digest_sample(fake.name)
+        if local_feed is None:
+            # The list id is assigned on injection: hold the lock so the handler cannot finish first
+            with recorder.lock:
+                now = time.perf_counter()
+                list_ids = fake.inject_digest(DIGEST, [sample])
+                if list_ids:
+                    recorder.sent[(fake.name, 'digest', list_ids[0])] = now
+            return bool(list_ids)
+        message = fake.build_digest_lists(DIGEST, [sample])[0]
+        key = (fake.name, 'digest', message.digest.list_id)
+
+    recorder.sent_at(key, time.perf_counter())
+    if local_feed is not None:
+        ok = local_feed.offer(message)
+    else:
+        ok = fake.inject_packet_in(message.packet.payload, {'ingress_port': workload.neighbours[fake.name][0]})
+    if not ok:
+        with recorder.lock:
+            recorder.sent.pop(key, None)
+    return ok
+
+
+def percentiles(values):
+    if not values:
+        return {p: float('nan') for p in ('p50', 'p90', 'p99', 'max')}
+    ms = np.asarray(values) * 1000
+    return {'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+            'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+
+
+def run(rate=2000, duration=10, switches=4, feed='grpc', pattern='constant', burst=50, tunnels=8, flows=16,
+        malicious=0.01, arp=0.05, buffer=1000, drain=5.0, base_port=51050, seed=0, quiet=True):
+    """Runs one load test and returns its results as a dict."""
+    import p4runtime_lib.helper
+    from p4runtime_lib.switch import SwitchConnection
+    from arp_manager import ArpManager
+    from digest_manager import DigestManager
+    from message_manager import MessageManager
+
+    if os.path.exists(P4INFO):
+        p4info, helper = load_p4info(P4INFO), p4runtime_lib.helper.P4InfoHelper(P4INFO)
+    else:
+        # Without the compiled p4info the ARP handler cannot build its rules
+        p4info, helper = build_p4info(), None
+        arp = 0.0
+
+    servers = start_fake_switches(p4info, switches, base_port=base_port, stream_buffer=buffer)
+    connections, feeds = {}, {}
+    for i, (_, fake) in enumerate(servers):
+        sw = SwitchConnection(name=fake.name, address=f'127.0.0.1:{base_port + i + 1}', device_id=fake.device_id,
+                              proto_dump_file=None)
+        sw.MasterArbitrationUpdate()
+        if helper is not None:
+            sw.WriteDigestEntry(helper.buildDigestEntry(digest_name=DIGEST))
+            sw.WritePREEntry(helper.buildMCEntry(multicast_group_id=1, replicas=[]))
+        else:
+            entry = p4runtime_pb2.DigestEntry(digest_id=fake._id('digests', DIGEST))
+            entry.config.max_list_size = 10
+            sw.WriteDigestEntry(entry)
+        if feed == 'in-process':
+            feeds[fake.name] = LocalFeed(buffer)
+            sw.stream_msg_resp = feeds[fake.name]
+        connections[i] = sw
+
+    workdir = tempfile.TemporaryDirectory()
+    digest_manager = DigestManager(helper, connections, filename=os.path.join(workdir.name, 'digest.xlsx'),
+                                   filename_time=os.path.join(workdir.name, 'digest_time.xlsx'))
+    # The Excel writer runs on its own thread and is not part of the message path
+    digest_manager.save_to_excel = lambda *args, **kwargs: None
+    arp_manager = ArpManager(helper, connections)
+    message_manager = MessageManager(helper, connections)
+    recorder = Recorder()
+    instrument(recorder, digest_manager, arp_manager)
+
+    loop = asyncio.new_event_loop()
+    main_task = loop.create_task(message_manager.start(connections, arp_manager, digest_manager))
+
+    def consume():
+        with contextlib.suppress(asyncio.CancelledError):
+            loop.run_until_complete(main_task)
+
+    consumer = threading.Thread(target=consume, daemon=True)
+
+    workload = Workload([fake.name for _, fake in servers], tunnels, flows, malicious, arp, seed)
+    offsets = schedule(rate, duration, pattern, burst, workload.rng)
+    fakes = [fake for _, fake in servers]
+    offered = dropped = 0
+    max_lag = 0.0
+
+    out = open(os.devnull, 'w') if quiet else sys.stdout
+    with contextlib.redirect_stdout(out):
+        consumer.start()
+        time.sleep(0.5)  # listeners and queues up
+        start = time.perf_counter()
+        for n, offset in enumerate(offsets):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            fake = fakes[n % len(fakes)]
+            offered += 1
+            if not send(recorder, workload, fake, feeds.get(fake.name)):
+                dropped += 1
+        send_time = time.perf_counter() - start
+
+        deadline = time.perf_counter() + drain
+        while recorder.sent and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+    loop.call_soon_threadsafe(main_task.cancel)
+    for f in feeds.values():
+        f.close()
+    for server, _ in servers:
+        server.stop(None)
+    digest_manager.stop_excel_thread()
+    workdir.cleanup()
+    if out is not sys.stdout:
+        out.close()
+
+    processed = len(recorder.latency)
+    return {
+        'feed': feed, 'pattern': pattern, 'switches': switches, 'arp': arp,
+        'offered': offered, 'offered_rate': offered / send_time if send_time else 0.0,
+        'processed': processed, 'sustained_rate': processed / elapsed if elapsed else 0.0,
+        'dropped_buffer': dropped, 'lost': len(recorder.sent), 'max_send_lag_ms': max_lag * 1000,
+        'latency_ms': percentiles(recorder.latency), 'service_ms': percentiles(recorder.service),
+    }
+
+
+def report(result):
+    print(f"feed={result['feed']} pattern={result['pattern']} switches={result['switches']} arp={result['arp']}")
+    print(f"{'offered':<24} {result['offered']:>10} msg  ({result['offered_rate']:.0f} msg/s, "
+          f"max send lag {result['max_send_lag_ms']:.1f} ms)")
+    print(f"{'processed':<24} {result['processed']:>10} msg  ({result['sustained_rate']:.0f} msg/s sustained)")
+    print(f"{'dropped (switch buffer)':<24} {result['dropped_buffer']:>10}")
+    print(f"{'lost (not processed)':<24} {result['lost']:>10}")
+    for name in ('latency_ms', 'service_ms'):
+        p = result[name]
+        print(f"{name:<24} p50 {p['p50']:.3f}  p90 {p['p90']:.3f}  p99 {p['p99']:.3f}  max {p['max']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Digest and packet-in load on the controller message path')
+    parser.add_argument('--rate', type=float, default=2000, help='messages per second, all switches')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--switches', type=int, default=4)
+    parser.add_argument('--feed', choices=('grpc', 'in-process'), default='grpc')
+    parser.add_argument('--pattern', choices=('constant', 'burst', 'poisson'), default='constant')
+    parser.add_argument('--burst', type=int, default=50, help='messages per burst with --pattern burst')
+    parser.add_argument('--tunnels', type=int, default=8)
+    parser.add_argument('--flows', type=int, default=16, help='flows per tunnel')
+    parser.add_argument('--malicious', type=float, default=0.01, help='fraction of digests with malicious_flag')
+    parser.add_argument('--arp', type=float, default=0.05, help='fraction of ARP packet-ins')
+    parser.add_argument('--buffer', type=int, default=1000, help='stream messages buffered per switch')
+    parser.add_argument('--drain', type=float, default=5.0, help='seconds to wait for the backlog')
+    parser.add_argument('--base-port', type=int, default=51050)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report(run(args.rate, args.duration, args.switches, args.feed, args.pattern, args.burst, args.tunnels,
+               args.flows, args.malicious, args.arp, args.buffer, args.drain, args.base_port, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Detection-to-mitigation latency: time from the first packet of a malicious flow to the
+drop rule in place on the ingress switch of its tunnel, split per stage and correlated
+per tunnel through DigestManager.stage_hook.
+
+Stages of one run (one detection):
+  accumulation  first packet -> digest emitted by the weak learner (digest_timestamp)
+  batching      digest emitted -> DigestList sent (max_list_size / max_timeout_ns)
+  stream        DigestList sent -> received by SwitchConnection.listen_for_messages
+  decode        received -> mitigation started (stream queue + DigestManager decoding)
+  install       install_block_on_first_switch, up to the upsertRule write completion
+  total         first packet -> rule installed
+
+Modes:
+  fake     fake P4Runtime switches (utils/fake_p4runtime_switch.py) with the routes of
+           examples/rules_example.txt. Each run models the accumulation of --packets
+           packets --gap-ms apart, then injects a malicious digest on the first weak
+           learner of a route; the switch batches it like BMv2. First packet time and
+           switch clock are known exactly. --background adds benign digests per second
+           on every switch, which fill the digest lists.
+  mininet  connects to running BMv2 switches in place of the controller (stop it first)
+           and measures the attacks generated in Mininet, e.g. p4src/SYN_flood.py. The
+           first packet is estimated as digest_timestamp - packet_count * interarrival_time
+           and the switch clock is aligned on the fastest digest (minimum of receive -
+           digest_timestamp), so the stream stage is a lower bound. Drop rules are removed
+           --hold seconds after installation so the next attack is detected again.
+
+Usage:
+    python3 bench_mitigation_latency.py fake [--runs 200] [--packets 8] [--gap-ms 1]
+        [--background 0] [-o result.json]
+    python3 bench_mitigation_latency.py mininet [--runs 20] [--hold 5] [--install] [-o result.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+import numpy as np
+from google.protobuf import text_format
+from p4.config.v1 import p4info_pb2
+
+from bench_message_load import DIGEST, P4INFO, Workload, build_p4info
+
+BMV2_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../p4src/build/advanced_tunnel.json')
+ROUTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../examples/rules_example.txt')
+TABLE = 'MyIngress.myTunnel_exact'
+
+STAGES = [('accumulation', 'first_packet', 'detected'),
+          ('batching', 'detected', 'list_sent'),
+          ('stream', 'list_sent', 'received'),
+          ('decode', 'received', 'mitigation_start'),
+          ('install', 'mitigation_start', 'rule_installed'),
+          ('total', 'first_packet', 'rule_installed')]
+
+
+def load_helper(workdir):
+    """P4InfoHelper of advanced_tunnel.p4; without the compiled p4info, the digest and the blocking table only."""
+    import p4runtime_lib.helper
+
+    if os.path.exists(P4INFO):
+        return p4runtime_lib.helper.P4InfoHelper(P4INFO)
+    p4info = build_p4info()
+    action = p4info.actions.add()
+    action.preamble.id = 16800001
+    action.preamble.name = 'MyIngress.drop'
+    table = p4info.tables.add()
+    table.preamble.id = 37000001
+    table.preamble.name = TABLE
+    table.match_fields.add(id=1, name='hdr.myTunnel.dst_id', bitwidth=32,
+                           match_type=p4info_pb2.MatchField.EXACT)
+    table.action_refs.add(id=action.preamble.id)
+    table.size = 1024
+    path = os.path.join(workdir, 'advanced_tunnel.p4info.txt')
+    with open(path, 'w') as f:
+        f.write(text_format.MessageToString(p4info))
+    return p4runtime_lib.helper.P4InfoHelper(path)
+
+
+class StageRecorder:
+    """
+    DigestManager.stage_hook collecting one run per tunnel: the first malicious digest of
+    a tunnel opens a run, which is complete when its drop rule is installed. Digests of a
+    tunnel with a run in progress (or already blocked) are ignored.
+    """
+
+    def __init__(self, on_complete=None):
+        self.lock = threading.Lock()
+        self.active = {}  # tunnel_id -> run
+        self.runs = []
+        self.first_packet = {}  # tunnel_id -> known time of the first packet (fake mode)
+        self.on_complete = on_complete
+        self.completed = threading.Condition(self.lock)
+
+    def expect(self, tunnel_id, first_packet):
+        with self.lock:
+            self.first_packet[tunnel_id] = first_packet
+
+    def release(self, tunnel_id):
+        """The tunnel can be detected again (its drop rule was removed)."""
+        with self.lock:
+            self.active.pop(tunnel_id, None)
+
+    def __call__(self, stage, tunnel_id, timestamp, details):
+        with self.lock:
+            run = self.active.get(tunnel_id)
+            if stage == 'received':
+                if run is not None or details.get('is_malicious') != 1:
+                    return
+                self.active[tunnel_id] = {
+                    'tunnel': tunnel_id, 'switch': details['switch'], 'received': timestamp,
+                    'digest_timestamp': details['digest_timestamp'], 'list_sent': details['list_timestamp'] / 1e9,
+                    'packet_count': details['packet_count'], 'interarrival_time': details['interarrival_time'],
+                    'first_packet': self.first_packet.pop(tunnel_id, None),
+                }
+            elif run is None or stage in run:
+                return
+            elif stage in ('decoded', 'mitigation_start'):
+                run[stage] = timestamp
+            elif stage == 'rule_installed':
+                run[stage] = timestamp
+                run['ingress_switch'] = details['switch']
+                self.runs.append(run)
+                self.completed.notify_all()
+                if self.on_complete is not None:
+                    self.on_complete(run)
+
+    def wait(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while len(self.runs) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.completed.wait(remaining):
+                    return False
+        return True
+
+
+def align(runs, clock_offset=None):
+    """
+    Fills in 'detected' (wall time of digest_timestamp) and the estimated 'first_packet'.
+    The digest timestamp is the switch clock (us / 1e6); without a known offset it is
+    aligned on the fastest digest. The list timestamp is aligned the same way when it is
+    not a wall clock time.
+    """
+    if not runs:
+        return runs
+    if clock_offset is None:
+        clock_offset = min(run['received'] - run['digest_timestamp'] for run in runs)
+    list_offset = 0.0
+    if any(abs(run['received'] - run['list_sent']) > 60 for run in runs):
+        list_offset = min(run['received'] - run['list_sent'] for run in runs)
+    for run in runs:
+        run['detected'] = run['digest_timestamp'] + clock_offset
+        run['list_sent'] += list_offset
+        if run['first_packet'] is None:
+            run['first_packet'] = run['detected'] - run['packet_count'] * run['interarrival_time']
+            run['first_packet_estimated'] = True
+    return runs
+
+
+def breakdown(runs):
+    result = {}
+    for name, start, end in STAGES:
+        ms = np.array([(run[end] - run[start]) * 1000 for run in runs if start in run and end in run])
+        if not len(ms):
+            continue
+        result[name] = {'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)),
+                        'p90': float(np.percentile(ms, 90)), 'p99': float(np.percentile(ms, 99)),
+                        'max': float(ms.max())}
+    return result
+
+
+def remove_block(helper, sw, tunnel_id):
+    entry = helper.buildTableEntry(table_name=TABLE, match_fields={'hdr.myTunnel.dst_id': tunnel_id})
+    with contextlib.suppress(Exception):
+        sw.DeleteTableEntry(entry)
+
+
+def start_controller(helper, connections, recorder, workdir):
+    """DigestManager and MessageManager on their own event loop thread, like the controller."""
+    from arp_manager import ArpManager
+    from digest_manager import DigestManager
+    from message_manager import MessageManager
+
+    digest_manager = DigestManager(helper, connections, filename=os.path.join(workdir, 'digest.xlsx'),
+                                   filename_time=os.path.join(workdir, 'digest_time.xlsx'))
+    # The Excel writer runs on its own thread and is not part of the mitigation path
+    digest_manager.save_to_excel = lambda *args, **kwargs: None
+    digest_manager.stage_hook = recorder
+    arp_manager = ArpManager(helper, connections)
+    message_manager = MessageManager(helper, connections)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(message_manager.start(connections, arp_manager, digest_manager))
+
+    def consume():
+        with contextlib.suppress(asyncio.CancelledError):
+            loop.run_until_complete(task)
+
+    threading.Thread(target=consume, daemon=True).start()
+
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        digest_manager.stop_excel_thread()
+
+    return stop
+
+
+def malicious_sample(tunnel_id, packets, gap_s, clock_us):
+    src_ip, dst_ip = 0x0A000101, 0x0A000102
+    return (tunnel_id, 1, 800, 4, int(gap_s * 1e6), 1200, 50, clock_us & 0xFFFFFFFF,
+            packets * 1200, packets, 1, 1, 40000 + tunnel_id % 20000, 80, src_ip, dst_ip, 6)
+
+
+def run_fake(runs=200, packets=8, gap_ms=1.0, background=0.0, timeout=10.0, base_port=52050, quiet=True):
+    from p4runtime_lib.switch import SwitchConnection
+    from fake_p4runtime_switch import start_fake_switches
+
+    with open(ROUTES) as f:
+        example = json.load(f)
+    routes = [[int(s) for s in path] for path in example['shortest_paths_constrained'].values()]
+    wl_nodes = set(example.get('wl_nodes', []))
+
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    helper = load_helper(workdir.name)
+    count = max(max(path) for path in routes)
+    servers = start_fake_switches(helper.p4info, count, base_port=base_port)
+    connections = {}
+    for i, (_, fake) in enumerate(servers):
+        sw = SwitchConnection(name=fake.name, address=f'127.0.0.1:{base_port + i + 1}', device_id=fake.device_id,
+                              proto_dump_file=None)
+        sw.MasterArbitrationUpdate()
+        sw.WriteDigestEntry(helper.buildDigestEntry(digest_name=DIGEST))
+        sw.WritePREEntry(helper.buildMCEntry(multicast_group_id=1, replicas=[]))
+        connections[i] = sw
+    by_name = {sw.name: sw for sw in connections.values()}
+    fakes = {fake.name: fake for _, fake in servers}
+
+    recorder = StageRecorder()
+    # clock of the fake weak learners: time.monotonic() in us on 32 bits, as the digest_timestamp of BMv2
+    clock_offset = time.time() - ((time.monotonic_ns() // 1000) & 0xFFFFFFFF) / 1e6
+    out = open(os.devnull, 'w') if quiet else sys.stdout
+    try:
+        # install_block_on_first_switch reads the routes from ./parsed_data.json
+        os.chdir(workdir.name)
+        with open('parsed_data.json', 'w') as f:
+            json.dump({'routes': {f'{path[0]},{path[-1]}': path for path in routes}}, f)
+        with contextlib.redirect_stdout(out):
+            stop = start_controller(helper, connections, recorder, workdir.name)
+            time.sleep(0.5)  # listeners up
+            if background:
+                for fake in fakes.values():
+                    workload = Workload(list(fakes), tunnels=8, flows=16, malicious=0.0, arp=0.0,
+                                        seed=fake.device_id)
+                    fake.schedule(background, int(background * timeout * runs),
+                                  lambda i, fake=fake, workload=workload: fake.inject_digest(
+                                      DIGEST, [workload.digest_sample(fake.name)], batch=True))
+            timeouts = 0
+            for n in range(runs):
+                path = routes[n % len(routes)]
+                tunnel_id = int(''.join(str(s) for s in path))
+                detector = next((s for s in path if s in wl_nodes), path[1])
+                completed = len(recorder.runs)
+                recorder.expect(tunnel_id, time.time())
+                time.sleep(packets * gap_ms / 1000)  # the weak learner sees `packets` packets
+                sample = malicious_sample(tunnel_id, packets, gap_ms / 1000, time.monotonic_ns() // 1000)
+                fakes[f's{detector}'].inject_digest(DIGEST, [sample], batch=True)
+                if not recorder.wait(completed + 1, timeout):
+                    timeouts += 1
+                recorder.release(tunnel_id)
+                remove_block(helper, by_name[f's{path[0]}'], tunnel_id)
+            stop()
+    finally:
+        os.chdir(cwd)
+        workdir.cleanup()
+        for server, _ in servers:
+            server.stop(None)
+        if out is not sys.stdout:
+            out.close()
+
+    measured = align(recorder.runs, clock_offset)
+    return {'mode': 'fake', 'runs': runs, 'completed': len(measured), 'timeouts': timeouts,
+            'packets': packets, 'gap_ms': gap_ms, 'background': background,
+            'stages_ms': breakdown(measured), 'samples': measured}
+
+
+def run_mininet(runs=20, duration=600.0, hold=5.0, install=False, switch_count=12, host='127.0.0.1',
+                base_port=50050, p4info=P4INFO, bmv2_json=BMV2_JSON, quiet=True):
+    import p4runtime_lib.helper
+    from switch_connection_manager import SwitchConnectionManager
+
+    helper = p4runtime_lib.helper.P4InfoHelper(p4info)
+    manager = SwitchConnectionManager(helper, bmv2_json, switch_count, host=host, base_port=base_port)
+    manager.create_connections()
+    manager.update_master()
+    if install:
+        manager.install_p4_program()
+    else:
+        for sw in manager.get_switches().values():
+            manager.sendDigestEntry(sw, DIGEST)
+    connections = manager.get_switches()
+    by_name = {sw.name: sw for sw in connections.values()}
+
+    def unblock(run):
+        def remove():
+            remove_block(helper, by_name[run['ingress_switch']], run['tunnel'])
+            recorder.release(run['tunnel'])
+        timer = threading.Timer(hold, remove)
+        timer.daemon = True
+        timer.start()
+
+    recorder = StageRecorder(on_complete=unblock)
+    out = open(os.devnull, 'w') if quiet else sys.stdout
+    print(f"waiting for {runs} detections (at most {duration:.0f} s), start the attacks in Mininet")
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(out):
+        stop = start_controller(helper, connections, recorder, workdir)
+        recorder.wait(runs, duration)
+        stop()
+    if out is not sys.stdout:
+        out.close()
+
+    measured = align(list(recorder.runs))
+    return {'mode': 'mininet', 'runs': runs, 'completed': len(measured), 'timeouts': runs - len(measured),
+            'stages_ms': breakdown(measured), 'samples': measured}
+
+
+def report(result):
+    print(f"mode={result['mode']} completed {result['completed']}/{result['runs']} runs "
+          f"({result['timeouts']} timed out)")
+    if result['mode'] == 'mininet':
+        print("accumulation estimated from packet_count * interarrival_time; stream is a lower bound")
+    print(f"{'stage (ms)':<14} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, p in result['stages_ms'].items():
+        print(f"{name:<14} {p['mean']:>9.3f} {p['p50']:>9.3f} {p['p90']:>9.3f} {p['p99']:>9.3f} {p['max']:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detection-to-mitigation latency per stage')
+    sub = parser.add_subparsers(dest='mode', required=True)
+    fake = sub.add_parser('fake', help='fake P4Runtime switches')
+    fake.add_argument('--runs', type=int, default=200)
+    fake.add_argument('--packets', type=int, default=8, help='packets seen by the weak learner before the digest')
+    fake.add_argument('--gap-ms', type=float, default=1.0, help='interarrival time of the malicious flow')
+    fake.add_argument('--background', type=float, default=0.0, help='benign digests per second per switch')
+    fake.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for each run')
+    fake.add_argument('--base-port', type=int, default=52050)
+    mininet = sub.add_parser('mininet', help='running BMv2 switches')
+    mininet.add_argument('--runs', type=int, default=20)
+    mininet.add_argument('--duration', type=float, default=600.0, help='stop waiting after these seconds')
+    mininet.add_argument('--hold', type=float, default=5.0, help='seconds before a drop rule is removed')
+    mininet.add_argument('--install', action='store_true', help='install the P4 program first')
+    mininet.add_argument('--switches', type=int, default=12)
+    mininet.add_argument('--host', default='127.0.0.1')
+    mininet.add_argument('--base-port', type=int, default=50050)
+    mininet.add_argument('--p4info', default=P4INFO)
+    mininet.add_argument('--bmv2-json', default=BMV2_JSON)
+    for p in (fake, mininet):
+        p.add_argument('-o', '--output', help='write the breakdown and the per-run samples as JSON')
+        p.add_argument('-v', '--verbose', action='store_true', help='keep the controller output')
+    args = parser.parse_args()
+
+    if args.mode == 'fake':
+        result = run_fake(args.runs, args.packets, args.gap_ms, args.background, args.timeout, args.base_port,
+                          quiet=not args.verbose)
+    else:
+        result = run_mininet(args.runs, args.duration, args.hold, args.install, args.switches, args.host,
+                             args.base_port, args.p4info, args.bmv2_json, quiet=not args.verbose)
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
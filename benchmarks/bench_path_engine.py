@@ -0,0 +1,100 @@
+"""
+Route computation of path_engine on random switch graphs: engine build (all-pairs
+distances and next hops, once per graph) and answering routes for host pairs, plain and
+constrained to cross a WL node, with the engine cached.
+
+Each switch has a host; the graph is a random tree plus random links up to --degree
+links per switch on average. Every --wl-every-th switch hosts a WL.
+
+Usage:
+    python3 bench_path_engine.py [--switches 50 200 500] [--degree 4] [--pairs 1000]
+        [--wl-every 10] [--runs 3] [--seed 1]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+from path_engine import PathEngine, compute_routes, get_engine
+from topology import Topology
+
+
+def random_topology(switches, degree, seed):
+    rng = random.Random(seed)
+    names = [f's{i}' for i in range(1, switches + 1)]
+    switch_ports = {name: {f'h{i}': 1} for i, name in enumerate(names, start=1)}
+    links = {(i, rng.randint(1, i - 1)) for i in range(2, switches + 1)}
+    while len(links) < switches * degree // 2:
+        a, b = rng.sample(range(1, switches + 1), 2)
+        if (b, a) not in links:
+            links.add((a, b))
+    for a, b in sorted(links):
+        sa, sb = f's{a}', f's{b}'
+        switch_ports[sa][sb] = len(switch_ports[sa]) + 1
+        switch_ports[sb][sa] = len(switch_ports[sb]) + 1
+    hosts = {i: f'h{i}' for i in range(1, switches + 1)}
+    return Topology(names, hosts, {name: 1 for name in names}, switch_ports,
+                    {i: (f'08:00:00:00:{i // 256:02x}:{i % 256:02x}', f'10.0.{i // 256}.{i % 256}') for i in hosts})
+
+
+def run(switches=(50, 200, 500), degree=4, pairs=1000, wl_every=10, runs=3, seed=1):
+    rng = random.Random(seed)
+    results = []
+    for n in switches:
+        topology = random_topology(n, degree, seed)
+        host_pairs = [tuple(rng.sample(range(1, n + 1), 2)) for _ in range(pairs)]
+        via = list(range(1, n + 1, wl_every))
+        build = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            PathEngine(topology.switches, topology.switch_ports)
+            build.append(time.perf_counter() - started)
+        get_engine(topology.switches, topology.switch_ports)
+        plain = [compute_routes(topology, host_pairs) for _ in range(runs)]
+        constrained = [compute_routes(topology, host_pairs, via) for _ in range(runs)]
+        results.append({
+            'switches': n,
+            'links': plain[0]['graph']['links'] // 2,
+            'pairs': pairs,
+            'build_ms': statistics.median(build) * 1000,
+            'routes_ms': statistics.median(r['compute_ms'] for r in plain),
+            'constrained_ms': statistics.median(r['compute_ms'] for r in constrained),
+            'constrained_unreachable': len(constrained[0]['unreachable']),
+        })
+    return results
+
+
+def report(results):
+    print(f"{'switches':>9}{'links':>8}{'pairs':>8}{'build':>12}{'routes':>12}{'constrained':>14}")
+    for r in results:
+        print(f"{r['switches']:>9}{r['links']:>8}{r['pairs']:>8}{r['build_ms']:>9.1f} ms{r['routes_ms']:>9.1f} ms"
+              f"{r['constrained_ms']:>11.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='path_engine build and route times')
+    parser.add_argument('--switches', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--degree', type=int, default=4)
+    parser.add_argument('--pairs', type=int, default=1000)
+    parser.add_argument('--wl-every', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.switches, args.degree, args.pairs, args.wl_every, args.runs, args.seed)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
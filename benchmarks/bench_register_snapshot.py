@@ -0,0 +1,147 @@
+"""
+Register snapshot benchmark: MAX_REGISTER_ENTRIES slots x the MyIngress.reg_* registers.
+
+The register list and widths are taken from p4src/advanced_tunnel.p4. A fake switch
+answers ReadRegisterArrays from pre-built ReadResponses, so the numbers cover decoding
+only, not the gRPC transport; with --include-parse every read also parses the serialized
+response (this dominates with the pure-Python protobuf backend). The baseline decodes
+the same responses cell by cell with int.from_bytes, as the per-index ReadRegisters path does.
+
+Usage:
+    python3 bench_register_snapshot.py [--repeat 3] [--per-request 8] [--include-parse]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+import numpy as np
+from google.protobuf.internal import api_implementation
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from register_manager import RegisterManager
+
+P4_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../p4src/advanced_tunnel.p4')
+
+
+class _P4InfoHelper:
+    def __init__(self, p4info):
+        self.p4info = p4info
+
+
+def build_p4info():
+    with open(P4_SOURCE) as f:
+        source = f.read()
+    size = int(re.search(r"#define\s+MAX_REGISTER_ENTRIES\s+(\d+)", source).group(1))
+    p4info = p4info_pb2.P4Info()
+    for i, (width, name) in enumerate(re.findall(
+            r"register\s*<\s*bit<(\d+)>\s*>\s*\(MAX_REGISTER_ENTRIES\)\s*(reg_\w+)\s*;", source)):
+        register = p4info.registers.add()
+        register.preamble.id = 369000000 + i
+        register.preamble.name = "MyIngress." + name
+        register.type_spec.bitstring.bit.bitwidth = int(width)
+        register.size = size
+    return p4info
+
+
+class FakeSwitch:
+    name = "s1"
+
+    def __init__(self, p4info, include_parse=False, seed=0):
+        self.include_parse = include_parse
+        self.requests = 0
+        rng = np.random.default_rng(seed)
+        self.cells = {}
+        for register in p4info.registers:
+            width = register.type_spec.bitstring.bit.bitwidth
+            nbytes = (width + 7) // 8
+            values = rng.integers(0, 1 << min(width, 62), size=register.size, dtype=np.int64)
+            self.cells[register.preamble.id] = [int(v).to_bytes(nbytes, 'big') for v in values]
+        self.serialized = {}
+
+    def touch(self, register_id, slots, rng):
+        nbytes = len(self.cells[register_id][0])
+        for slot in slots:
+            self.cells[register_id][slot] = int(rng.integers(0, 1 << 8)).to_bytes(nbytes, 'big')
+        self.serialized.clear()
+
+    def ReadRegisterArrays(self, register_ids):
+        self.requests += 1
+        key = tuple(register_ids)
+        if key not in self.serialized:
+            response = p4runtime_pb2.ReadResponse()
+            for register_id in register_ids:
+                for index, value in enumerate(self.cells[register_id]):
+                    entry = response.entities.add().register_entry
+                    entry.register_id = register_id
+                    entry.index.index = index
+                    entry.data.bitstring = value
+            self.serialized[key] = (response.SerializeToString(), response)
+        serialized, response = self.serialized[key]
+        yield p4runtime_pb2.ReadResponse.FromString(serialized) if self.include_parse else response
+
+
+def per_cell_decode(sw, manager):
+    values = {}
+    for register_id in manager.registers:
+        for response in sw.ReadRegisterArrays([register_id]):
+            for entity in response.entities:
+                entry = entity.register_entry
+                values[(entry.register_id, entry.index.index)] = int.from_bytes(entry.data.bitstring, 'big')
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Register snapshot throughput')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--per-request', type=int, default=8)
+    parser.add_argument('--include-parse', action='store_true', help='parse the serialized response on every read')
+    args = parser.parse_args()
+
+    p4info = build_p4info()
+    manager = RegisterManager(_P4InfoHelper(p4info), registers_per_request=args.per_request)
+    sw = FakeSwitch(p4info, include_parse=args.include_parse)
+    cells = manager.size * len(manager.registers)
+    print(f"{len(manager.registers)} registers x {manager.size} slots = {cells} cells, "
+          f"{manager.dtype.itemsize} bytes per slot, protobuf backend: {api_implementation.Type()}")
+
+    # Build the responses up front so that only parsing and decoding are timed
+    manager.snapshot(sw)
+    for register_id in manager.registers:
+        list(sw.ReadRegisterArrays([register_id]))
+
+    sw.requests = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        per_cell_decode(sw, manager)
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(f"{'per-cell int.from_bytes':<32} {elapsed * 1000:>9.1f} ms/snapshot  {cells / elapsed:>12.0f} cells/s"
+          f"  {sw.requests // args.repeat} requests")
+
+    sw.requests = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        previous = manager.snapshot(sw)
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(f"{'RegisterManager.snapshot':<32} {elapsed * 1000:>9.1f} ms/snapshot  {cells / elapsed:>12.0f} cells/s"
+          f"  {sw.requests // args.repeat} requests")
+
+    rng = np.random.default_rng(1)
+    for register_id in list(manager.registers)[:5]:
+        sw.touch(register_id, rng.choice(manager.size, size=100, replace=False), rng)
+    current = manager.snapshot(sw)
+    start = time.perf_counter()
+    diff = manager.diff(previous, current)
+    elapsed = time.perf_counter() - start
+    print(f"{'RegisterManager.diff':<32} {elapsed * 1000:>9.1f} ms  ({len(diff.slots)} slots, "
+          f"{len(diff.fields)} registers changed)")
+
+
+if __name__ == '__main__':
+    main()
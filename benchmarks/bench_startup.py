@@ -0,0 +1,151 @@
+"""
+Controller startup against fake P4Runtime switches: connection, master arbitration and
+pipeline installation (SetForwardingPipelineConfig + digest entry) of N switches, done
+the old way (one switch after the other, BMv2 JSON read and p4info copied per switch)
+and by SwitchConnectionManager (all switches at once, pipeline config built once).
+
+Each fake switch answers after the given RPC latency, scaled by up to --skew across the
+switches (the slowest one is (1 + skew) times the fastest): the serial startup grows with
+the sum of the latencies, the parallel one with the slowest switch.
+
+Without p4src/build, the p4info is reduced to the digest (bench_mitigation_latency) and
+a synthetic BMv2 JSON of --json-mb MB is pushed.
+
+Usage:
+    python3 bench_startup.py [--switches 12] [--arbitration-ms 20] [--pipeline-ms 100]
+        [--write-ms 2] [--skew 1.0] [--runs 3] [--json-mb 2]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+
+from bench_mitigation_latency import BMV2_JSON, load_helper
+from fake_p4runtime_switch import start_fake_switches
+
+PHASES = ('connect', 'arbitration', 'install')
+
+
+def bmv2_json(workdir, size_mb):
+    if os.path.exists(BMV2_JSON):
+        return BMV2_JSON
+    path = os.path.join(workdir, 'advanced_tunnel.json')
+    with open(path, 'w') as f:
+        json.dump({"program": "advanced_tunnel.p4", "padding": "x" * int(size_mb * 1024 * 1024)}, f)
+    return path
+
+
+def serial_startup(manager):
+    """create_connections / update_master / install_p4_program as they were: a loop over the switches."""
+    import p4runtime_lib.bmv2
+
+    timings = {}
+    started = time.perf_counter()
+    for i in range(manager.switch_count):
+        switch_name = f's{i + 1}'
+        manager.switches[i] = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            name=switch_name, address=f'{manager.host}:{manager.base_port + i + 1}', device_id=i + 1,
+            proto_dump_file=f'../p4src/logs/{switch_name}-p4runtime-requests.p4rtlog')
+    timings['connect'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for switch in manager.switches.values():
+        switch.MasterArbitrationUpdate()
+    timings['arbitration'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for switch in manager.switches.values():
+        switch.SetForwardingPipelineConfig(p4info=manager.p4info_helper.p4info,
+                                           bmv2_json_file_path=manager.bmv2_file_path)
+        manager.sendDigestEntry(sw=switch, digest_name="congestion_digest_t")
+    timings['install'] = time.perf_counter() - started
+    return timings
+
+
+def parallel_startup(manager):
+    manager.create_connections()
+    manager.update_master()
+    manager.install_p4_program()
+    return {phase: manager.timings[phase]['total_s'] for phase in PHASES}
+
+
+def run(switches=12, arbitration_ms=20.0, pipeline_ms=100.0, write_ms=2.0, skew=1.0, runs=3, json_mb=2.0,
+        base_port=54050):
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections, connections
+    from switch_connection_manager import SwitchConnectionManager
+
+    results = {'serial': [], 'parallel': []}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # SwitchConnectionManager writes its request logs to ../p4src/logs
+        os.makedirs(os.path.join(workdir, 'p4src', 'logs'))
+        os.makedirs(os.path.join(workdir, 'src'))
+        os.chdir(os.path.join(workdir, 'src'))
+        helper = load_helper(workdir)
+        json_path = bmv2_json(workdir, json_mb)
+        servers = start_fake_switches(helper.p4info, switches, base_port=base_port)
+        for i, (_, fake) in enumerate(servers):
+            scale = 1.0 + skew * i / max(1, switches - 1)
+            fake.latency = {'StreamChannel.arbitration': arbitration_ms / 1000 * scale,
+                            'SetForwardingPipelineConfig': pipeline_ms / 1000 * scale,
+                            'Write': write_ms / 1000 * scale}
+        try:
+            for _ in range(runs):
+                for mode, startup in (('serial', serial_startup), ('parallel', parallel_startup)):
+                    manager = SwitchConnectionManager(helper, json_path, switches, base_port=base_port)
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        timings = startup(manager)
+                    timings['total'] = sum(timings[phase] for phase in PHASES)
+                    results[mode].append(timings)
+                    ShutdownAllSwitchConnections()
+                    connections.clear()
+        finally:
+            for server, _ in servers:
+                server.stop(None)
+            os.chdir(cwd)
+    slowest = (arbitration_ms + pipeline_ms + write_ms) * (1.0 + skew) / 1000
+    return {'switches': switches, 'slowest_switch_s': slowest,
+            'median': {mode: {phase: statistics.median(t[phase] for t in samples)
+                              for phase in PHASES + ('total',)}
+                       for mode, samples in results.items()},
+            'runs': results}
+
+
+def report(result):
+    print(f"{result['switches']} switches, slowest switch {result['slowest_switch_s'] * 1000:.0f} ms of RPC latency")
+    print(f"{'':<10}" + ''.join(f"{phase:>14}" for phase in PHASES + ('total',)))
+    for mode, phases in result['median'].items():
+        print(f"{mode:<10}" + ''.join(f"{phases[phase] * 1000:>11.1f} ms" for phase in PHASES + ('total',)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial vs parallel controller startup')
+    parser.add_argument('--switches', type=int, default=12)
+    parser.add_argument('--arbitration-ms', type=float, default=20.0)
+    parser.add_argument('--pipeline-ms', type=float, default=100.0)
+    parser.add_argument('--write-ms', type=float, default=2.0)
+    parser.add_argument('--skew', type=float, default=1.0)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--json-mb', type=float, default=2.0)
+    parser.add_argument('--base-port', type=int, default=54050)
+    parser.add_argument('-o', '--output', help='write the medians and the per-run timings as JSON')
+    args = parser.parse_args()
+
+    result = run(args.switches, args.arbitration_ms, args.pipeline_ms, args.write_ms, args.skew, args.runs,
+                 args.json_mb, args.base_port)
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
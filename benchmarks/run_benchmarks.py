@@ -0,0 +1,474 @@
+"""
+Microbenchmark suite for the controller hot paths, with JSON results and a compare mode.
+
+Fixtures come from the real inputs: the compiled p4info (p4src/build, run `make`),
+p4src/topology.json and examples/rules_example.txt, scaled with --tunnels (routes and
+installed entries), --hosts/--switches (synthetic topologies) and --wl-entries (level
+table entries per WL). Table reads and upserts go to a fake P4Runtime switch
+(utils/fake_p4runtime_switch.py). Benchmarks whose imports or fixtures are not available
+are recorded as skipped with the reason.
+
+Usage:
+    python3 run_benchmarks.py [-o results.json] [--tunnels 64] [--hosts 50] [--wl-entries 64] [-k upsert]
+    python3 run_benchmarks.py --tree /path/to/other/checkout -o base.json   # same suite, other sources
+    python3 run_benchmarks.py --commit HEAD~1 -o base.json                  # via a temporary git worktree
+    python3 run_benchmarks.py compare base.json results.json [--threshold 0.10]
+
+compare exits with status 1 when a benchmark's median got slower by more than the threshold.
+"""
+
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+
+class Skip(Exception):
+    pass
+
+
+def measure(fn, repeat=5, min_time=0.2):
+    """Per-call times in µs: calls are batched until a batch lasts min_time, `repeat` batches."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    samples = [s * 1e6 for s in samples]
+    return {'median_us': statistics.median(samples), 'min_us': min(samples),
+            'stdev_us': statistics.pstdev(samples), 'calls': number * repeat}
+
+
+# ---------------------------------------------------------------------------- fixtures
+
+class Context:
+    def __init__(self, args):
+        self.args = args
+        self.tree = os.path.abspath(args.tree or os.path.join(HERE, '..'))
+        self.src = os.path.join(self.tree, 'src')
+        # Build outputs are not versioned: fall back to this checkout's p4info for worktrees
+        self.p4info_path = args.p4info or next(
+            (path for path in (os.path.join(root, 'p4src/build/advanced_tunnel.p4.p4info.txt')
+                               for root in (self.tree, os.path.join(HERE, '..'))) if os.path.exists(path)),
+            os.path.join(self.tree, 'p4src/build/advanced_tunnel.p4.p4info.txt'))
+        self._helper = None
+        self._fake = None
+        self._servers = []
+        self.workdir = tempfile.mkdtemp(prefix='p4orch-bench-')
+
+    @property
+    def helper(self):
+        if self._helper is None:
+            if not os.path.exists(self.p4info_path):
+                raise Skip(f"{self.p4info_path} not found, run make in p4src")
+            import p4runtime_lib.helper
+            self._helper = p4runtime_lib.helper.P4InfoHelper(self.p4info_path)
+        return self._helper
+
+    def switch(self):
+        """A SwitchConnection to a fresh fake switch."""
+        from fake_p4runtime_switch import start_fake_switches
+        from p4runtime_lib.switch import SwitchConnection
+
+        port = self.args.base_port + len(self._servers)
+        [(server, fake)] = start_fake_switches(self.helper.p4info, 1, base_port=port)
+        self._servers.append(server)
+        sw = SwitchConnection(name=fake.name, address=f'127.0.0.1:{port + 1}', device_id=1, proto_dump_file=None)
+        sw.MasterArbitrationUpdate()
+        sw.WritePREEntry(self.helper.buildMCEntry(multicast_group_id=1, replicas=[]))
+        return sw, fake
+
+    def rules(self):
+        """rules_example.txt scaled to --tunnels routes and --wl-entries entries per WL."""
+        with open(os.path.join(self.tree, 'examples/rules_example.txt')) as f:
+            rules = json.load(f)
+        routes = list(rules['shortest_paths_constrained'].items())
+        rules['shortest_paths_constrained'] = {
+            f"{i // 100 + 1},{i % 100 + 2}": routes[i % len(routes)][1] for i in range(self.args.tunnels)}
+        for wl, entries in rules['table_entries'].items():
+            scaled = []
+            for i in range(self.args.wl_entries):
+                entry = copy.deepcopy(entries[i % len(entries)])
+                entry['match_fields'][0] += 1000 * (i // len(entries))
+                scaled.append(entry)
+            rules['table_entries'][wl] = scaled
+        return rules
+
+    def topology(self, hosts=None, switches=None):
+        """topology.json, or a ring of `switches` switches with chords and `hosts` hosts."""
+        if hosts is None:
+            with open(os.path.join(self.tree, 'p4src/topology.json')) as f:
+                return json.load(f)
+        topology = {'hosts': {}, 'switches': {f's{i}': {} for i in range(1, switches + 1)}, 'links': []}
+        next_port = {s: 1 for s in topology['switches']}
+
+        def port(s):
+            next_port[s] += 1
+            return next_port[s] - 1
+
+        for h in range(1, hosts + 1):
+            s = f's{(h - 1) % switches + 1}'
+            topology['hosts'][f'h{h}'] = {'ip': f'10.0.{h // 250}.{h % 250 + 1}/24', 'mac': f'08:00:00:00:{h >> 8:02x}:{h & 0xFF:02x}'}
+            topology['links'].append([f'h{h}', f'{s}-p{port(s)}'])
+        for i in range(1, switches + 1):
+            for j in (i % switches + 1, (i + switches // 2 - 1) % switches + 1):
+                if j != i and not any(link[0].startswith(f's{j}-') and link[1].startswith(f's{i}-')
+                                      for link in topology['links']):
+                    topology['links'].append([f's{i}-p{port(f"s{i}")}', f's{j}-p{port(f"s{j}")}'])
+        return topology
+
+    def close(self):
+        for server in self._servers:
+            server.stop(None)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# ---------------------------------------------------------------------------- benchmarks
+
+@benchmark('convert.encode[mac]')
+def bench_encode_mac(ctx):
+    from p4runtime_lib.convert import encode
+    return measure(lambda: encode('08:00:00:00:01:11', 48))
+
+
+@benchmark('convert.encode[ipv4]')
+def bench_encode_ipv4(ctx):
+    from p4runtime_lib.convert import encode
+    return measure(lambda: encode('10.0.1.1', 32))
+
+
+@benchmark('convert.encode[int]')
+def bench_encode_int(ctx):
+    from p4runtime_lib.convert import encode
+    return measure(lambda: encode(12345, 32))
+
+
+@benchmark('buildTableEntry[myTunnel_exact]')
+def bench_build_tunnel(ctx):
+    helper = ctx.helper
+    return measure(lambda: helper.buildTableEntry(
+        table_name='MyIngress.myTunnel_exact', match_fields={'hdr.myTunnel.dst_id': 1678},
+        action_name='MyIngress.myTunnel_forward', action_params={'port': 2}))
+
+
+@benchmark('buildTableEntry[level1]')
+def bench_build_level(ctx):
+    helper = ctx.helper
+    return measure(lambda: helper.buildTableEntry(
+        table_name='MyIngress.level1',
+        match_fields={'meta.node_id': 0, 'meta.prevFeature': 0, 'meta.isTrue': 1},
+        action_name='MyIngress.CheckFeature', action_params={'node_id': 12, 'f_inout': 1, 'threshold': 6}))
+
+
+def _tunnel_entry(helper, tunnel_id):
+    return helper.buildTableEntry(table_name='MyIngress.myTunnel_exact',
+                                  match_fields={'hdr.myTunnel.dst_id': tunnel_id},
+                                  action_name='MyIngress.myTunnel_forward', action_params={'port': 2})
+
+
+@benchmark('upsertRule[modify, N tunnels installed]')
+def bench_upsert(ctx):
+    helper = ctx.helper
+    sw, _ = ctx.switch()
+    for tunnel_id in range(1, ctx.args.tunnels + 1):
+        sw.WriteTableEntry(_tunnel_entry(helper, tunnel_id))
+    # Worst case for the linear scan: the last installed entry
+    entry = _tunnel_entry(helper, ctx.args.tunnels)
+    with quiet():
+        return measure(lambda: helper.upsertRule(sw, 'MyIngress.myTunnel_exact', ctx.args.tunnels, entry))
+
+
+@benchmark('upsertRuleMultipleMatch[modify, N WL entries installed]')
+def bench_upsert_multiple(ctx):
+    helper = ctx.helper
+    sw, _ = ctx.switch()
+    entries = ctx.rules()['table_entries']['6']
+    built = []
+    for e in entries:
+        match = dict(zip(['meta.node_id', 'meta.prevFeature', 'meta.isTrue'], e['match_fields']))
+        names = ['node_id', 'f_inout', 'threshold'] if e['action'] == 'MyIngress.CheckFeature' else ['node_id', 'class']
+        entry = helper.buildTableEntry(table_name=e['table'], match_fields=match, action_name=e['action'],
+                                       action_params=dict(zip(names, e['action_params'])))
+        with contextlib.suppress(Exception):
+            sw.WriteTableEntry(entry)
+        built.append((e['table'], match, entry))
+    table, match, entry = built[-1]
+    with quiet():
+        return measure(lambda: helper.upsertRuleMultipleMatch(sw, table, match, entry))
+
+
+@benchmark('TableManager.read_table_rules[N tunnels installed]')
+def bench_read_table_rules(ctx):
+    from routing_table_manager import TableManager
+    helper = ctx.helper
+    sw, _ = ctx.switch()
+    for tunnel_id in range(1, ctx.args.tunnels + 1):
+        sw.WriteTableEntry(_tunnel_entry(helper, tunnel_id))
+    manager = TableManager(helper)
+    return measure(lambda: manager.read_table_rules(sw))
+
+
+@benchmark('DigestManager.handle_digest_for_switch')
+def bench_handle_digest(ctx):
+    from bench_digest_throughput import build_digest, _Switch
+    from digest_manager import DigestManager
+
+    manager = DigestManager(None, {}, filename=os.path.join(ctx.workdir, 'digest.xlsx'),
+                            filename_time=os.path.join(ctx.workdir, 'digest_time.xlsx'))
+    manager.save_to_excel = lambda *args, **kwargs: None
+    messages = [build_digest(67 + flow, flow) for flow in range(ctx.args.tunnels)]
+    switch = _Switch()
+    counter = iter(range(1 << 62))
+    try:
+        with quiet():
+            return measure(lambda: manager.handle_digest_for_switch(
+                switch, messages[next(counter) % len(messages)], time.time()))
+    finally:
+        manager.stop_excel_thread()
+
+
+@benchmark('ArpManager.handle_packet_for_switch[broadcast, rules cached]')
+def bench_handle_arp(ctx):
+    from arp_manager import ArpManager
+    from bench_message_load import Workload
+
+    sw, fake = ctx.switch()
+    manager = ArpManager(ctx.helper, {0: sw})
+    workload = Workload([sw.name], 1, 1, 0.0, 1.0)
+    messages = [fake.build_packet_in(workload.arp_frame()[1], {'ingress_port': 1}) for _ in range(16)]
+    counter = iter(range(1 << 62))
+    with quiet():
+        for message in messages:
+            manager.handle_packet_for_switch(sw, message)  # rules installed once
+        return measure(lambda: manager.handle_packet_for_switch(sw, messages[next(counter) % len(messages)]))
+
+
+@benchmark('extract_info[N tunnels, WL entries]')
+def bench_extract_info(ctx):
+    cwd = os.getcwd()
+    try:
+        # imported from src/ as under uvicorn; the topology comes from the shared Topology (config.py)
+        os.chdir(ctx.src)
+        with quiet():
+            import rest_api
+    except ImportError as e:
+        raise Skip(f"rest_api not importable: {e}")
+    finally:
+        os.chdir(cwd)
+    import logging
+    import types
+    logging.getLogger().setLevel(logging.WARNING)
+    # a controller whose WL install is a no-op: without it every call logs the failed install
+    # with its traceback, and that would be most of what is measured
+    saved = rest_api.controller, rest_api.switches
+    rest_api.controller = types.SimpleNamespace(
+        WL_manager=types.SimpleNamespace(install_wl_rules=lambda wl_nodes, switches, colors=None: None))
+    rest_api.switches = {}
+    content = json.dumps(ctx.rules())
+    try:
+        return measure(lambda: rest_api.extract_info(content))
+    finally:
+        rest_api.controller, rest_api.switches = saved
+
+
+@benchmark('parse_topology[topology.json]')
+def bench_parse_topology(ctx):
+    from generate_config import parse_topology
+    topology = ctx.topology()
+    return measure(lambda: parse_topology(topology))
+
+
+@benchmark('parse_topology[synthetic]')
+def bench_parse_topology_synthetic(ctx):
+    from generate_config import parse_topology
+    topology = ctx.topology(ctx.args.hosts, ctx.args.switches)
+    return measure(lambda: parse_topology(topology))
+
+
+@benchmark('SpanningTree.build_tree[synthetic]')
+def bench_build_tree(ctx):
+    from generate_config import parse_topology
+    from spanningtree_manager import SpanningTree
+
+    _, switch_ports, _, _, _, _ = parse_topology(ctx.topology(ctx.args.hosts, ctx.args.switches))
+    cwd = os.getcwd()
+    os.chdir(ctx.workdir)  # log, figures and Excel report are written to the working directory
+    try:
+        with quiet():
+            tree = SpanningTree(switch_ports)
+            return measure(tree.build_tree, repeat=3, min_time=0.0)
+    finally:
+        os.chdir(cwd)
+
+
+@benchmark('PathEngine[synthetic]')
+def bench_path_engine(ctx):
+    from path_engine import PathEngine
+    from topology import Topology
+
+    topology = Topology.from_json(ctx.topology(ctx.args.hosts, ctx.args.switches))
+    return measure(lambda: PathEngine(topology.switches, topology.switch_ports), repeat=3, min_time=0.0)
+
+
+@benchmark('compute_routes[synthetic,constrained]')
+def bench_compute_routes(ctx):
+    from path_engine import compute_routes
+    from topology import Topology
+
+    topology = Topology.from_json(ctx.topology(ctx.args.hosts, ctx.args.switches))
+    pairs = [(a, b) for a in topology.hosts for b in topology.hosts if a < b][:ctx.args.tunnels]
+    via = list(range(1, topology.num_switches + 1, 3))
+    compute_routes(topology, pairs, via)  # engine cached by graph hash, as between two requests
+    return measure(lambda: compute_routes(topology, pairs, via))
+
+
+@benchmark('place[synthetic,3 colors]')
+def bench_place(ctx):
+    from placement_manager import place
+    from topology import Topology
+
+    topology = Topology.from_json(ctx.topology(ctx.args.hosts, ctx.args.switches))
+    pairs = [(a, b) for a in topology.hosts for b in topology.hosts if a < b][:ctx.args.tunnels]
+    return measure(lambda: place(topology, pairs, 3), repeat=3, min_time=0.0)
+
+
+# ---------------------------------------------------------------------------- driver
+
+def git_commit(tree):
+    with contextlib.suppress(Exception):
+        return subprocess.run(['git', '-C', tree, 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    return None
+
+
+def run_suite(args):
+    ctx = Context(args)
+    for path in (ctx.src, os.path.join(ctx.tree, 'utils'), HERE):
+        sys.path.insert(0, path)
+    # Older trees may lack the fake switch: take it from this checkout
+    sys.path.append(os.path.join(HERE, '../utils'))
+    results = {}
+    try:
+        for name, fn in BENCHMARKS:
+            if args.k and not any(k in name for k in args.k):
+                continue
+            try:
+                results[name] = fn(ctx)
+                print(f"{name:<60} {results[name]['median_us']:>12.2f} us")
+            except (Skip, ImportError, FileNotFoundError) as e:
+                results[name] = {'skipped': str(e)}
+                print(f"{name:<60} {'skipped':>12}  ({e})")
+    finally:
+        ctx.close()
+    return {
+        'meta': {'commit': git_commit(ctx.tree), 'tree': ctx.tree, 'python': platform.python_version(),
+                 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'params': {'tunnels': args.tunnels, 'hosts': args.hosts, 'switches': args.switches,
+                            'wl_entries': args.wl_entries}},
+        'results': results,
+    }
+
+
+def run_at_commit(args):
+    """Runs this suite on the sources of another commit, checked out in a temporary worktree."""
+    repo = os.path.join(HERE, '..')
+    worktree = tempfile.mkdtemp(prefix='p4orch-worktree-')
+    subprocess.run(['git', '-C', repo, 'worktree', 'add', '--detach', worktree, args.commit], check=True)
+    try:
+        args.tree = worktree
+        return run_suite(args)
+    finally:
+        subprocess.run(['git', '-C', repo, 'worktree', 'remove', '--force', worktree], check=False)
+
+
+def compare(base_path, new_path, threshold):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base {base['meta'].get('commit')}  ->  new {new['meta'].get('commit')}  (threshold {threshold:.0%})")
+    if base['meta'].get('params') != new['meta'].get('params'):
+        print(f"warning: different parameters {base['meta'].get('params')} vs {new['meta'].get('params')}")
+    regressions = 0
+    for name in sorted(set(base['results']) | set(new['results'])):
+        old, cur = base['results'].get(name, {}), new['results'].get(name, {})
+        if 'median_us' not in old or 'median_us' not in cur:
+            print(f"{name:<60} {'n/a':>12}")
+            continue
+        change = cur['median_us'] / old['median_us'] - 1
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif change < -threshold:
+            flag = 'improved'
+        print(f"{name:<60} {old['median_us']:>10.2f} -> {cur['median_us']:>10.2f} us  {change:>+7.1%}  {flag}")
+    return regressions
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+        parser.add_argument('base')
+        parser.add_argument('new')
+        parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown flagged, 0.10 = 10%%')
+        args = parser.parse_args(sys.argv[2:])
+        sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+
+    parser = argparse.ArgumentParser(description='Controller hot path microbenchmarks')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('-k', action='append', help='only benchmarks whose name contains this (repeatable)')
+    parser.add_argument('--tunnels', type=int, default=64)
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--switches', type=int, default=12)
+    parser.add_argument('--wl-entries', type=int, default=64)
+    parser.add_argument('--p4info', help='default: <tree>/p4src/build/advanced_tunnel.p4.p4info.txt')
+    parser.add_argument('--tree', help='checkout whose src/ and utils/ are benchmarked (default: this one)')
+    parser.add_argument('--commit', help='benchmark this commit in a temporary git worktree')
+    parser.add_argument('--base-port', type=int, default=52050)
+    args = parser.parse_args()
+
+    results = run_at_commit(args) if args.commit else run_suite(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
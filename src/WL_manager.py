@@ -7,10 +7,12 @@ class WLManager:
         self.switches = switches
         self.isWLGauge = Gauge('weak_learner', 'weak learner', ['switch'])
 
-    def install_wl_rules(self, wl_nodes, switches):
+    def install_wl_rules(self, wl_nodes, switches, colors=None):
         """
         Install the rules on the 'WL_table' table. If a switch is a WL (i.e., it is in the wl_nodes list),
         install a rule with flag = 1. Otherwise, install a rule with flag = 0.
+        colors: {device id: color} of the WLs (e.g. the deployment of POST /placement); without it
+        the WLs get the colors 1, 2, ... in the order of switches.
         """
         i = 1
         for switch in switches.values():
@@ -25,7 +27,7 @@ class WLManager:
                         match_fields={"meta.color": 00},
                         action_name="MyIngress.set_color",
 
-                        action_params={"color_n": i}
+                        action_params={"color_n": colors.get(switch.device_id, i) if colors else i}
                     )
                     print(table_entry)
                     self.p4info_helper.upsertRule(switch, "MyIngress.color_table", 0, table_entry)
@@ -4,8 +4,6 @@ import threading
 import binascii
 import socket
 import re
-from scapy.all import Ether
-from tabulate import tabulate
 import ipaddress
 from collections import deque
 import time
@@ -131,6 +129,8 @@ class ArpManager:
         try:
             if not hasattr(packet, "payload") or not packet.payload:
                 raise ValueError("The packet does not contain a valid payload")
+            # imported on the first packet-in (or by preload_heavy_modules), not at controller startup
+            from scapy.all import Ether
             pkt = Ether(_pkt=packet.payload)
             print(f"Parsed Ethernet packet")
 
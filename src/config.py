@@ -1,13 +1,23 @@
+"""
+Tables of the network topology, shared by all the managers (see topology.py).
+
+They are the dicts of the process-wide Topology: /topology/reload updates them in place,
+so import them (from config import SWITCH_PORTS) and never rebind them. NUM_SWITCHES and
+NUM_PORTS are the values at startup. TREE is filled by SpanningTree.
+"""
+from topology import get_topology
+
+_topology = get_topology()
 
 # Define the host and switch port mappings
-HOST_TO_PORT = {'s1': 1, 's2': 2, 's3': 3, 's4': 4, 's5': 5}
+HOST_TO_PORT = _topology.host_to_port
 
-SWITCH_PORTS = {'s1': {'s6': 6, 'h1': 1}, 's2': {'s7': 7, 'h2': 2}, 's3': {'s8': 8, 'h3': 3}, 's4': {'s9': 9, 'h4': 4}, 's5': {'s10': 10, 'h5': 5}, 's6': {'s1': 1, 's7': 7, 's8': 8, 's10': 10}, 's7': {'s2': 2, 's6': 6, 's8': 8, 's11': 11, 's9': 9}, 's8': {'s3': 3, 's6': 6, 's7': 7, 's12': 12}, 's9': {'s4': 4, 's7': 7, 's10': 10}, 's10': {'s5': 5, 's6': 6, 's12': 12, 's9': 9}, 's11': {'s7': 7, 's12': 12}, 's12': {'s11': 11, 's8': 8, 's10': 10}}
+SWITCH_PORTS = _topology.switch_ports
 
 # Define the MAC and IP address mappings for hosts
-MAC_IP_MAPPING = {1: ('08:00:00:00:01:11', '10.0.1.1'), 2: ('08:00:00:00:02:22', '10.0.1.2'), 3: ('08:00:00:00:03:33', '10.0.1.3'), 4: ('08:00:00:00:04:44', '10.0.1.4'), 5: ('08:00:00:00:05:55', '10.0.1.5')}
+MAC_IP_MAPPING = _topology.mac_ip_mapping
 
-NUM_SWITCHES = 12
-NUM_PORTS = 12
+NUM_SWITCHES = _topology.num_switches
+NUM_PORTS = _topology.num_ports
 
 TREE = {}
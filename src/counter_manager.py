@@ -1,40 +1,61 @@
-from prometheus_client import Counter, Gauge
+from flow_state import CounterStateStore, CounterStateCollector, register_collector
+import numpy as np
+import asyncio
+import logging
 import time
 
+logger = logging.getLogger(__name__)
+
+# Counter arrays read by the poller: tunnel counters are indexed by tunnel_id, the others by port
+TUNNEL_COUNTERS = {
+    "MyIngress.ingressTunnelCounter": ("ingress_packets", "ingress_bytes", "ingress_packet_rate", "ingress_byte_rate"),
+    "MyIngress.egressTunnelCounter": ("egress_packets", "egress_bytes", "egress_packet_rate", "egress_byte_rate"),
+}
+PORT_COUNTERS = ["MyIngress.IngressPacketCount", "MyIngress.totalByteCount"]
+
+
+class CounterArrayState:
+    """Last snapshot of one counter array on one switch."""
+
+    def __init__(self, size):
+        self.packets = np.zeros(size, dtype=np.int64)
+        self.bytes = np.zeros(size, dtype=np.int64)
+        self.active = np.zeros(size, dtype=bool)  # indices whose last published rate was non zero
+        self.timestamp = None
+
 
 class CounterManager:
-    def __init__(self, p4info_helper):
+    def __init__(self, p4info_helper, poll_interval=5.0, max_poll_interval=60.0, poll_load=0.25):
+        """
+        poll_interval: minimum time between two full polls (s).
+        max_poll_interval: upper bound of the adaptive interval (s).
+        poll_load: target fraction of time spent polling; when a full poll takes longer than
+                   poll_load * poll_interval the interval is stretched accordingly.
+        """
         self.p4info_helper = p4info_helper
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_load = poll_load
+        self.current_interval = poll_interval
+        self.last_poll_duration = None
+        self.array_state = {}  # {(switch, counter): CounterArrayState}
 
-        # Definition of Prometheus counters
-        # Number of packets
-        self.ingress_tunnel_packet_count = Gauge(
-            'ingress_tunnel_packet_count',
-            'Ingress Tunnel Packet Count',
-            ['switch', 'tunnel_id']
-        )
-        self.egress_tunnel_packet_count = Gauge(
-            'egress_tunnel_packet_count',
-            'Egress Tunnel Packet Count',
-            ['switch', 'tunnel_id']
-        )
-        # Bytes
-        self.ingress_tunnel_byte_count = Gauge('ingress_tunnel_byte_count', 'Numero di byte ingressi per tunnel',
-                                               ['switch', 'tunnel_id'])
-        self.egress_tunnel_byte_count = Gauge('egress_tunnel_byte_count', 'Numero di byte egressi per tunnel',
-                                              ['switch', 'tunnel_id'])
-        # Definition of Prometheus counters
+        # Counter values are kept in per-(switch, tunnel) records and exported at scrape time
+        self.counter_state = CounterStateStore()
+        register_collector(CounterStateCollector(self.counter_state))
 
     def update_prometheus_counters(self, sw, counter_name, tunnel_id, packet_count, byte_count):
         """
         Aggiorna i contatori Prometheus
         """
         if counter_name == "MyIngress.ingressTunnelCounter":
-            self.ingress_tunnel_packet_count.labels(sw.name, tunnel_id).set(packet_count)
-            self.ingress_tunnel_byte_count.labels(sw.name, tunnel_id).set(byte_count)
+            record = self.counter_state.tunnel(sw.name, tunnel_id)
+            record.ingress_packets = packet_count
+            record.ingress_bytes = byte_count
         elif counter_name == "MyIngress.egressTunnelCounter":
-            self.egress_tunnel_packet_count.labels(sw.name, tunnel_id).set(packet_count)
-            self.egress_tunnel_byte_count.labels(sw.name, tunnel_id).set(byte_count)
+            record = self.counter_state.tunnel(sw.name, tunnel_id)
+            record.egress_packets = packet_count
+            record.egress_bytes = byte_count
 
     def update_counter(self, sw, counter_name, index):
         """
@@ -42,28 +63,122 @@ class CounterManager:
         """
         tunnel_id_int = int(index)
         for response in sw.ReadCounters(self.p4info_helper.get_counters_id(counter_name), tunnel_id_int):
-            print(f"Reading counter {counter_name} for tunnel_id {tunnel_id_int} on switch {sw.name}")
-            print(f"Response: {response}")
             for entity in response.entities:
                 counter = entity.counter_entry
-                egress_port = counter.index
                 packet_count = counter.data.packet_count
                 byte_count = counter.data.byte_count
-                print(f"Packet count: {packet_count}")
 
                 # Update Prometheus counters
                 self.update_prometheus_counters(sw, counter_name, tunnel_id_int, packet_count, byte_count)
 
-    def monitor_tunnel_counters(self, switches, tunnel_ids):
+    def read_counter_array(self, sw, counter_name):
+        """
+        Reads a whole counter array with a single wildcard read.
+        Returns dense (packets, bytes) int64 arrays of the counter size. A failed read
+        raises (ReadCounters would print the error and return nothing, i.e. all zeros),
+        so the previous snapshot is kept and the next poll computes the right delta.
+        """
+        counter_info = self.p4info_helper.get("counters", name=counter_name)
+        size = counter_info.size
+        entries = [entity.counter_entry
+                   for response in sw.ReadCounterArray(counter_info.preamble.id)
+                   for entity in response.entities]
+
+        index = np.fromiter((e.index.index for e in entries), dtype=np.int64, count=len(entries))
+        packets = np.zeros(size, dtype=np.int64)
+        byte_counts = np.zeros(size, dtype=np.int64)
+        packets[index] = np.fromiter((e.data.packet_count for e in entries), dtype=np.int64, count=len(entries))
+        byte_counts[index] = np.fromiter((e.data.byte_count for e in entries), dtype=np.int64, count=len(entries))
+        return packets, byte_counts
+
+    def process_counter_array(self, sw, counter_name, packets, byte_counts, timestamp):
+        """
+        Computes per-index deltas and rates against the previous snapshot and publishes
+        only the indices whose value or rate changed. Returns the number of published indices.
+        """
+        key = (sw.name, counter_name)
+        state = self.array_state.get(key)
+        if state is None:
+            state = self.array_state[key] = CounterArrayState(len(packets))
+
+        if state.timestamp is None:
+            changed = np.flatnonzero((packets != 0) | (byte_counts != 0))
+            packet_rate = byte_rate = np.zeros(len(packets))
+        else:
+            elapsed = max(timestamp - state.timestamp, 1e-6)
+            delta_packets = packets - state.packets
+            delta_bytes = byte_counts - state.bytes
+            # A counter going backwards means it was reset (switch restart or pipeline reload)
+            reset = (delta_packets < 0) | (delta_bytes < 0)
+            delta_packets = np.where(reset, packets, delta_packets)
+            delta_bytes = np.where(reset, byte_counts, delta_bytes)
+            packet_rate = delta_packets / elapsed
+            byte_rate = delta_bytes / elapsed
+
+            moving = (delta_packets != 0) | (delta_bytes != 0)
+            # Indices that stopped moving are published once more so their rate drops to 0
+            changed = np.flatnonzero(moving | state.active)
+            state.active = moving
+
+        state.packets = packets
+        state.bytes = byte_counts
+        state.timestamp = timestamp
+
+        if len(changed) == 0:
+            return 0
+
+        values = zip(changed.tolist(), packets[changed].tolist(), byte_counts[changed].tolist(),
+                     packet_rate[changed].tolist(), byte_rate[changed].tolist())
+        if counter_name in TUNNEL_COUNTERS:
+            packets_attr, bytes_attr, packet_rate_attr, byte_rate_attr = TUNNEL_COUNTERS[counter_name]
+            for index, pkt, byt, pkt_rate, byt_rate in values:
+                record = self.counter_state.tunnel(sw.name, index)
+                setattr(record, packets_attr, pkt)
+                setattr(record, bytes_attr, byt)
+                setattr(record, packet_rate_attr, pkt_rate)
+                setattr(record, byte_rate_attr, byt_rate)
+        else:
+            short_name = counter_name.split(".")[-1]
+            for index, pkt, byt, pkt_rate, byt_rate in values:
+                record = self.counter_state.port(sw.name, short_name, index)
+                record.packets = pkt
+                record.bytes = byt
+                record.packet_rate = pkt_rate
+                record.byte_rate = byt_rate
+        return len(changed)
+
+    def _poll_switch_counter(self, sw, counter_name):
+        packets, byte_counts = self.read_counter_array(sw, counter_name)
+        return self.process_counter_array(sw, counter_name, packets, byte_counts, time.time())
+
+    async def poll_once(self, switches):
+        """One wildcard read per switch per counter, all issued concurrently."""
+        counter_names = list(TUNNEL_COUNTERS) + PORT_COUNTERS
+        jobs = [(sw, name) for sw in switches.values() for name in counter_names]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._poll_switch_counter, sw, name) for sw, name in jobs),
+            return_exceptions=True)
+
+        published = 0
+        for (sw, name), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                logger.warning("Counter poll of %s on %s failed: %s", name, sw.name, result)
+            else:
+                published += result
+        return published
+
+    async def monitor_tunnel_counters(self, switches):
         """
-        Esegue il monitoraggio continuo dei contatori di pacchetti dagli switch.
+        Esegue il monitoraggio continuo dei contatori degli switch.
+        The interval grows when a full poll takes more than poll_load of it, and goes
+        back to poll_interval when polls get fast again.
         """
         while True:
-            # print('\n----- Monitoring Tunnel Counters -----')
-            for tunnel_id in tunnel_ids:
-                # print(f'Tunnel ID: {tunnel_id}')
-                for switch in switches.values():
-                    print(f'Switch: {switch}')
-                    self.update_counter(switch, "MyIngress.ingressTunnelCounter", tunnel_id)
-                    self.update_counter(switch, "MyIngress.egressTunnelCounter", tunnel_id)
-            time.sleep(5)
+            start = time.perf_counter()
+            published = await self.poll_once(switches)
+            self.last_poll_duration = time.perf_counter() - start
+            self.current_interval = min(self.max_poll_interval,
+                                        max(self.poll_interval, self.last_poll_duration / self.poll_load))
+            logger.debug("Counter poll: %d entries updated in %.3f s, next in %.1f s",
+                         published, self.last_poll_duration, self.current_interval)
+            await asyncio.sleep(max(0.0, self.current_interval - self.last_poll_duration))
@@ -1,18 +1,18 @@
 from config import SWITCH_PORTS, HOST_TO_PORT, MAC_IP_MAPPING, TREE
-from prometheus_client import Gauge
+from flow_state import FlowStateStore, FlowStateCollector, register_collector
+from timeseries_store import TimeSeriesStore
+from latency_metrics import LATENCY
+from startup_profile import STARTUP
 import threading
 import queue
 import binascii
 import socket
 import re
-from scapy.all import Ether
-from tabulate import tabulate
 import ipaddress
 from collections import deque
 import time
 from concurrent.futures import ThreadPoolExecutor
 import math
-import pandas as pd
 import os
 import json
 import logging
@@ -22,18 +22,21 @@ logger = logging.getLogger(__name__)
 
 class DigestManager:
 
-    def __init__(self, p4info_helper, switches, filename="digest_data.xlsx", filename_time="digest_data_time.xlsx"):
+    def __init__(self, p4info_helper, switches, filename="digest_data.xlsx", filename_time="digest_data_time.xlsx",
+                 timeseries=None):
         self.filename = filename
         self.filename_time = filename_time
-        self.clear_excel_file()
         self.queue_data = {}
         self.lock = threading.Lock()
         self.threads = []
         self.running = True
         self.p4info_helper = p4info_helper
         self._excel_queue = queue.Queue()
+        # pandas is imported by the writer thread on the first digest, not on the startup path
+        self._excel_queue.put({"type": "clear"})
         self._excel_thread = threading.Thread(target=self._excel_writer_thread, daemon=True)
         self._excel_running = True
+        self._excel_cleared = False
         self._excel_thread.start()
         self.switches = switches
 
@@ -41,34 +44,27 @@ class DigestManager:
         self.arp_rules = {sw: {} for sw in switches.values()}
 
         self.bcast = "ff:ff:ff:ff:ff:ff"  # broadcast
-        self.switch_port_queue_depth = Gauge('switch_port_queue_depth',
-                                             'Coda di congestione per switch e porta',
-                                             ['switch', 'port', 'flow'])
-        self.tunnel_id_gauge = Gauge('tunnel_id', 'ID del tunnel', ['switch', 'port'])
-        self.switch_time_gauge = Gauge('switch_time', 'Tempo di switch', ['switch', 'flow'])
-        self.interarrival_time_gauge = Gauge('interarrival_time', 'Tempo di interarrivo tra pacchetti in ms',
-                                             ['switch', 'flow'])
-        self.packet_length_gauge = Gauge('packet_length', 'Lunghezza del pacchetto in Byte', ['switch', 'flow'])
-        self.queue_time_gauge = Gauge('queue_time', 'Tempo di attesa in coda', ['switch', 'port', 'flow'])
-        self.sending_rate_gauge = Gauge('sending_rate', 'sending rate in bps', ['switch', 'flow'])
-        self.digest_timestamp_gauge = Gauge('digest_timestamp', 'digest timestamp', ['switch', 'flow'])
-        self.last_timestamp_gauge = Gauge('last_digest_timestamp', 'last digest timestamp', ['switch', 'flow'])
-        self.total_byte_gauge = Gauge('total_byte_count', 'total_byte_count', ['switch', 'flow'])
-        self.total_packet_gauge = Gauge('total_packet_count', 'total_packet_count', ['switch', 'flow'])
-        self.throughput_gauge = Gauge('throughput', 'throughput', ['switch', 'flow'])
-        #self.isWLGauge = Gauge('weak_learner', 'weak learner', ['switch', 'is_WL'])
-        self.isMaliciousGauge = Gauge('ismalicious_flow', 'malicious flow', ['switch', 'flow'])
-        self.overhead_Gauge = Gauge('overhead', 'overhead ns', ['switch', 'flow'])
-        self.maliciousFlowGauge = Gauge(
-            'malicious_flow',
-            'Flows detected as malicious',
-            ['switch', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol', 'tunnel_id']
-        )
+        # Digest values are kept in per-(switch, flow) records; the Prometheus gauges are
+        # generated from them at scrape time by FlowStateCollector.
+        self.flow_state = FlowStateStore()
+        register_collector(FlowStateCollector(self.flow_state))
+        # Recent history of the same values, served by /flows/{tunnel_id}/history
+        self.timeseries = timeseries if timeseries is not None else TimeSeriesStore()
+        # Optional FlowTableManager fed with the digest 5-tuples for collision detection
+        self.flow_table = None
+        # Optional callable(stage, tunnel_id, timestamp, details) called along the digest ->
+        # mitigation path: "received", "decoded", "mitigation_start", "rule_installed"
+        self.stage_hook = None
+        # Optional FailoverManager, told of the tunnels blocked so that a failover keeps the drop rule
+        self.failover = None
+        # Per-stage latency histograms exported on /metrics and /debug/latency
+        self.latency = LATENCY
         self.last_timestamps = {}
         self.last_byte_count = {}
 
     def clear_excel_file(self):
         """ Completely empty the Excel file upon initialization of the class """
+        import pandas as pd
         empty_df = pd.DataFrame(columns=[
             "Switch", "Tunnel ID", "Queue Depth (packets)", "Queue Time (ms)",
             "Switch Time (ms)", "Interarrival Time (ms)", "Packet Length (Bytes)",
@@ -87,7 +83,12 @@ class DigestManager:
         while self._excel_running or not self._excel_queue.empty():
             try:
                 task = self._excel_queue.get(timeout=1)
-                if task["type"] == "time":
+                if task["type"] == "clear":
+                    # old data removed right away; the empty file (pandas) is written on the first digest
+                    if os.path.exists(self.filename):
+                        os.remove(self.filename)
+                    self._excel_cleared = False
+                elif task["type"] == "time":
                     self._write_time_excel(task["data"])
                 else:  # full
                     self._write_full_excel(task["data"])
@@ -96,6 +97,7 @@ class DigestManager:
                 continue
 
     def _write_time_excel(self, data: dict):
+        import pandas as pd  # Excel writer thread only
         df = pd.DataFrame(data)
         if os.path.exists(self.filename_time):
             existing = pd.read_excel(self.filename_time)
@@ -103,6 +105,10 @@ class DigestManager:
         df.to_excel(self.filename_time, index=False)
 
     def _write_full_excel(self, data: dict):
+        import pandas as pd
+        if not self._excel_cleared:
+            self.clear_excel_file()
+            self._excel_cleared = True
         df = pd.DataFrame(data)
         if os.path.exists(self.filename):
             existing = pd.read_excel(self.filename)
@@ -229,6 +235,10 @@ class DigestManager:
                 action_params={}
             )
             self.p4info_helper.upsertRule(ingress_sw, "MyIngress.myTunnel_exact", tunnel_id, table_entry)
+            if self.failover is not None:
+                self.failover.block(int(tunnel_id))
+            if self.stage_hook is not None:
+                self.stage_hook("rule_installed", tunnel_id, time.time(), {"switch": ingress_sw.name})
         except Exception as e:
             logger.error(f"Error installing blocking tunnel rule on {ingress_sw.name}: {e}")
 
@@ -242,8 +252,7 @@ class DigestManager:
             delta_byte = current_byte - self.last_byte_count[key]
             throughput = delta_byte * 8 / delta_time
             print(f"throughput: {throughput} bps")
-            self.throughput_gauge.labels(switch=switch, flow=tunnel_id).set(
-                throughput)
+            self.flow_state.flow(switch, tunnel_id).throughput = throughput
         else:
             delta_time = 0
             throughput = 0
@@ -252,7 +261,7 @@ class DigestManager:
         self.last_byte_count[key] = total_byte_count
 
         print(f"digest delta time for tunnel {tunnel_id}: {delta_time}")
-        self.digest_timestamp_gauge.labels(switch=switch, flow=tunnel_id).set(delta_time)
+        self.flow_state.flow(switch, tunnel_id).digest_delta = delta_time
         return delta_time, throughput
 
     def interpret_tunnel_id(self, tunnel_id, in_port, switch_name, queue_depth, queue_time, switch_time,
@@ -274,16 +283,17 @@ class DigestManager:
             print(
                 f" s{previous_switch} port {port}, queue depth: {queue_depth}")
 
-            self.switch_port_queue_depth.labels(switch=previous_switch, port=port, flow=tunnel_id).set(queue_depth)
-            self.queue_time_gauge.labels(switch=previous_switch, port=port, flow=tunnel_id).set(queue_time)
-            self.switch_time_gauge.labels(switch=previous_switch, flow=tunnel_id).set(switch_time)
+            record = self.flow_state.flow(previous_switch, tunnel_id)
+            record.port = port
+            record.queue_depth = queue_depth
+            record.queue_time = queue_time
+            record.switch_time = switch_time
             if interarrival_time != 0:
                 sending_rate = 1 / interarrival_time
             else:
                 sending_rate = 0
             print(f"sending rate: {sending_rate} pps")
-            self.sending_rate_gauge.labels(switch=previous_switch, flow=tunnel_id).set(
-                sending_rate)
+            record.sending_rate = sending_rate
             delta_time, throughput = self.update_digest_timestamp(previous_switch, tunnel_id, digest_timestamp,
                                                                   byte_count)
             # self.save_to_excel_time(previous_switch, tunnel_id, queue_depth, queue_time, switch_time)
@@ -302,8 +312,11 @@ class DigestManager:
             print("===============================")
 
             digest_message_list = digest.data
+            observe = self.latency.observe
+            STARTUP.mark("first_digest")
 
             for members in digest_message_list:
+                started = time.perf_counter()
                 if members.WhichOneof('data') == 'struct':
                     struct_members = members.struct.members
 
@@ -313,6 +326,7 @@ class DigestManager:
                             tunnel_id_bytes = struct_members[0].bitstring
                             tunnel_id = int.from_bytes(tunnel_id_bytes, byteorder='big')
                             print(f"Tunnel ID: {tunnel_id}")
+                            record = self.flow_state.flow(switch.name, tunnel_id)
                         if struct_members[1].WhichOneof('data') == 'bitstring':
                             in_port_bytes = struct_members[1].bitstring
                             in_port = int.from_bytes(in_port_bytes,
@@ -335,15 +349,13 @@ class DigestManager:
                             interarrival_time = int.from_bytes(interarrival_time_bytes,
                                                                byteorder='big') / 1000000
                             print(f"Interarrival Time: {interarrival_time} s")
-                            self.interarrival_time_gauge.labels(switch=switch.name, flow=tunnel_id).set(
-                                interarrival_time)
+                            record.interarrival_time = interarrival_time
 
                         if struct_members[5].WhichOneof('data') == 'bitstring':
                             packet_length_bytes = struct_members[5].bitstring
                             packet_length = int.from_bytes(packet_length_bytes, byteorder='big')
                             print(f"Packet Length: {packet_length} bytes")
-                            self.packet_length_gauge.labels(switch=switch.name, flow=tunnel_id).set(
-                                packet_length)
+                            record.packet_length = packet_length
 
                         if struct_members[6].WhichOneof('data') == 'bitstring':
                             queue_time_bytes = struct_members[6].bitstring
@@ -360,15 +372,13 @@ class DigestManager:
                             byte_count = int.from_bytes(byte_count_bytes,
                                                         byteorder='big')
                             print(f"Byte count: {byte_count} byte")
-                            self.total_byte_gauge.labels(switch=switch.name, flow=tunnel_id).set(
-                                byte_count)
+                            record.total_bytes = byte_count
                         if struct_members[9].WhichOneof('data') == 'bitstring':
                             packet_count_bytes = struct_members[9].bitstring
                             packet_count = int.from_bytes(packet_count_bytes,
                                                           byteorder='big')
                             print(f"Packet count: {packet_count} ")
-                            self.total_packet_gauge.labels(switch=switch.name, flow=tunnel_id).set(
-                                packet_count)
+                            record.total_packets = packet_count
                         if struct_members[10].WhichOneof('data') == 'bitstring':
                             is_WL = int.from_bytes(struct_members[10].bitstring, byteorder='big')
                             if is_WL == 1:
@@ -383,8 +393,7 @@ class DigestManager:
                             is_malicious = int.from_bytes(struct_members[11].bitstring, byteorder='big')
                             if is_malicious == 1:
                                 print(f"switch {switch.name} detected malicious flow")
-                                self.isMaliciousGauge.labels(switch=switch.name, flow=tunnel_id).set(
-                                    is_malicious)
+                                record.is_malicious = is_malicious
                         if struct_members[12].WhichOneof('data') == 'bitstring':
                             src_port = int.from_bytes(struct_members[12].bitstring, byteorder='big')
                             print(f"source port: {src_port} ")
@@ -407,22 +416,31 @@ class DigestManager:
                                 print(f"Protocol: UDP ")
 
                         protocol_str = 'TCP' if protocol == 6 else 'UDP' if protocol == 17 else str(protocol)
+                        decoded = time.perf_counter()
+                        observe("decode", switch.name, decoded - started)
+                        if self.stage_hook is not None:
+                            details = {"switch": switch.name, "digest_timestamp": digest_timestamp,
+                                       "list_timestamp": digest.timestamp, "packet_count": packet_count,
+                                       "interarrival_time": interarrival_time, "is_malicious": is_malicious}
+                            self.stage_hook("received", tunnel_id, timestamp_received, details)
+                            self.stage_hook("decoded", tunnel_id, time.time(), details)
+                        if self.flow_table is not None:
+                            self.flow_table.observe(switch.name, src_ip, dst_ip, src_port, dst_port, protocol)
                         if is_malicious == 1:
-                            self.maliciousFlowGauge.labels(
-                                switch=switch.name,
-                                src_ip=src_ip,
-                                dst_ip=dst_ip,
-                                src_port=src_port,
-                                dst_port=dst_port,
-                                protocol=protocol_str,
-                                tunnel_id=tunnel_id
-                            ).set(1)
+                            if self.stage_hook is not None:
+                                self.stage_hook("mitigation_start", tunnel_id, time.time(), details)
+                            self.flow_state.mark_malicious(switch.name, src_ip, dst_ip, src_port, dst_port,
+                                                           protocol_str, tunnel_id)
                             self.install_block_on_first_switch(self.switches, tunnel_id)
+                            observe("mitigation", switch.name, time.perf_counter() - decoded)
 
+                        interpret_start = time.perf_counter()
                         previous_switch, port, delta_time, throughput, sending_rate = self.interpret_tunnel_id(
                             tunnel_id, in_port, switch.name, queue_depth,
                             queue_time,
                             switch_time, digest_timestamp, byte_count, interarrival_time)
+                        gauge_start = time.perf_counter()
+                        observe("interpret", switch.name, gauge_start - interpret_start)
                         # if (interarrival_time != 0):
                         #    sending_rate = (packet_length * 8) / interarrival_time
                         # else:
@@ -437,8 +455,22 @@ class DigestManager:
                         print(f"digest received at time: {timestamp_received}")
                         print(f"current time: {current_time}")
                         print(f"overhead ns: {overhead}")
-                        self.overhead_Gauge.labels(switch=switch.name, flow=tunnel_id).set(overhead)
-                        self.last_timestamp_gauge.labels(switch=switch.name, flow=tunnel_id).set(time.time())
+                        record.overhead = overhead
+                        record.last_seen = current_time
+                        self.timeseries.record(switch.name, tunnel_id, timestamp_received, {
+                            "queue_depth": queue_depth,
+                            "queue_time": queue_time,
+                            "switch_time": switch_time,
+                            "interarrival_time": interarrival_time,
+                            "packet_length": packet_length,
+                            "sending_rate": sending_rate,
+                            "throughput": throughput,
+                            "total_byte_count": byte_count,
+                            "total_packet_count": packet_count,
+                            "overhead": overhead,
+                        })
+                        sink_start = time.perf_counter()
+                        observe("gauge_update", switch.name, sink_start - gauge_start)
 
                         self.save_to_excel(
                             switch.name, tunnel_id, previous_switch, port, queue_depth, queue_time, switch_time,
@@ -446,6 +478,7 @@ class DigestManager:
                             digest_timestamp, byte_count, packet_count, is_WL, timestamp_received,
                             in_port, is_malicious, src_port, dst_port, src_ip, dst_ip, protocol_str, overhead
                         )
+                        observe("sink_enqueue", switch.name, time.perf_counter() - sink_start)
 
 
         except KeyboardInterrupt:
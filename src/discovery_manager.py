@@ -0,0 +1,280 @@
+"""
+LLDP topology discovery (P4_DISCOVERY=1).
+
+Every interval seconds an LLDP frame is sent as PacketOut on each port of each switch
+(all switches at once, at most rate frames per second per switch). The frame carries
+the switch name and port, and a nonce of this controller so that frames of another
+controller or of a previous run are ignored. advanced_tunnel.p4 sends LLDP frames
+received on a front port to the CPU: MessageManager passes them to
+handle_packet_for_switch, and the switch name and port in the frame plus the ingress
+port of the packet-in give both ends of a link.
+
+The links between switches found this way replace the ones of topology.json in the
+shared SWITCH_PORTS (hosts do not speak LLDP: their ports still come from the file).
+A new link is applied at the end of the round it is seen in, a link not seen for
+hold_time seconds (3 intervals by default) is removed; the links of the file are
+considered seen at startup, so a switch slow to answer does not lose them at the
+first round. Changes go through on_change, the same path as /topology/reload:
+spanning tree, multicast groups and tunnels of the routes involved. listeners (e.g.
+FailoverManager.on_links) are told first of the links lost, before the topology is
+updated, and of the links found after it.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+
+from topology import Topology
+
+logger = logging.getLogger(__name__)
+
+LLDP_MAC = b'\x01\x80\xc2\x00\x00\x0e'
+ETHERTYPE_LLDP = b'\x88\xcc'
+
+# TLV types and the "locally assigned" subtype used for chassis and port ids
+TLV_END, TLV_CHASSIS_ID, TLV_PORT_ID, TLV_TTL, TLV_ORG = 0, 1, 2, 3, 127
+LOCAL = 7
+ORG_OUI = b'\x00\x00\x00'
+
+
+def _tlv(tlv_type, value):
+    return struct.pack('!H', (tlv_type << 9) | len(value)) + value
+
+
+def build_lldp_frame(switch_name, device_id, port, nonce, ttl=120):
+    """LLDP frame announcing (switch_name, port), with nonce in an organizationally specific TLV."""
+    src = bytes([0x02, 0x00, (device_id >> 8) & 0xff, device_id & 0xff, (port >> 8) & 0xff, port & 0xff])
+    return (LLDP_MAC + src + ETHERTYPE_LLDP
+            + _tlv(TLV_CHASSIS_ID, bytes([LOCAL]) + switch_name.encode())
+            + _tlv(TLV_PORT_ID, bytes([LOCAL]) + str(port).encode())
+            + _tlv(TLV_TTL, struct.pack('!H', ttl))
+            + _tlv(TLV_ORG, ORG_OUI + b'\x01' + nonce)
+            + _tlv(TLV_END, b''))
+
+
+def parse_lldp_frame(payload):
+    """(switch name, port, nonce) of an LLDP frame built by build_lldp_frame, None otherwise."""
+    if len(payload) < 16 or payload[12:14] != ETHERTYPE_LLDP:
+        return None
+    offset, chassis, port, nonce = 14, None, None, None
+    while offset + 2 <= len(payload):
+        header, = struct.unpack_from('!H', payload, offset)
+        tlv_type, length = header >> 9, header & 0x1ff
+        value = payload[offset + 2:offset + 2 + length]
+        offset += 2 + length
+        if tlv_type == TLV_END:
+            break
+        if tlv_type == TLV_CHASSIS_ID and value[:1] == bytes([LOCAL]):
+            chassis = value[1:].decode(errors='replace')
+        elif tlv_type == TLV_PORT_ID and value[:1] == bytes([LOCAL]) and value[1:].isdigit():
+            port = int(value[1:])
+        elif tlv_type == TLV_ORG and value[:4] == ORG_OUI + b'\x01':
+            nonce = value[4:]
+    if chassis is None or port is None:
+        return None
+    return chassis, port, nonce
+
+
+def is_lldp(payload):
+    return payload[12:14] == ETHERTYPE_LLDP
+
+
+class DiscoveryManager:
+    """
+    - links: {(switch, port, neighbour, neighbour port): last seen}, one entry per direction
+      probed (a link answering both ways has two)
+    - ports: ports probed on each switch (P4_DISCOVERY_PORTS, by default 1..num_ports
+      of the topology)
+    """
+
+    def __init__(self, p4info_helper, switches, topology, on_change=None, interval=None, hold_time=None,
+                 rate=None, ports=None, reply_wait=None):
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.topology = topology
+        self.on_change = on_change
+        self.interval = interval or float(os.environ.get("P4_DISCOVERY_INTERVAL", 5.0))
+        self.hold_time = hold_time or float(os.environ.get("P4_DISCOVERY_HOLD", 3 * self.interval))
+        self.rate = rate or float(os.environ.get("P4_DISCOVERY_RATE", 200))
+        self.ports = ports or int(os.environ.get("P4_DISCOVERY_PORTS", 0)) or topology.num_ports
+        self.reply_wait = reply_wait or min(0.5, self.interval / 2)
+        self.listeners = []  # called with (links added, links removed, {link: seconds since last seen})
+        self.last_seen = {}  # frozenset((a, b)) -> last reply of the links removed by current_links
+        self.nonce = os.urandom(8)
+        self.links = {}
+        self.applied = self._switch_links(topology.switch_ports)
+        self.probe_now = asyncio.Event()
+        self.running = False
+        self.stats = {"rounds": 0, "probes_sent": 0, "replies": 0, "ignored": 0, "changes": 0}
+        self.last_round_ms = None
+        self.last_change = None
+        now = time.monotonic()
+        for a, b, port_a, port_b in self.applied:
+            self.links[(a, port_a, b, port_b)] = now
+
+    def _switch_links(self, switch_ports):
+        """{(a, b, port on a, port on b)} of the links between switches, a < b."""
+        names = set(self.topology.switches)
+        links = set()
+        for a, ports in switch_ports.items():
+            for b, port in ports.items():
+                if b in names and a < b:
+                    links.add((a, b, port, switch_ports.get(b, {}).get(a)))
+        return links
+
+    # ---------------- probing ----------------
+    def _packet_out(self, sw, port):
+        payload = build_lldp_frame(sw.name, sw.device_id, port, self.nonce, ttl=int(self.hold_time) + 1)
+        packet_out = self.p4info_helper.buildPacketOut(
+            payload=payload,
+            metadata={
+                1: port.to_bytes(2, byteorder='big'),
+                2: b"\x00\x00"
+            }
+        )
+        return sw.PacketOut(packet_out)
+
+    async def _probe_switch(self, sw):
+        gap = 1.0 / self.rate if self.rate else 0
+        for port in range(1, self.ports + 1):
+            if self._packet_out(sw, port):
+                self.stats["probes_sent"] += 1
+            if gap:
+                await asyncio.sleep(gap)
+
+    async def probe_round(self):
+        """One LLDP frame on every port of every switch, all switches concurrently."""
+        started = time.perf_counter()
+        await asyncio.gather(*(self._probe_switch(sw) for sw in self.switches.values()))
+        self.stats["rounds"] += 1
+        self.last_round_ms = (time.perf_counter() - started) * 1000
+
+    # ---------------- replies ----------------
+    def handle_packet_for_switch(self, switch, message):
+        """LLDP packet-in: switch received on its ingress port the frame sent by (chassis, port)."""
+        packet = message.packet
+        parsed = parse_lldp_frame(packet.payload)
+        ingress_port = next((int.from_bytes(m.value, byteorder='big') for m in packet.metadata
+                             if m.metadata_id == 1), None)
+        if parsed is None or ingress_port is None:
+            self.stats["ignored"] += 1
+            return
+        chassis, port, nonce = parsed
+        if nonce != self.nonce or chassis not in self.topology.switches or chassis == switch.name:
+            self.stats["ignored"] += 1
+            return
+        self.stats["replies"] += 1
+        self.links[(chassis, port, switch.name, ingress_port)] = time.monotonic()
+
+    def current_links(self):
+        """
+        Links seen within hold_time, as _switch_links. SWITCH_PORTS holds one port per
+        neighbour: between two switches the link seen last wins (a recabled port replaces
+        the old one at once) and among parallel links, all seen in the last round, the
+        lowest ports.
+        """
+        expired = time.monotonic() - self.hold_time
+        for key in [key for key, seen in self.links.items() if seen < expired]:
+            pair = frozenset((key[0], key[2]))
+            self.last_seen[pair] = max(self.last_seen.get(pair, 0), self.links.pop(key))
+        pairs = {}
+        for (a, port_a, b, port_b), seen in self.links.items():
+            if a > b:
+                a, port_a, b, port_b = b, port_b, a, port_a
+            pairs.setdefault((a, b), []).append((seen, port_a, port_b))
+        links = set()
+        for (a, b), seen_ports in pairs.items():
+            newest = max(seen for seen, _, _ in seen_ports)
+            port_a, port_b = min((port_a, port_b) for seen, port_a, port_b in seen_ports
+                                 if seen >= newest - self.interval)
+            links.add((a, b, port_a, port_b))
+        return links
+
+    def discovered_topology(self, links, base=None):
+        """base (by default the shared topology) with its links between switches replaced by links."""
+        base = base or self.topology
+        names = set(base.switches)
+        switch_ports = {s: {n: p for n, p in base.switch_ports.get(s, {}).items() if n not in names}
+                        for s in base.switches}
+        for a, b, port_a, port_b in sorted(links, key=str):
+            for switch, neighbour, port in ((a, b, port_a), (b, a, port_b)):
+                if port is not None:
+                    switch_ports[switch][neighbour] = port
+        digest = hashlib.sha256(json.dumps(sorted(links, key=str)).encode()).hexdigest()
+        return Topology(list(base.switches), dict(base.hosts), dict(base.host_to_port), switch_ports,
+                        dict(base.mac_ip_mapping), f"lldp-{digest}", base.path)
+
+    async def check_links(self):
+        """Applies the links found if they differ from the ones applied last. Returns on_change's result."""
+        links = self.current_links()
+        if links == self.applied:
+            return None
+        added, removed = links - self.applied, self.applied - links
+        logger.info("LLDP: links added %s, removed %s", sorted(added, key=str), sorted(removed, key=str))
+        self.applied = links
+        self.stats["changes"] += 1
+        now = time.monotonic()
+        silent_for = {pair: now - seen for pair, seen in self.last_seen.items()}
+        self.last_seen = {}
+        # links lost are handled before the topology update (failover), links found after it
+        # (their ports must be in SWITCH_PORTS); a pair recabled on other ports is not lost
+        pairs_added = {frozenset((a, b)) for a, b, _, _ in added}
+        lost = {l for l in removed if frozenset((l[0], l[1])) not in pairs_added}
+        for listener in self.listeners:
+            if lost:
+                await asyncio.to_thread(listener, set(), lost, silent_for)
+        result = None
+        if self.on_change is not None:
+            result = await self.on_change(self.discovered_topology(links))
+        for listener in self.listeners:
+            if added:
+                await asyncio.to_thread(listener, added, removed - lost)
+        self.last_change = {"time": time.time(), "added": sorted(added, key=str), "removed": sorted(removed, key=str)}
+        return result
+
+    async def run(self):
+        """Probes every interval (or when probe_now is set), then applies the link changes."""
+        self.running = True
+        logger.info("LLDP discovery on %d switches, ports 1-%d, every %.1f s", len(self.switches), self.ports,
+                    self.interval)
+        try:
+            while self.running:
+                started = time.monotonic()
+                try:
+                    await self.probe_round()
+                    await asyncio.sleep(self.reply_wait)
+                    await self.check_links()
+                except Exception as e:
+                    logger.error("LLDP discovery round failed: %s", e)
+                self.probe_now.clear()
+                try:
+                    await asyncio.wait_for(self.probe_now.wait(),
+                                           timeout=max(0.0, self.interval - (time.monotonic() - started)))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+
+    def stop(self):
+        self.running = False
+        self.probe_now.set()
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "interval_s": self.interval,
+            "hold_time_s": self.hold_time,
+            "ports": self.ports,
+            "links": [{"switch": a, "port": port_a, "neighbour": b, "neighbour_port": port_b}
+                      for a, b, port_a, port_b in sorted(self.applied, key=str)],
+            "seen": [{"from": a, "port": port_a, "to": b, "to_port": port_b, "age_s": round(now - seen, 3)}
+                     for (a, port_a, b, port_b), seen in sorted(self.links.items())],
+            "last_round_ms": self.last_round_ms,
+            "last_change": self.last_change,
+            **self.stats,
+        }
@@ -0,0 +1,297 @@
+"""
+Link failover of the tunnels.
+
+install_tunnel_rules registers every tunnel (one per direction of a route) with its
+primary path; a backup path sharing no link with it is precomputed on the switch graph
+of SWITCH_PORTS (shortest in hops). When a link goes down (LLDP: DiscoveryManager
+listeners, or POST /failover/links/{a}/{b}) every tunnel whose active path crosses it
+moves to its backup, or to a shortest path avoiding the links down if the backup is
+broken too. When the link comes back the tunnels return to their primary path.
+
+A tunnel keeps its id on every path (the ipv4_lpm entry of the ingress switch does not
+change): only the myTunnel_exact entries that differ between the installed path and
+the new one are written, in one Write per switch, all switches at once. The inserts
+(switches new to the tunnel) go before the modifies, so traffic is redirected only to
+switches that already forward it. Entries of switches left by the tunnel stay: they
+are unreachable and are reused by the way back. Tunnels blocked by the mitigation
+never get their ingress entry (the drop rule) rewritten.
+
+Failover times go to the controller_failover_seconds histogram:
+- detection: from the last LLDP heartbeat of the link to the failure being detected
+- rewrite: from detection to the last switch acknowledging the new entries
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from p4.v1 import p4runtime_pb2
+from prometheus_client import Gauge, Histogram
+
+from config import SWITCH_PORTS, HOST_TO_PORT
+
+logger = logging.getLogger(__name__)
+
+TABLE = "MyIngress.myTunnel_exact"
+INSERT, MODIFY = p4runtime_pb2.Update.INSERT, p4runtime_pb2.Update.MODIFY
+
+failover_seconds = Histogram('controller_failover_seconds', 'Tunnel failover time', ['phase'],
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                                      30.0))
+tunnels_on_backup = Gauge('controller_tunnels_on_backup', 'Tunnels not on their primary path')
+
+
+def link(a, b):
+    return frozenset((a, b))
+
+
+def path_links(path):
+    return {link(a, b) for a, b in zip(path, path[1:])}
+
+
+class Tunnel:
+    """
+    - primary / backup / active: paths as switch names, backup None if there is none
+    - installed: {switch name: spec} of the myTunnel_exact entries written for this tunnel
+    """
+
+    def __init__(self, tunnel_id, route, primary, dst_eth_addr):
+        self.tunnel_id = tunnel_id
+        self.route = route
+        self.primary = primary
+        self.dst_eth_addr = dst_eth_addr
+        self.backup = None
+        self.active = primary
+        self.installed = {}
+        self.blocked = False
+
+    def summary(self):
+        return {"tunnel_id": self.tunnel_id, "route": list(self.route), "primary": self.primary,
+                "backup": self.backup, "active": self.active, "on_backup": self.active != self.primary,
+                "blocked": self.blocked}
+
+
+class FailoverManager:
+
+    def __init__(self, p4info_helper):
+        self.p4info_helper = p4info_helper
+        self.tunnels = {}   # tunnel id -> Tunnel
+        self.switches = {}  # switch name -> SwitchConnection
+        self.down = set()   # links down, as link(a, b)
+        self.events = deque(maxlen=50)
+        self.lock = threading.RLock()
+
+    # ---------------- paths ----------------
+    def usable(self, a, b):
+        return link(a, b) not in self.down and SWITCH_PORTS.get(a, {}).get(b) is not None
+
+    def path_ok(self, path):
+        return path is not None and all(self.usable(a, b) for a, b in zip(path, path[1:]))
+
+    def shortest_path(self, src, dst, avoid=()):
+        """Shortest path (hops) from src to dst over the usable links not in avoid, None if there is none."""
+        previous, frontier = {src: None}, [src]
+        while frontier and dst not in previous:
+            next_frontier = []
+            for a in frontier:
+                for b in sorted(SWITCH_PORTS.get(a, {})):
+                    if b in previous or b not in SWITCH_PORTS or link(a, b) in avoid or not self.usable(a, b):
+                        continue
+                    previous[b] = a
+                    next_frontier.append(b)
+            frontier = next_frontier
+        if dst not in previous:
+            return None
+        path = [dst]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        return path[::-1]
+
+    def entries(self, tunnel, path):
+        """{switch: spec} of the myTunnel_exact entries of tunnel along path, as write_tunnel_rules installs them."""
+        specs = {a: ("forward", SWITCH_PORTS[a][b]) for a, b in zip(path, path[1:])}
+        specs[path[-1]] = ("egress", tunnel.dst_eth_addr, HOST_TO_PORT[path[-1]])
+        return specs
+
+    def _table_entry(self, tunnel, spec):
+        if spec[0] == "forward":
+            return self.p4info_helper.buildTableEntry(
+                table_name=TABLE,
+                match_fields={"hdr.myTunnel.dst_id": tunnel.tunnel_id},
+                action_name="MyIngress.myTunnel_forward",
+                action_params={"port": spec[1]})
+        return self.p4info_helper.buildTableEntry(
+            table_name=TABLE,
+            match_fields={"hdr.myTunnel.dst_id": tunnel.tunnel_id},
+            action_name="MyIngress.myTunnel_egress",
+            action_params={"dstAddr": spec[1], "port": spec[2]})
+
+    # ---------------- registration (install_tunnel_rules) ----------------
+    def register(self, tunnel_id, route, primary, dst_eth_addr, switches):
+        """
+        Registers a tunnel with its primary path (switch names) and precomputes its backup.
+        Returns the path to install: the primary, or the backup if a link of the primary is down.
+        """
+        with self.lock:
+            for sw in switches.values():
+                self.switches[sw.name] = sw
+            tunnel = self.tunnels.get(tunnel_id)
+            if tunnel is None or tunnel.primary != primary or tunnel.dst_eth_addr != dst_eth_addr:
+                blocked = tunnel.blocked if tunnel is not None else False
+                tunnel = self.tunnels[tunnel_id] = Tunnel(tunnel_id, route, primary, dst_eth_addr)
+                tunnel.blocked = blocked
+            tunnel.backup = self.shortest_path(primary[0], primary[-1], avoid=path_links(primary))
+            if self.path_ok(primary) or not self.path_ok(tunnel.backup):
+                return primary
+            return tunnel.backup
+
+    def mark_installed(self, tunnel_id, path):
+        """install_tunnel_rules wrote the entries of path for the tunnel (a drop rule at the ingress is replaced)."""
+        with self.lock:
+            tunnel = self.tunnels.get(tunnel_id)
+            if tunnel is not None:
+                tunnel.installed.update(self.entries(tunnel, path))
+                tunnel.active = path
+                tunnel.blocked = False
+                self._export()
+
+    def retain(self, tunnel_ids):
+        """Forgets the tunnels not in tunnel_ids (routes file replaced)."""
+        with self.lock:
+            for tunnel_id in set(self.tunnels) - set(tunnel_ids):
+                del self.tunnels[tunnel_id]
+            self._export()
+
+    def block(self, tunnel_id):
+        """The mitigation installed a drop rule at the ingress of the tunnel: failover leaves it there."""
+        with self.lock:
+            tunnel = self.tunnels.get(tunnel_id)
+            if tunnel is not None:
+                tunnel.blocked = True
+                tunnel.installed[tunnel.primary[0]] = ("drop",)
+
+    def recompute(self):
+        """Backups of all tunnels on the current graph, e.g. after a topology change."""
+        with self.lock:
+            for tunnel in self.tunnels.values():
+                tunnel.backup = self.shortest_path(tunnel.primary[0], tunnel.primary[-1],
+                                                   avoid=path_links(tunnel.primary))
+
+    # ---------------- link events ----------------
+    def on_links(self, added, removed, silent_for=None):
+        """DiscoveryManager listener: links as (a, b, port on a, port on b)."""
+        up = {link(a, b) for a, b, _, _ in added}
+        for a, b, _, _ in removed:
+            if link(a, b) not in up:  # a pair still connected on other ports is not a failure
+                self.link_down(a, b, (silent_for or {}).get(link(a, b)))
+        for a, b, _, _ in added:
+            if link(a, b) in self.down:
+                self.link_up(a, b)
+        if added or removed:
+            self.recompute()
+
+    def link_down(self, a, b, silent_for=None):
+        """Moves the tunnels crossing a-b to their backup. Returns the failover event."""
+        detected = time.perf_counter()
+        with self.lock:
+            self.down.add(link(a, b))
+            moves = {}
+            for tunnel in self.tunnels.values():
+                if link(a, b) not in path_links(tunnel.active):
+                    continue
+                path = tunnel.backup if self.path_ok(tunnel.backup) else \
+                    self.shortest_path(tunnel.primary[0], tunnel.primary[-1])
+                moves[tunnel.tunnel_id] = path
+            return self._switch(f"{a}-{b} down", moves, detected, silent_for)
+
+    def link_up(self, a, b):
+        """Brings back to their primary path the tunnels whose primary is whole again."""
+        detected = time.perf_counter()
+        with self.lock:
+            self.down.discard(link(a, b))
+            moves = {tunnel.tunnel_id: tunnel.primary for tunnel in self.tunnels.values()
+                     if tunnel.active != tunnel.primary and self.path_ok(tunnel.primary)}
+            return self._switch(f"{a}-{b} up", moves, detected)
+
+    def _switch(self, cause, moves, detected, silent_for=None):
+        """Writes the entries moving each tunnel of moves to its path (None: no path left)."""
+        if not moves:
+            return None
+        inserts, modifies = {}, {}
+        moved, lost = [], []
+        for tunnel_id, path in moves.items():
+            tunnel = self.tunnels[tunnel_id]
+            if path is None:
+                lost.append(tunnel_id)
+                continue
+            for name, spec in self.entries(tunnel, path).items():
+                if tunnel.installed.get(name) == spec or tunnel.installed.get(name) == ("drop",):
+                    continue
+                update = p4runtime_pb2.Update(type=MODIFY if name in tunnel.installed else INSERT)
+                update.entity.table_entry.CopyFrom(self._table_entry(tunnel, spec))
+                (modifies if update.type == MODIFY else inserts).setdefault(name, []).append(update)
+                tunnel.installed[name] = spec
+            tunnel.active = path
+            moved.append(tunnel_id)
+
+        errors = self._write(inserts)
+        errors.update(self._write(modifies))
+        rewrite = time.perf_counter() - detected
+        updates = sum(len(u) for u in inserts.values()) + sum(len(u) for u in modifies.values())
+        if moved:
+            failover_seconds.labels("rewrite").observe(rewrite)
+            if silent_for is not None:
+                failover_seconds.labels("detection").observe(silent_for)
+        event = {"time": time.time(), "cause": cause, "tunnels": sorted(moved), "no_path": sorted(lost),
+                 "updates": updates, "switches": sorted(set(inserts) | set(modifies)),
+                 "rewrite_ms": round(rewrite * 1000, 3),
+                 "detection_ms": None if silent_for is None else round(silent_for * 1000, 3),
+                 "errors": {name: str(e) for name, e in errors.items()}}
+        self.events.append(event)
+        self._export()
+        if lost:
+            logger.error("Failover %s: no path left for tunnels %s", cause, lost)
+        logger.info("Failover %s: %d tunnels moved with %d updates in %.3f ms", cause, len(moved), updates,
+                    rewrite * 1000)
+        return event
+
+    def _write(self, updates):
+        """One Write per switch, all switches at once. Returns {switch name: exception}."""
+        errors = {}
+
+        def write(name):
+            sw = self.switches[name]
+            try:
+                sw.WriteUpdates(updates[name])
+            except grpc.RpcError:
+                # an entry left by an earlier run (INSERT) or deleted meanwhile (MODIFY): one at a time,
+                # retrying with the other operation
+                for update in updates[name]:
+                    try:
+                        sw.WriteUpdates([update])
+                    except grpc.RpcError:
+                        try:
+                            update.type = MODIFY if update.type == INSERT else INSERT
+                            sw.WriteUpdates([update])
+                        except grpc.RpcError as e:
+                            errors[name] = e
+
+        if updates:
+            with ThreadPoolExecutor(max_workers=len(updates), thread_name_prefix="failover") as pool:
+                list(pool.map(write, updates))
+        return errors
+
+    def _export(self):
+        tunnels_on_backup.set(sum(1 for t in self.tunnels.values() if t.active != t.primary))
+
+    def status(self):
+        with self.lock:
+            return {
+                "down": sorted(sorted(pair) for pair in self.down),
+                "tunnels": [t.summary() for _, t in sorted(self.tunnels.items())],
+                "without_backup": sorted(t.tunnel_id for t in self.tunnels.values() if t.backup is None),
+                "events": list(self.events),
+            }
@@ -0,0 +1,596 @@
+"""
+Offline flow-feature extractor replicating the feature pipeline of advanced_tunnel.p4.
+
+Reads pcap files or CSV packet traces and computes, for every flow, the 43 features
+the weak learners see in meta.feature0..42, with the data-plane semantics:
+  - flows live in MAX_REGISTER_ENTRIES slots indexed by the crc16 of the 5-tuple, so
+    colliding flows share (and corrupt) the same registers;
+  - a slot is re-initialised when its last packet is older than FLOW_TIMEOUT;
+  - registers and metadata wrap at their bit widths (8-bit packet and flag counts,
+    16-bit header lengths, 32-bit timestamps), means are computed by bit shifting;
+  - actions run in the order of MyIngress.apply, including its quirks (e.g. the
+    "fwd" totals and header length count every packet, fwd_* len features are 0
+    on backward packets, flow_iat_min is the last iat, the window features are
+    never filled because init_f/b_win_byts default to NoAction);
+  - a feature vector is emitted when the flow reaches PACKET_THR packets or a FIN
+    is seen, then the slot is cleared with init_register(), as the switch does.
+
+Only the default actions of the feature tables are emulated (no entries are installed
+on them), no custom header is present and the majority voting across colors is not
+modelled, so slots are never marked as malicious.
+
+Header decoding and slot hashing are vectorized per chunk; the register updates are
+a tight per-packet loop, since every packet depends on the state left by the previous
+one in the same slot. Memory is bounded by the chunk size and the 8192 slots.
+
+Usage:
+    python3 feature_extractor.py trace.pcap -o features.csv [--rules rules.json --wl 6]
+"""
+
+import argparse
+import csv
+import ipaddress
+import json
+import logging
+import struct
+import sys
+import time
+
+import numpy as np
+
+from p4_hash import flow_slot, MAX_REGISTER_ENTRIES
+from wl_features import FEATURES, NUM_FEATURES
+
+logger = logging.getLogger(__name__)
+
+FLOW_TIMEOUT = 15000000  # us
+PACKET_THR = 50
+TYPE_IPV4 = 0x0800
+TYPE_MYTUNNEL = 0x1212
+MYTUNNEL_HEADER_LEN = 28  # added by myTunnel_ingress, counted in standard_metadata.packet_length
+CUSTOM_NEXT_HEADER = 1234 & 0xFF  # next_header_type is bit<8>
+CUSTOM_HEADER_LEN = 2
+
+M8, M16, M32, M48 = 0xFF, 0xFFFF, 0xFFFFFFFF, (1 << 48) - 1
+LEN_MIN_INIT = 99999999
+
+# Bytes of each frame needed to decode Ethernet + myTunnel + custom + IPv4 + TCP/UDP
+HEADER_BYTES = 14 + MYTUNNEL_HEADER_LEN + CUSTOM_HEADER_LEN + 20 + 20
+
+# Registers reset by init_register(), with their initial value
+REGISTERS = [
+    ("reg_src_ip", 0), ("reg_dst_ip", 0), ("reg_src_port", 0), ("reg_dst_port", 0), ("reg_protocol", 0),
+    ("reg_time_first_pkt", 0), ("reg_time_last_pkt", 0), ("reg_time_last_pkt_bwd", 0),
+    ("reg_time_last_pkt_fwd", 0), ("reg_flow_duration", 0), ("reg_packets", 0),
+    ("reg_tot_fwd_pkts", 0), ("reg_tot_bwd_pkts", 0),
+    ("reg_fin_flag_cnt", 0), ("reg_syn_flag_cnt", 0), ("reg_rst_flag_cnt", 0), ("reg_psh_flag_cnt", 0),
+    ("reg_ack_flag_cnt", 0), ("reg_urg_flag_cnt", 0), ("reg_ece_flag_cnt", 0),
+    ("reg_len_fwd_pkts", 0), ("reg_totlen_fwd_pkts", 0), ("reg_len_bwd_pkts", 0), ("reg_totlen_bwd_pkts", 0),
+    ("reg_totLen_pkts", 0),
+    ("reg_fwd_pkt_len_max", 0), ("reg_fwd_pkt_len_min", LEN_MIN_INIT), ("reg_fwd_pkt_len_mean", 0),
+    ("reg_bwd_pkt_len_max", 0), ("reg_bwd_pkt_len_min", LEN_MIN_INIT), ("reg_bwd_pkt_len_mean", 0),
+    ("reg_pkt_len_max", 0), ("reg_pkt_len_min", LEN_MIN_INIT), ("reg_pkt_len_mean", 0),
+    ("reg_fwd_header_len", 0), ("reg_bwd_header_len", 0), ("reg_fwd_seg_size_min", 65000),
+    ("reg_fwd_act_data_pkts", 0),
+    ("reg_iat", 0), ("reg_iat_tot", 0), ("reg_flow_iat_mean", 0), ("reg_flow_iat_max", 0),
+    ("reg_flow_iat_min", LEN_MIN_INIT),
+    ("reg_fwd_iat", 0), ("reg_fwd_iat_tot", 0), ("reg_fwd_iat_mean", 0), ("reg_fwd_iat_max", 0),
+    ("reg_fwd_iat_min", LEN_MIN_INIT),
+    ("reg_bwd_iat", 0), ("reg_bwd_iat_tot", 0), ("reg_bwd_iat_mean", 0), ("reg_bwd_iat_max", 0),
+    ("reg_bwd_iat_min", LEN_MIN_INIT),
+    ("reg_init_fwd_win_byts", 0), ("reg_init_bwd_win_byts", 0),
+    ("reg_active_vals", 0), ("reg_active_tot", 0), ("reg_active_mean", 0), ("reg_active_max", 0),
+    ("reg_active_min", LEN_MIN_INIT),
+    ("reg_idle_vals", 0), ("reg_idle_tot", 0), ("reg_idle_mean", 0), ("reg_idle_max", 0),
+    ("reg_idle_min", LEN_MIN_INIT),
+]
+INIT_REGISTERS = [value for _, value in REGISTERS]
+R = {name: index for index, (name, _) in enumerate(REGISTERS)}
+
+# compute_shift(): shift used by calculate_mean() for a bit<8> packet count
+MEAN_SHIFT = [0] + [1 if p <= 2 else 2 if p <= 4 else 3 if p <= 8 else 4 if p <= 16 else
+                    5 if p <= 32 else 6 if p <= 64 else 7 for p in range(1, 256)]
+
+PACKET_COLUMNS = ["ts_us", "length", "src_ip", "dst_ip", "src_port", "dst_port", "protocol",
+                  "ihl", "version", "total_len", "data_offset", "tcp_flags", "udp_len", "tunnelled"]
+TCP_FIN, TCP_SYN, TCP_RST, TCP_PSH, TCP_ACK, TCP_URG, TCP_ECE = 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40
+
+FLOW_COLUMNS = ["ts_us", "src_ip", "dst_ip", "src_port", "dst_port", "protocol", "slot", "direction",
+                "collision"]
+FEATURE_NAMES = [name for _, name, _ in FEATURES]
+
+
+# ---------------------------------------------------------------------------
+# Input readers: both yield dicts of NumPy arrays with PACKET_COLUMNS
+# ---------------------------------------------------------------------------
+
+def decode_frames(ts_us, wire_len, raw):
+    """
+    Vectorized parse of Ethernet frames, as MyParser does: IPv4 directly or behind
+    myTunnel (and the custom header), TCP/UDP right after the 20-byte IPv4 header.
+    raw: (N, HEADER_BYTES) uint8, zero padded. Non TCP/UDP packets are dropped.
+    """
+    raw = raw.astype(np.uint32)
+    ether_type = (raw[:, 12] << 8) | raw[:, 13]
+    tunnelled = ether_type == TYPE_MYTUNNEL
+    next_header = raw[:, 16]
+    ip_offset = np.full(len(raw), 14)
+    ip_offset[tunnelled] += MYTUNNEL_HEADER_LEN
+    ip_offset[tunnelled & (next_header == CUSTOM_NEXT_HEADER)] += CUSTOM_HEADER_LEN
+    is_ipv4 = (ether_type == TYPE_IPV4) | (tunnelled & ((next_header == 0) | (next_header == CUSTOM_NEXT_HEADER)))
+
+    protocol = raw[np.arange(len(raw)), ip_offset + 9]
+    keep = is_ipv4 & ((protocol == 6) | (protocol == 17))
+    raw, ip_offset = raw[keep], ip_offset[keep]
+    rows = np.arange(len(raw))
+
+    def at(offset, size):
+        value = np.zeros(len(raw), dtype=np.uint32)
+        for k in range(size):
+            value = (value << 8) | raw[rows, offset + k]
+        return value
+
+    l4 = ip_offset + 20
+    return {
+        "ts_us": np.asarray(ts_us, dtype=np.int64)[keep],
+        "length": np.asarray(wire_len, dtype=np.int64)[keep],
+        "version": at(ip_offset, 1) >> 4,
+        "ihl": at(ip_offset, 1) & 0xF,
+        "total_len": at(ip_offset + 2, 2),
+        "protocol": at(ip_offset + 9, 1),
+        "src_ip": at(ip_offset + 12, 4),
+        "dst_ip": at(ip_offset + 16, 4),
+        "src_port": at(l4, 2),
+        "dst_port": at(l4 + 2, 2),
+        "data_offset": at(l4 + 12, 1) >> 4,
+        "tcp_flags": at(l4 + 13, 1),
+        "udp_len": at(l4 + 4, 2),
+        "tunnelled": tunnelled[keep],
+    }
+
+
+def read_pcap(path, chunk_packets=65536):
+    """Streams a libpcap file (Ethernet link type, us or ns timestamps) in decoded chunks."""
+    with open(path, "rb") as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError(f"{path}: not a pcap file")
+        magic = header[:4]
+        formats = {b"\xd4\xc3\xb2\xa1": ("<", 1000), b"\xa1\xb2\xc3\xd4": (">", 1000),
+                   b"\x4d\x3c\xb2\xa1": ("<", 1), b"\xa1\xb2\x3c\x4d": (">", 1)}
+        if magic not in formats:
+            raise ValueError(f"{path}: unsupported capture format (pcapng must be converted with "
+                             f"'editcap -F pcap')")
+        endian, ns_per_unit = formats[magic]
+        link_type = struct.unpack(endian + "I", header[20:24])[0] & 0xFFFF
+        if link_type != 1:
+            raise ValueError(f"{path}: link type {link_type} is not Ethernet")
+        record = struct.Struct(endian + "IIII")
+
+        ts = np.empty(chunk_packets, dtype=np.int64)
+        wire_len = np.empty(chunk_packets, dtype=np.int64)
+        raw = np.zeros((chunk_packets, HEADER_BYTES), dtype=np.uint8)
+        n = 0
+        while True:
+            head = f.read(16)
+            if len(head) < 16:
+                break
+            sec, frac, cap_len, orig_len = record.unpack(head)
+            data = f.read(cap_len)
+            ts[n] = sec * 1000000 + frac * ns_per_unit // 1000
+            wire_len[n] = orig_len
+            keep = min(cap_len, HEADER_BYTES)
+            raw[n, :keep] = np.frombuffer(data, dtype=np.uint8, count=keep)
+            n += 1
+            if n == chunk_packets:
+                yield decode_frames(ts, wire_len, raw)
+                raw[:] = 0
+                n = 0
+        if n:
+            yield decode_frames(ts[:n], wire_len[:n], raw[:n])
+
+
+def _ip_column(values):
+    if values.dtype.kind in "iu":
+        return values.to_numpy(dtype=np.uint32)
+    octets = values.astype(str).str.split(".", expand=True).astype(np.uint32).to_numpy()
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def _flags_column(values):
+    if values.dtype.kind in "iu":
+        return values.to_numpy(dtype=np.uint32)
+    if values.dtype.kind == "f":
+        return values.fillna(0).to_numpy().astype(np.uint32)
+    text = values.fillna("").astype(str)
+    if text.str.startswith("0x").all():
+        return text.apply(lambda v: int(v, 16)).to_numpy(dtype=np.uint32)
+    flags = np.zeros(len(text), dtype=np.uint32)
+    for letter, bit in (("F", TCP_FIN), ("S", TCP_SYN), ("R", TCP_RST), ("P", TCP_PSH), ("A", TCP_ACK),
+                        ("U", TCP_URG), ("E", TCP_ECE)):
+        flags |= np.where(text.str.contains(letter, regex=False), bit, 0).astype(np.uint32)
+    return flags
+
+
+def read_csv(path, chunk_packets=65536):
+    """
+    Streams a CSV packet trace. Required columns: timestamp (s), src_ip, dst_ip,
+    src_port, dst_port, protocol, length (frame length). Optional: tcp_flags (int,
+    hex or letters like "SA"), ip_len, ihl, data_offset, udp_len, tunnelled.
+    """
+    import pandas as pd
+
+    for chunk in pd.read_csv(path, chunksize=chunk_packets):
+        chunk = chunk[chunk["protocol"].isin([6, 17])]
+        n = len(chunk)
+        length = chunk["length"].to_numpy(dtype=np.int64)
+        ihl = chunk["ihl"].to_numpy(dtype=np.uint32) if "ihl" in chunk else np.full(n, 5, dtype=np.uint32)
+        total_len = chunk["ip_len"].to_numpy(dtype=np.uint32) if "ip_len" in chunk else \
+            np.maximum(length - 14, 0).astype(np.uint32)
+        yield {
+            "ts_us": np.round(chunk["timestamp"].to_numpy(dtype=np.float64) * 1e6).astype(np.int64),
+            "length": length,
+            "version": np.full(n, 4, dtype=np.uint32),
+            "ihl": ihl,
+            "total_len": total_len,
+            "protocol": chunk["protocol"].to_numpy(dtype=np.uint32),
+            "src_ip": _ip_column(chunk["src_ip"]),
+            "dst_ip": _ip_column(chunk["dst_ip"]),
+            "src_port": chunk["src_port"].to_numpy(dtype=np.uint32),
+            "dst_port": chunk["dst_port"].to_numpy(dtype=np.uint32),
+            "data_offset": chunk["data_offset"].to_numpy(dtype=np.uint32) if "data_offset" in chunk else
+            np.full(n, 5, dtype=np.uint32),
+            "tcp_flags": _flags_column(chunk["tcp_flags"]) if "tcp_flags" in chunk else np.zeros(n, dtype=np.uint32),
+            "udp_len": chunk["udp_len"].to_numpy(dtype=np.uint32) if "udp_len" in chunk else
+            (total_len - ihl * 4).astype(np.uint32),
+            "tunnelled": chunk["tunnelled"].to_numpy(dtype=bool) if "tunnelled" in chunk else np.zeros(n, dtype=bool),
+        }
+
+
+def read_trace(path, chunk_packets=65536):
+    if path.endswith(".csv"):
+        return read_csv(path, chunk_packets)
+    return read_pcap(path, chunk_packets)
+
+
+# ---------------------------------------------------------------------------
+# Data-plane emulation
+# ---------------------------------------------------------------------------
+
+class FeatureExtractor:
+    def __init__(self, size=MAX_REGISTER_ENTRIES, flow_timeout=FLOW_TIMEOUT, packet_thr=PACKET_THR,
+                 encap_overhead=MYTUNNEL_HEADER_LEN, clock_start_us=60000000):
+        """
+        encap_overhead: bytes added to frames captured outside the tunnel: a WL switch
+                        along the path receives them with the myTunnel header, while
+                        packet_length on the tunnel's ingress switch excludes it (use 0
+                        there). Frames captured inside the tunnel are taken as they are.
+        clock_start_us: ingress_global_timestamp of the first packet; the default is a
+                        switch running for longer than FLOW_TIMEOUT.
+        """
+        self.size = size
+        self.flow_timeout = flow_timeout
+        self.packet_thr = packet_thr
+        self.encap_overhead = encap_overhead
+        self.clock_start_us = clock_start_us
+        self.first_ts = None
+
+        self.reg_flow = [0] * size
+        self.reg_malware = [0] * size
+        self.registers = [list(INIT_REGISTERS) for _ in range(size)]
+        self.collided = [False] * size
+        self.stats = {"packets": 0, "new_flows": 0, "expired": 0, "collisions": 0, "dropped": 0, "emitted": 0}
+
+    def process(self, packets):
+        """
+        Runs a chunk of packets (dict of PACKET_COLUMNS arrays) through the pipeline.
+        Returns (flows, features): a dict of FLOW_COLUMNS arrays and an (M, 43) uint32
+        array, one row for each classification the switch would run.
+        """
+        n = len(packets["ts_us"])
+        if n == 0:
+            return {name: np.zeros(0, dtype=np.int64) for name in FLOW_COLUMNS}, \
+                np.zeros((0, NUM_FEATURES), dtype=np.uint32)
+        if self.first_ts is None:
+            self.first_ts = int(packets["ts_us"][0])
+
+        src, dst = packets["src_ip"], packets["dst_ip"]
+        sport, dport, proto = packets["src_port"], packets["dst_port"], packets["protocol"]
+        slot_fwd = flow_slot(src, dst, sport, dport, proto, self.size).tolist()
+        slot_bwd = flow_slot(dst, src, dport, sport, proto, self.size).tolist()
+        switch_ts = ((packets["ts_us"] - self.first_ts + self.clock_start_us) & M48).tolist()
+        length = np.where(packets["tunnelled"], packets["length"],
+                          packets["length"] + self.encap_overhead).astype(np.int64).tolist()
+        ihl = packets["ihl"].astype(np.int64)
+        l4_header = np.where(proto == 6, ihl * 4, 8).tolist()
+        tcp = (proto == 6).tolist()
+        flags = packets["tcp_flags"].astype(np.int64).tolist()
+        # count_payload(): TCP payload from the IPv4/TCP lengths, UDP length > 8
+        ip_tcp_len = ((ihl * 4 + packets["data_offset"].astype(np.int64) * 4) & M16)
+        has_payload = np.where(
+            proto == 6,
+            (packets["version"] == 4) & (ihl >= 5) & (packets["data_offset"] >= 5) &
+            (packets["total_len"].astype(np.int64) > ip_tcp_len),
+            packets["udp_len"] > 8).tolist()
+        keys = list(zip(src.tolist(), dst.tolist(), sport.tolist(), dport.tolist(), proto.tolist()))
+
+        reg_flow, reg_malware, registers, collided = self.reg_flow, self.reg_malware, self.registers, self.collided
+        flow_timeout, packet_thr, shift = self.flow_timeout, self.packet_thr, MEAN_SHIFT
+        emitted_rows, emitted_info = [], []
+        new_flows = expired = collisions = dropped = 0
+
+        # s[k] is register REGISTERS[k] of the slot (see R), indexed by literal for speed
+        for i in range(n):
+            t32 = switch_ts[i] & M32
+            idx = slot_fwd[i]
+            direction = 0
+            is_first = False
+            if reg_flow[idx] == 0:
+                inverse = slot_bwd[i]
+                if reg_flow[inverse] != 0:
+                    direction = 1
+                    idx = inverse
+                else:
+                    is_first = True
+                    registers[idx] = list(INIT_REGISTERS)
+                    reg_flow[idx] = idx
+                    new_flows += 1
+            if reg_malware[idx]:
+                dropped += 1
+                continue
+            s = registers[idx]
+
+            time_last = s[6]  # reg_time_last_pkt
+            if is_first:
+                time_last = t32
+                s[5] = t32  # reg_time_first_pkt
+            if ((t32 - time_last) & M32) > flow_timeout:
+                if time_last:  # not a slot already cleared after a classification
+                    expired += 1
+                s = registers[idx] = list(INIT_REGISTERS)
+                is_first = True
+
+            key = keys[i]
+            if is_first:
+                s[0], s[1], s[2], s[3], s[4] = key  # store_flow_key_*
+                collided[idx] = False
+            elif s[0] or s[1]:
+                stored = (s[0], s[1], s[2], s[3], s[4])
+                if key != stored and key != (s[1], s[0], s[3], s[2], s[4]):
+                    collided[idx] = True
+                    collisions += 1
+
+            pkt_len = length[i]
+            hdr_len = l4_header[i]
+            fwd_pkt_len_min = fwd_pkt_len_max = fwd_pkt_len_mean = fwd_act_data_pkts = 0
+            bwd_pkt_len_min = bwd_pkt_len_max = bwd_pkt_len_mean = 0
+
+            if direction == 0:
+                s[11] = tot_fwd = (s[11] + 1) & M8  # count_pkts_fwd
+                s[20] = pkt_len  # calc_len_fwd_pkts
+                if is_first:
+                    s[6] = s[8] = time_last
+                else:
+                    time_last = s[8]  # reg_time_last_pkt_fwd
+                    s[43] = (t32 - time_last) & M32  # reg_fwd_iat
+                    s[6] = s[8] = t32
+                # calc_Length_fwd_mean (before totlen_f_pkts adds this packet)
+                totlen = s[21]
+                s[27] = fwd_pkt_len_mean = totlen if tot_fwd == 1 else totlen >> shift[tot_fwd]
+                fwd_pkt_len_max = s[25]  # calc_max_fwd
+                if s[20] > fwd_pkt_len_max:
+                    s[25] = fwd_pkt_len_max = s[20]
+                fwd_pkt_len_min = s[26]  # calc_min_fwd
+                if s[20] <= fwd_pkt_len_min:
+                    s[26] = fwd_pkt_len_min = s[20]
+                fwd_act_data_pkts = s[37]  # count_payload
+                if has_payload[i]:
+                    s[37] = fwd_act_data_pkts = (fwd_act_data_pkts + 1) & M32
+            else:
+                s[12] = tot_bwd = (s[12] + 1) & M8  # count_pkts_bwd
+                s[22] = pkt_len  # calc_len_bwd_pkts
+                if is_first:
+                    s[6] = s[7] = time_last
+                else:
+                    time_last = s[7]  # reg_time_last_pkt_bwd
+                    if time_last == 0:  # bwd_iat == timestamp: first backward packet
+                        s[7] = t32
+                    else:
+                        s[48] = (t32 - time_last) & M32  # reg_bwd_iat
+                        s[6] = s[7] = t32
+                totlen = s[23]  # calc_Length_bwd_mean
+                s[30] = bwd_pkt_len_mean = totlen if tot_bwd == 1 else totlen >> shift[tot_bwd]
+                bwd_pkt_len_max = s[28]  # calc_max_bwd
+                if s[22] > bwd_pkt_len_max:
+                    s[28] = bwd_pkt_len_max = s[22]
+                bwd_pkt_len_min = s[29]  # calc_min_bwd
+                if s[22] <= bwd_pkt_len_min:
+                    s[29] = bwd_pkt_len_min = s[22]
+
+            tot_fwd, tot_bwd = s[11], s[12]
+
+            # fwd_iat_tot, fwd_iat_mean, fwd_iat_max, fwd_iat_min
+            fwd_iat = s[43]
+            s[44] = fwd_iat_tot = (s[44] + fwd_iat) & M32
+            s[45] = fwd_iat_mean = fwd_iat_tot if tot_fwd == 1 else fwd_iat_tot >> shift[tot_fwd]
+            fwd_iat_max = s[46]
+            if fwd_iat > fwd_iat_max:
+                s[46] = fwd_iat_max = fwd_iat
+            fwd_iat_min = s[47]
+            if fwd_iat < fwd_iat_min and fwd_iat != 0:
+                s[47] = fwd_iat_min = fwd_iat
+
+            # calc_Length_fwd_tot, fwd_header, fwd_min_size
+            s[20] = pkt_len
+            s[21] = totlen_fwd = (s[21] + pkt_len) & M32
+            s[34] = fwd_header_len = (s[34] + hdr_len) & M16
+            s[36] = fwd_seg_size_min = hdr_len
+
+            # bwd_iat_tot, bwd_iat_mean, bwd_iat_max, bwd_iat_min
+            bwd_iat = s[48]
+            s[49] = bwd_iat_tot = (s[49] + bwd_iat) & M32
+            s[50] = bwd_iat_mean = bwd_iat_tot if tot_bwd == 1 else bwd_iat_tot >> shift[tot_bwd]
+            bwd_iat_max = s[51]
+            if bwd_iat > bwd_iat_max:
+                s[51] = bwd_iat_max = bwd_iat
+            bwd_iat_min = s[52]
+            if bwd_iat < bwd_iat_min and bwd_iat != 0:
+                s[52] = bwd_iat_min = bwd_iat
+
+            # calc_Length_bwd_tot, bwd_header
+            s[22] = pkt_len
+            s[23] = totlen_bwd = (s[23] + pkt_len) & M32
+            s[35] = bwd_header_len = (hdr_len * tot_bwd) & M16
+
+            # calc_dur and active/idle: meta.active_timeout is only set later by init_features,
+            # so the comparison is against 0
+            time_first = s[5]
+            s[9] = flow_duration = (t32 - time_first) & M32
+            if flow_duration > 0:
+                active = (time_last - time_first) & M32
+                if active > 0:
+                    s[55] = active
+                s[60] = (t32 - time_last) & M32
+
+            # packet_len_tot, flow_pkts_tot
+            s[24] = totlen_pkts = (s[21] + s[23]) & M32
+            s[10] = packets = (tot_fwd + tot_bwd) & M8
+
+            # iat_mean, iat_max, iat_min
+            iat = (t32 - s[6]) & M32
+            s[38] = iat
+            s[39] = iat_tot = (s[39] + iat) & M32
+            s[40] = flow_iat_mean = iat_tot if packets == 1 else iat_tot >> shift[packets]
+            flow_iat_max = s[41]
+            if iat > flow_iat_max:
+                s[41] = flow_iat_max = iat
+            s[42] = flow_iat_min = iat
+
+            # active_mean, active_max, active_min
+            active_vals = s[55]
+            s[56] = active_tot = (s[56] + active_vals) & M32
+            s[57] = active_mean = active_tot if packets == 1 else active_tot >> shift[packets]
+            active_max = s[58]
+            if active_vals > active_max:
+                s[58] = active_max = active_vals
+            active_min = s[59]
+            if active_vals < active_min:
+                s[59] = active_min = active_vals
+
+            # idle_mean, idle_max, idle_min
+            idle_vals = s[60]
+            s[61] = idle_tot = (s[61] + idle_vals) & M32
+            s[62] = idle_mean = idle_tot if packets == 1 else idle_tot >> shift[packets]
+            idle_max = s[63]
+            if idle_vals > idle_max:
+                s[63] = idle_max = idle_vals
+            idle_min = s[64]
+            if idle_vals < idle_min:
+                s[64] = idle_min = idle_vals
+
+            # packet_len_mean, packet_len_max, packet_len_min
+            s[33] = pkt_len_mean = totlen_pkts if packets == 1 else totlen_pkts >> shift[packets]
+            pkt_len_max = s[31]
+            if s[25] > pkt_len_max:
+                pkt_len_max = s[25]
+            if s[28] > pkt_len_max:
+                pkt_len_max = s[28]
+            s[31] = pkt_len_max
+            pkt_len_min = s[32]
+            if s[26] <= pkt_len_min:
+                pkt_len_min = s[26]
+            if s[29] <= pkt_len_min:
+                pkt_len_min = s[29]
+            s[32] = pkt_len_min
+
+            # f_fl ... urg_fl; ece_flag defaults to NoAction
+            fin = syn = rst = psh = ack = urg = 0
+            if tcp[i]:
+                f = flags[i]
+                s[13] = fin = (s[13] + ((f & TCP_FIN) != 0)) & M8
+                s[14] = syn = (s[14] + ((f & TCP_SYN) != 0)) & M8
+                s[15] = rst = (s[15] + ((f & TCP_RST) != 0)) & M8
+                s[16] = psh = (s[16] + ((f & TCP_PSH) != 0)) & M8
+                s[17] = ack = (s[17] + ((f & TCP_ACK) != 0)) & M8
+                s[18] = urg = (s[18] + ((f & TCP_URG) != 0)) & M8
+
+            if packets >= packet_thr or (tcp[i] and flags[i] & TCP_FIN):
+                # init_features(): meta.feature0..42
+                emitted_rows.append((
+                    fin, syn, rst, psh, ack, urg, 0, tot_fwd, tot_bwd, totlen_fwd, totlen_bwd,
+                    fwd_pkt_len_min, fwd_pkt_len_max, fwd_pkt_len_mean,
+                    bwd_pkt_len_min, bwd_pkt_len_max, bwd_pkt_len_mean,
+                    pkt_len_max, pkt_len_min, pkt_len_mean,
+                    fwd_header_len, fwd_seg_size_min, bwd_header_len, 0, 0, fwd_act_data_pkts,
+                    flow_iat_min, flow_iat_max, flow_iat_mean,
+                    fwd_iat_min, fwd_iat_max, fwd_iat_tot, fwd_iat_mean,
+                    bwd_iat_min, bwd_iat_max, bwd_iat_tot, bwd_iat_mean,
+                    active_mean, active_min, active_max, idle_mean, idle_max, idle_min))
+                emitted_info.append((switch_ts[i], *key, idx, direction, collided[idx]))
+                registers[idx] = list(INIT_REGISTERS)  # init_register() after the classification
+
+        self.stats["packets"] += n
+        self.stats["new_flows"] += new_flows
+        self.stats["expired"] += expired
+        self.stats["collisions"] += collisions
+        self.stats["dropped"] += dropped
+        self.stats["emitted"] += len(emitted_rows)
+
+        features = np.array(emitted_rows, dtype=np.uint32).reshape(-1, NUM_FEATURES)
+        info = np.array(emitted_info, dtype=np.int64).reshape(-1, len(FLOW_COLUMNS))
+        flows = {name: info[:, k] for k, name in enumerate(FLOW_COLUMNS)}
+        return flows, features
+
+    def extract(self, path, chunk_packets=65536):
+        """Streams (flows, features) chunks for a pcap or CSV trace."""
+        for packets in read_trace(path, chunk_packets):
+            yield self.process(packets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Computes the advanced_tunnel.p4 flow features of a trace")
+    parser.add_argument("trace", help="pcap file or CSV packet trace")
+    parser.add_argument("-o", "--output", default="-", help="output CSV (default stdout)")
+    parser.add_argument("--encap-overhead", type=int, default=MYTUNNEL_HEADER_LEN)
+    parser.add_argument("--flow-timeout", type=int, default=FLOW_TIMEOUT, help="us")
+    parser.add_argument("--packet-thr", type=int, default=PACKET_THR)
+    parser.add_argument("--chunk", type=int, default=65536, help="packets per chunk")
+    parser.add_argument("--rules", help="rules file whose table_entries are used to classify the flows")
+    parser.add_argument("--wl", help="WL id in the rules file (default: every WL)")
+    args = parser.parse_args()
+
+    evaluators = {}
+    if args.rules:
+        from wl_evaluator import WLEvaluator
+        with open(args.rules) as f:
+            table_entries = json.load(f)["table_entries"]
+        for wl, entries in table_entries.items():
+            if args.wl is None or wl == args.wl:
+                evaluators[wl] = WLEvaluator(entries)
+
+    extractor = FeatureExtractor(flow_timeout=args.flow_timeout, packet_thr=args.packet_thr,
+                                 encap_overhead=args.encap_overhead)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    writer = csv.writer(out)
+    writer.writerow(FLOW_COLUMNS + FEATURE_NAMES + [f"class_wl{wl}" for wl in evaluators])
+
+    start = time.perf_counter()
+    for flows, features in extractor.extract(args.trace, args.chunk):
+        columns = [flows[name] for name in FLOW_COLUMNS]
+        columns[1] = [str(ipaddress.IPv4Address(int(ip))) for ip in flows["src_ip"]]
+        columns[2] = [str(ipaddress.IPv4Address(int(ip))) for ip in flows["dst_ip"]]
+        classes = [evaluator.evaluate(features) for evaluator in evaluators.values()]
+        for k in range(len(features)):
+            writer.writerow([column[k] for column in columns] + features[k].tolist() + [c[k] for c in classes])
+    elapsed = time.perf_counter() - start
+    if out is not sys.stdout:
+        out.close()
+
+    stats = extractor.stats
+    print(f"{stats['packets']} packets in {elapsed:.1f}s ({stats['packets'] / max(elapsed, 1e-9) * 60 / 1e6:.2f}M/min), "
+          f"{stats['emitted']} feature vectors, {stats['new_flows']} new flows, {stats['expired']} expired, "
+          f"{stats['collisions']} packets on colliding slots", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+In-memory flow state backing the Prometheus metrics exported by the controller.
+
+The digest and counter hot paths only write plain attributes on small
+per-key records; the metric families are produced from those records by a
+custom collector when Prometheus scrapes /metrics, so no registry lock or
+label lookup is paid per digest.
+"""
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY, Collector
+
+
+class FlowRecord:
+    """Last known values for one (switch, flow) pair. None means never set."""
+
+    __slots__ = (
+        "port", "queue_depth", "queue_time", "switch_time", "sending_rate",
+        "throughput", "digest_delta", "interarrival_time", "packet_length",
+        "total_bytes", "total_packets", "is_malicious", "overhead", "last_seen",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class TunnelCounterRecord:
+    """Ingress/egress tunnel counter values for one (switch, tunnel_id) pair."""
+
+    __slots__ = ("ingress_packets", "ingress_bytes", "egress_packets", "egress_bytes",
+                 "ingress_packet_rate", "ingress_byte_rate", "egress_packet_rate", "egress_byte_rate")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class PortCounterRecord:
+    """Value and rate of one per-port counter cell (switch, counter, port)."""
+
+    __slots__ = ("packets", "bytes", "packet_rate", "byte_rate")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class FlowStateStore:
+    """
+    Per-key state written by DigestManager.
+
+    - flows: {(switch, flow): FlowRecord}
+    - malicious: {(switch, src_ip, dst_ip, src_port, dst_port, protocol, tunnel_id): 1}
+    """
+
+    def __init__(self):
+        self.flows = {}
+        self.malicious = {}
+
+    def flow(self, switch, flow):
+        key = (switch, flow)
+        record = self.flows.get(key)
+        if record is None:
+            record = self.flows[key] = FlowRecord()
+        return record
+
+    def mark_malicious(self, switch, src_ip, dst_ip, src_port, dst_port, protocol, tunnel_id):
+        self.malicious[(switch, src_ip, dst_ip, src_port, dst_port, protocol, tunnel_id)] = 1
+
+
+class CounterStateStore:
+    """
+    Counter state written by CounterManager.
+
+    - tunnels: {(switch, tunnel_id): TunnelCounterRecord}
+    - ports: {(switch, counter, port): PortCounterRecord}
+    """
+
+    def __init__(self):
+        self.tunnels = {}
+        self.ports = {}
+
+    def tunnel(self, switch, tunnel_id):
+        key = (switch, tunnel_id)
+        record = self.tunnels.get(key)
+        if record is None:
+            record = self.tunnels[key] = TunnelCounterRecord()
+        return record
+
+    def port(self, switch, counter, port):
+        key = (switch, counter, port)
+        record = self.ports.get(key)
+        if record is None:
+            record = self.ports[key] = PortCounterRecord()
+        return record
+
+
+# (metric name, help, record attribute, labels the metric is exported with)
+FLOW_METRICS = [
+    ('switch_port_queue_depth', 'Coda di congestione per switch e porta', 'queue_depth', ('switch', 'port', 'flow')),
+    ('queue_time', 'Tempo di attesa in coda', 'queue_time', ('switch', 'port', 'flow')),
+    ('switch_time', 'Tempo di switch', 'switch_time', ('switch', 'flow')),
+    ('interarrival_time', 'Tempo di interarrivo tra pacchetti in ms', 'interarrival_time', ('switch', 'flow')),
+    ('packet_length', 'Lunghezza del pacchetto in Byte', 'packet_length', ('switch', 'flow')),
+    ('sending_rate', 'sending rate in bps', 'sending_rate', ('switch', 'flow')),
+    ('digest_timestamp', 'digest timestamp', 'digest_delta', ('switch', 'flow')),
+    ('last_digest_timestamp', 'last digest timestamp', 'last_seen', ('switch', 'flow')),
+    ('total_byte_count', 'total_byte_count', 'total_bytes', ('switch', 'flow')),
+    ('total_packet_count', 'total_packet_count', 'total_packets', ('switch', 'flow')),
+    ('throughput', 'throughput', 'throughput', ('switch', 'flow')),
+    ('ismalicious_flow', 'malicious flow', 'is_malicious', ('switch', 'flow')),
+    ('overhead', 'overhead ns', 'overhead', ('switch', 'flow')),
+]
+
+MALICIOUS_LABELS = ['switch', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol', 'tunnel_id']
+
+COUNTER_METRICS = [
+    ('ingress_tunnel_packet_count', 'Ingress Tunnel Packet Count', 'ingress_packets'),
+    ('egress_tunnel_packet_count', 'Egress Tunnel Packet Count', 'egress_packets'),
+    ('ingress_tunnel_byte_count', 'Numero di byte ingressi per tunnel', 'ingress_bytes'),
+    ('egress_tunnel_byte_count', 'Numero di byte egressi per tunnel', 'egress_bytes'),
+    ('ingress_tunnel_packet_rate', 'Ingress Tunnel Packet Rate (pps)', 'ingress_packet_rate'),
+    ('egress_tunnel_packet_rate', 'Egress Tunnel Packet Rate (pps)', 'egress_packet_rate'),
+    ('ingress_tunnel_byte_rate', 'Ingress Tunnel Byte Rate (Bps)', 'ingress_byte_rate'),
+    ('egress_tunnel_byte_rate', 'Egress Tunnel Byte Rate (Bps)', 'egress_byte_rate'),
+]
+
+PORT_COUNTER_METRICS = [
+    ('port_counter_packets', 'Per-port counter packets', 'packets'),
+    ('port_counter_bytes', 'Per-port counter bytes', 'bytes'),
+    ('port_counter_packet_rate', 'Per-port counter packet rate (pps)', 'packet_rate'),
+    ('port_counter_byte_rate', 'Per-port counter byte rate (Bps)', 'byte_rate'),
+]
+
+
+class FlowStateCollector(Collector):
+    """Builds the digest gauges from a FlowStateStore at scrape time."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def describe(self):
+        # Metric names are static: describing them lets the registry detect duplicates
+        # without calling collect() at registration time.
+        families = [GaugeMetricFamily(name, doc, labels=list(labels)) for name, doc, _, labels in FLOW_METRICS]
+        families.append(GaugeMetricFamily('malicious_flow', 'Flows detected as malicious', labels=MALICIOUS_LABELS))
+        return families
+
+    def collect(self):
+        # Snapshot the dicts: the digest handler may add keys while we iterate.
+        flows = list(self.store.flows.items())
+        for name, doc, attr, labels in FLOW_METRICS:
+            family = GaugeMetricFamily(name, doc, labels=list(labels))
+            with_port = 'port' in labels
+            for (switch, flow), record in flows:
+                value = getattr(record, attr)
+                if value is None:
+                    continue
+                if with_port:
+                    family.add_metric([str(switch), str(record.port), str(flow)], value)
+                else:
+                    family.add_metric([str(switch), str(flow)], value)
+            yield family
+
+        family = GaugeMetricFamily('malicious_flow', 'Flows detected as malicious', labels=MALICIOUS_LABELS)
+        for labels, value in list(self.store.malicious.items()):
+            family.add_metric([str(v) for v in labels], value)
+        yield family
+
+
+class CounterStateCollector(Collector):
+    """Builds the tunnel counter gauges from a CounterStateStore at scrape time."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def describe(self):
+        families = [GaugeMetricFamily(name, doc, labels=['switch', 'tunnel_id']) for name, doc, _ in COUNTER_METRICS]
+        families += [GaugeMetricFamily(name, doc, labels=['switch', 'counter', 'port'])
+                     for name, doc, _ in PORT_COUNTER_METRICS]
+        return families
+
+    def collect(self):
+        tunnels = list(self.store.tunnels.items())
+        for name, doc, attr in COUNTER_METRICS:
+            family = GaugeMetricFamily(name, doc, labels=['switch', 'tunnel_id'])
+            for (switch, tunnel_id), record in tunnels:
+                value = getattr(record, attr)
+                if value is not None:
+                    family.add_metric([str(switch), str(tunnel_id)], value)
+            yield family
+
+        ports = list(self.store.ports.items())
+        for name, doc, attr in PORT_COUNTER_METRICS:
+            family = GaugeMetricFamily(name, doc, labels=['switch', 'counter', 'port'])
+            for (switch, counter, port), record in ports:
+                value = getattr(record, attr)
+                if value is not None:
+                    family.add_metric([str(switch), str(counter), str(port)], value)
+            yield family
+
+
+def register_collector(collector, registry=REGISTRY):
+    registry.register(collector)
+    return collector
@@ -0,0 +1,300 @@
+"""
+Per-switch flow table rebuilt from the flow-feature registers.
+
+Every slot of the MAX_REGISTER_ENTRIES register arrays is owned by the flow whose
+5-tuple crc16-hashes to it (see p4_hash). The data plane stores that 5-tuple in
+reg_src_ip/reg_dst_ip/reg_src_port/reg_dst_port/reg_protocol when the flow takes
+the slot, and stamps reg_time_last_pkt on every packet.
+
+Reconstruction is incremental: each refresh reads only reg_time_last_pkt as a
+whole array, and re-reads the key registers just for the slots whose timestamp
+moved. A slot is reported as
+  - active:    reg_time_last_pkt != 0
+  - expired:   active but idle for more than FLOW_TIMEOUT (the data plane only
+               recycles it when the next packet hashing there arrives)
+  - collision: the 5-tuples reported by digests for the slot disagree with each
+               other or with the stored key, or the stored key does not hash to the slot
+
+observe() runs for every digest, so it only queues the 5-tuple (at most
+MAX_PENDING_DIGESTS per switch, the oldest are dropped): the slots are hashed in bulk
+and the tuples older than FLOW_TIMEOUT dropped at each refresh.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+from p4_hash import flow_slot
+from register_manager import RegisterManager
+
+logger = logging.getLogger(__name__)
+
+FLOW_TIMEOUT_US = 15000000  # FLOW_TIMEOUT in advanced_tunnel.p4, ingress_global_timestamp is in us
+TIME_MASK = 0xFFFFFFFF  # timestamps are truncated to bit<32>
+AGE_BUCKETS_S = [1, 5, 15, 60]
+MAX_PENDING_DIGESTS = 65536
+
+TIME_REGISTER = "MyIngress.reg_time_last_pkt"
+KEY_REGISTERS = [
+    "MyIngress.reg_flow",
+    "MyIngress.reg_src_ip",
+    "MyIngress.reg_dst_ip",
+    "MyIngress.reg_src_port",
+    "MyIngress.reg_dst_port",
+    "MyIngress.reg_protocol",
+    "MyIngress.reg_time_first_pkt",
+    "MyIngress.reg_tot_fwd_pkts",
+    "MyIngress.reg_tot_bwd_pkts",
+]
+
+
+def _newest_timestamp(stamps):
+    """Most recent of a set of wrapping 32-bit timestamps: the one just before the widest circular gap."""
+    values = np.unique(stamps)
+    gaps = np.diff(np.append(values, values[0] + TIME_MASK + 1))
+    return int(values[int(np.argmax(gaps))])
+
+
+class SwitchFlowTable:
+    """Reconstructed state of one switch."""
+
+    def __init__(self, key_dtype, size):
+        self.keys = np.zeros(size, dtype=key_dtype)
+        self.last_pkt = np.zeros(size, dtype=np.uint32)
+        self.key_ok = np.ones(size, dtype=bool)  # stored 5-tuple hashes to its slot (either direction)
+        self.observed = {}  # {slot: {5-tuple: wall time of the last digest}}
+        self.pending = deque(maxlen=MAX_PENDING_DIGESTS)  # (5-tuple..., wall time) not hashed yet
+        self.clock = None  # (switch time in us, wall time) of the most recent packet seen
+        self.last_refresh = None
+        self.slots_reread = 0
+
+    def switch_now(self, wall_time):
+        """Current switch time estimated from the most recent packet timestamp."""
+        if self.clock is None:
+            return 0
+        switch_time, seen_at = self.clock
+        return (switch_time + int((wall_time - seen_at) * 1e6)) & TIME_MASK
+
+
+class FlowTableManager:
+    def __init__(self, p4info_helper, flow_timeout=FLOW_TIMEOUT_US, full_read_ratio=0.25, poll_interval=5.0):
+        """
+        flow_timeout: idle time (us) after which a slot is reported as expired.
+        full_read_ratio: above this fraction of changed slots a refresh reads the
+                         whole key arrays instead of the single cells.
+        """
+        self.time_registers = RegisterManager(p4info_helper, register_names=[TIME_REGISTER])
+        self.key_registers = RegisterManager(p4info_helper, register_names=KEY_REGISTERS,
+                                             registers_per_request=len(KEY_REGISTERS))
+        self.size = self.time_registers.size
+        self.flow_timeout = flow_timeout
+        self.full_read_ratio = full_read_ratio
+        self.poll_interval = poll_interval
+        self.tables = {}  # {switch name: SwitchFlowTable}
+
+    def _table(self, switch):
+        table = self.tables.get(switch)
+        if table is None:
+            table = self.tables[switch] = SwitchFlowTable(self.key_registers.dtype, self.size)
+        return table
+
+    def _check_keys(self, table, slots):
+        keys = table.keys[slots]
+        forward = flow_slot(keys["reg_src_ip"], keys["reg_dst_ip"], keys["reg_src_port"],
+                            keys["reg_dst_port"], keys["reg_protocol"], self.size)
+        # Backward packets that restart an expired flow store the reversed tuple
+        backward = flow_slot(keys["reg_dst_ip"], keys["reg_src_ip"], keys["reg_dst_port"],
+                             keys["reg_src_port"], keys["reg_protocol"], self.size)
+        key_set = (keys["reg_src_ip"] != 0) | (keys["reg_dst_ip"] != 0)
+        table.key_ok[slots] = ~key_set | (forward == slots) | (backward == slots)
+
+    def refresh(self, sw):
+        """Reads the registers of a switch and updates its table. Returns the slots that changed."""
+        table = self._table(sw.name)
+        now = time.time()
+        last_pkt = self.time_registers.snapshot(sw).data["reg_time_last_pkt"]
+
+        if table.last_refresh is None:
+            changed = np.flatnonzero(last_pkt != 0)
+            table.keys = self.key_registers.snapshot(sw).data
+            table.slots_reread = self.size
+        else:
+            changed = np.flatnonzero(last_pkt != table.last_pkt)
+            if len(changed) > self.full_read_ratio * self.size:
+                table.keys = self.key_registers.snapshot(sw).data
+                table.slots_reread = self.size
+            elif len(changed):
+                table.keys[changed] = self.key_registers.read_slots(sw, changed)
+                table.slots_reread = len(changed)
+            else:
+                table.slots_reread = 0
+
+        if len(changed):
+            self._check_keys(table, changed)
+            stamps = last_pkt[changed].astype(np.int64)
+            stamps = stamps[stamps != 0]
+            if len(stamps):
+                if table.clock is None:
+                    newest = _newest_timestamp(stamps)
+                else:
+                    # The newest timestamp is the one furthest ahead of the previous reference, modulo 2^32
+                    reference = table.clock[0]
+                    newest = (reference + int(((stamps - reference) & TIME_MASK).max())) & TIME_MASK
+                table.clock = (newest, now)
+
+        table.last_pkt = last_pkt
+        table.last_refresh = now
+        self._drain(table)
+        self._prune(table, now)
+        return changed
+
+    def observe(self, switch, src_ip, dst_ip, src_port, dst_port, protocol):
+        """Queues the 5-tuple of a digest received from a switch, used for collision detection."""
+        self._table(switch).pending.append((src_ip, dst_ip, src_port, dst_port, protocol, time.time()))
+
+    def _drain(self, table):
+        """Hashes the queued digests in bulk and records them in table.observed."""
+        batch = []
+        while True:
+            try:
+                batch.append(table.pending.popleft())
+            except IndexError:
+                break
+        if not batch:
+            return
+        src_ip, dst_ip = ([int(ipaddress.IPv4Address(ip)) if isinstance(ip, str) else ip for ip in column]
+                          for column in list(zip(*batch))[:2])
+        src_port, dst_port, protocol = (list(column) for column in list(zip(*batch))[2:5])
+        slots = flow_slot(src_ip, dst_ip, src_port, dst_port, protocol, self.size)
+        reverse_slots = flow_slot(dst_ip, src_ip, dst_port, src_port, protocol, self.size)
+        # A bidirectional flow lives in the slot of the direction seen first: if the reverse
+        # slot already stores this flow, the digest belongs there
+        stored = table.keys[reverse_slots]
+        in_reverse = (stored["reg_src_ip"] == dst_ip) & (stored["reg_dst_ip"] == src_ip) & \
+                     (stored["reg_src_port"] == dst_port) & (stored["reg_dst_port"] == src_port) & \
+                     (stored["reg_protocol"] == protocol)
+        for i, (_, _, _, _, _, seen) in enumerate(batch):
+            key = (src_ip[i], dst_ip[i], src_port[i], dst_port[i], protocol[i])
+            if in_reverse[i]:
+                slot, key = int(reverse_slots[i]), (key[1], key[0], key[3], key[2], key[4])
+            else:
+                slot = int(slots[i])
+            observed = table.observed.setdefault(slot, {})
+            observed[key] = max(seen, observed.get(key, 0))
+
+    def _prune(self, table, now):
+        """Forgets the digests older than the flow timeout."""
+        horizon = self.flow_timeout / 1e6
+        for slot in list(table.observed):
+            seen = {key: t for key, t in table.observed[slot].items() if now - t <= horizon}
+            if seen:
+                table.observed[slot] = seen
+            else:
+                del table.observed[slot]
+
+    @staticmethod
+    def _stored_key(table, slot):
+        row = table.keys[slot]
+        return (int(row["reg_src_ip"]), int(row["reg_dst_ip"]), int(row["reg_src_port"]),
+                int(row["reg_dst_port"]), int(row["reg_protocol"]))
+
+    def _collisions(self, table, now):
+        """Slots where more than one live 5-tuple was seen or the stored key disagrees with the digests."""
+        horizon = self.flow_timeout / 1e6
+        colliding = set()
+        for slot, observed in list(table.observed.items()):
+            seen = [key for key, t in observed.items() if now - t <= horizon]
+            if not seen:
+                continue
+            # The two directions of a flow count as the same flow
+            flows = {min(key, (key[1], key[0], key[3], key[2], key[4])) for key in seen}
+            stored = self._stored_key(table, slot)
+            stored_flow = min(stored, (stored[1], stored[0], stored[3], stored[2], stored[4]))
+            if len(flows) > 1 or (stored[0] and stored_flow not in flows):
+                colliding.add(slot)
+        colliding.update(np.flatnonzero(~table.key_ok & (table.last_pkt != 0)).tolist())
+        return colliding
+
+    def _ages(self, table, now):
+        """Idle time (s) of every slot, from the estimated switch clock."""
+        switch_now = table.switch_now(now)
+        return ((switch_now - table.last_pkt.astype(np.int64)) & TIME_MASK) / 1e6
+
+    def stats(self, switch):
+        table = self.tables.get(switch)
+        if table is None or table.last_refresh is None:
+            return None
+        now = time.time()
+        active = table.last_pkt != 0
+        ages = self._ages(table, now)[active]
+        expired = int((ages > self.flow_timeout / 1e6).sum())
+        num_active = int(active.sum())
+        collisions = len(self._collisions(table, now))
+        histogram = np.histogram(ages, bins=[0] + AGE_BUCKETS_S + [np.inf])[0] if num_active else \
+            np.zeros(len(AGE_BUCKETS_S) + 1, dtype=np.int64)
+        labels = [f"<{AGE_BUCKETS_S[0]}s"] + [f"{a}-{b}s" for a, b in zip(AGE_BUCKETS_S, AGE_BUCKETS_S[1:])] + \
+                 [f">{AGE_BUCKETS_S[-1]}s"]
+
+        return {
+            "slots": self.size,
+            "active": num_active,
+            "allocated": int((table.keys["reg_flow"] != 0).sum()),
+            "occupancy": num_active / self.size,
+            "expired": expired,
+            "collisions": collisions,
+            "collision_rate": collisions / num_active if num_active else 0.0,
+            "age_s": {
+                "p50": float(np.percentile(ages, 50)) if num_active else None,
+                "p90": float(np.percentile(ages, 90)) if num_active else None,
+                "max": float(ages.max()) if num_active else None,
+                "histogram": dict(zip(labels, histogram.tolist())),
+            },
+            "slots_reread": table.slots_reread,
+            "refreshed_at": table.last_refresh,
+        }
+
+    def flows(self, switch, include_expired=True):
+        """Active slots of a switch with their 5-tuple, packet counts and age."""
+        table = self.tables.get(switch)
+        if table is None:
+            return []
+        now = time.time()
+        ages = self._ages(table, now)
+        colliding = self._collisions(table, now)
+        slots = np.flatnonzero(table.last_pkt != 0)
+        result = []
+        for slot in slots.tolist():
+            row = table.keys[slot]
+            expired = bool(ages[slot] > self.flow_timeout / 1e6)
+            if expired and not include_expired:
+                continue
+            result.append({
+                "slot": slot,
+                "src_ip": str(ipaddress.IPv4Address(int(row["reg_src_ip"]))),
+                "dst_ip": str(ipaddress.IPv4Address(int(row["reg_dst_ip"]))),
+                "src_port": int(row["reg_src_port"]),
+                "dst_port": int(row["reg_dst_port"]),
+                "protocol": int(row["reg_protocol"]),
+                "fwd_packets": int(row["reg_tot_fwd_pkts"]),
+                "bwd_packets": int(row["reg_tot_bwd_pkts"]),
+                "age_s": float(ages[slot]),
+                "expired": expired,
+                "collision": slot in colliding,
+            })
+        return result
+
+    async def monitor_flow_tables(self, switches):
+        """Refreshes every switch concurrently each poll_interval seconds."""
+        while True:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(asyncio.to_thread(self.refresh, sw) for sw in switches.values()),
+                                           return_exceptions=True)
+            for sw, result in zip(switches.values(), results):
+                if isinstance(result, Exception):
+                    logger.warning("Flow table refresh failed on %s: %s", sw.name, result)
+            elapsed = time.perf_counter() - start
+            await asyncio.sleep(max(0.0, self.poll_interval - elapsed))
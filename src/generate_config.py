@@ -53,22 +53,31 @@ def parse_topology(topology):
     return HOST_TO_PORT, SWITCH_PORTS, MAC_IP_MAPPING, NUM_SWITCHES, NUM_PORTS, TREE
 
 
-def generate_config(file_path):
-    topology = load_topology(file_path)
-    HOST_TO_PORT, SWITCH_PORTS, MAC_IP_MAPPING, NUM_SWITCHES, NUM_PORTS, TREE = parse_topology(topology)
-    # Update the Prometheus metrics dynamically based on the topology
+def export_metrics(HOST_TO_PORT, SWITCH_PORTS, NUM_SWITCHES, NUM_PORTS):
+    """Update the Prometheus metrics dynamically based on the topology"""
     num_switches.set(NUM_SWITCHES)
     num_ports.set(NUM_PORTS)
 
-    # Update switch connections (links between switches)
+    # Update switch connections (links between switches); links removed by a reload are dropped
+    switch_links.clear()
     for switch1, ports in SWITCH_PORTS.items():
         for switch2, port in ports.items():
             if switch1 != switch2:  # Avoid self-loops
                 switch_links.labels(switch1=switch1, switch2=switch2).set(1)
 
     # Update host connections to switches
+    host_connections.clear()
     for host, port in HOST_TO_PORT.items():
         host_connections.labels(host=host, switch=port).set(1)
+
+
+def generate_config(file_path):
+    """
+    Renders the tables of a topology file as Python source. The controller no longer writes
+    config.py with it: config.py reads the shared topology.Topology (see topology.py).
+    """
+    topology = load_topology(file_path)
+    HOST_TO_PORT, SWITCH_PORTS, MAC_IP_MAPPING, NUM_SWITCHES, NUM_PORTS, TREE = parse_topology(topology)
     config = f"""
 # Define the host and switch port mappings
 HOST_TO_PORT = {HOST_TO_PORT}
@@ -86,9 +95,6 @@ TREE = {TREE}
     return config
 
 
-def generate():
-    file_path = "../p4src/topology.json"
-    config_output = generate_config(file_path)
-    with open("config.py", "w") as f:
-        f.write(config_output)
-    print("Generated network_config.py")
+if __name__ == "__main__":
+    import sys
+    print(generate_config(sys.argv[1] if len(sys.argv) > 1 else "../p4src/topology.json"))
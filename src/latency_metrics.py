@@ -0,0 +1,199 @@
+"""
+Latency histograms of the controller hot paths.
+
+The message path records how long each stage takes with time.perf_counter():
+
+- stream_receive: a StreamMessageResponse returned by the gRPC stream in the listener
+  thread until the event loop picks it up
+- queue_wait: from the event loop receiving the message to PacketIn returning it
+- decode / interpret / gauge_update / sink_enqueue: steps of DigestManager.handle_digest_for_switch,
+  per digest sample
+- mitigation: install_block_on_first_switch for a malicious sample
+- rule_write: P4Runtime Write of a table entry, per table and operation
+
+As for flow_state, the hot path only updates plain counters on small records (no
+registry lock, no label lookup); the Prometheus histograms are built when /metrics
+is scraped and /debug/latency summarizes the same data as JSON. Labels are bounded:
+stages are fixed, keys (switch names, tables) are capped at MAX_KEYS per stage.
+"""
+
+import bisect
+import time
+
+from prometheus_client.core import HistogramMetricFamily
+from prometheus_client.registry import Collector
+
+from flow_state import register_collector
+
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+           float('inf'))
+
+STAGES = ('stream_receive', 'queue_wait', 'decode', 'interpret', 'gauge_update', 'sink_enqueue', 'mitigation')
+
+MAX_KEYS = 64
+OTHER = 'other'
+
+
+class Histogram:
+    """Bucket counts of one (stage, key). Updates are not locked: a concurrent observe may be lost, never corrupted."""
+
+    __slots__ = ('counts', 'sum', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimate from the buckets, interpolating linearly inside a bucket like histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = min(BUCKETS[i], self.max)
+                if upper <= lower:
+                    return upper
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.max
+
+    def summary(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 4)
+
+        return {'count': self.count, 'mean_ms': ms(self.sum / self.count) if self.count else None,
+                'p50_ms': ms(self.quantile(0.5)), 'p90_ms': ms(self.quantile(0.9)),
+                'p99_ms': ms(self.quantile(0.99)), 'max_ms': ms(self.max)}
+
+
+class LatencyStore:
+    """
+    - stages: {(stage, key): Histogram}, key is the switch name
+    - writes: {(table_id, operation): Histogram}
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.stages = {}
+        self.writes = {}
+        self.keys = {}  # stage -> number of distinct keys, to bound the label sets
+        self.table_names = {}
+        self.started = time.time()
+
+    def observe(self, stage, key, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get((stage, key))
+        if histogram is None:
+            histogram = self._new(self.stages, stage, key)
+        histogram.observe(seconds)
+
+    def observe_write(self, table_id, operation, seconds):
+        if not self.enabled:
+            return
+        histogram = self.writes.get((table_id, operation))
+        if histogram is None:
+            histogram = self._new(self.writes, table_id, operation)
+        histogram.observe(seconds)
+
+    def _new(self, histograms, group, key):
+        if self.keys.get(group, 0) >= MAX_KEYS:
+            key = OTHER
+        histogram = histograms.get((group, key))
+        if histogram is None:
+            histogram = histograms[(group, key)] = Histogram()
+            self.keys[group] = self.keys.get(group, 0) + 1
+        return histogram
+
+    def attach(self, switches, p4info_helper=None):
+        """Makes the SwitchConnections report stream, queue and write latencies here."""
+        for sw in switches.values():
+            sw.latency_observer = self.observe
+            sw.write_observer = self.observe_write
+        if p4info_helper is not None:
+            self.table_names = {t.preamble.id: t.preamble.name for t in p4info_helper.p4info.tables}
+
+    def table_name(self, table_id):
+        return self.table_names.get(table_id, str(table_id))
+
+    def reset(self):
+        self.stages = {}
+        self.writes = {}
+        self.keys = {}
+        self.started = time.time()
+
+    def summary(self):
+        """Per stage (all switches merged and per switch) and per table write latency, in ms."""
+        stages = {}
+        for (stage, key), histogram in sorted(list(self.stages.items())):
+            entry = stages.setdefault(stage, {'total': Histogram(), 'switches': {}})
+            entry['total'].merge(histogram)
+            entry['switches'][key] = histogram.summary()
+        writes = {}
+        for (table_id, operation), histogram in sorted(list(self.writes.items()), key=str):
+            writes.setdefault(self.table_name(table_id), {})[operation] = histogram.summary()
+        return {
+            'since': self.started,
+            'enabled': self.enabled,
+            'stages': {stage: dict(entry['total'].summary(), switches=entry['switches'])
+                       for stage, entry in stages.items()},
+            'rule_writes': writes,
+        }
+
+
+class LatencyCollector(Collector):
+    """Builds the latency histograms from a LatencyStore at scrape time."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def describe(self):
+        return [HistogramMetricFamily('controller_stage_latency_seconds', 'Controller message path stage latency',
+                                      labels=['stage', 'switch']),
+                HistogramMetricFamily('controller_rule_write_latency_seconds', 'P4Runtime table write latency',
+                                      labels=['table', 'operation'])]
+
+    def collect(self):
+        family = HistogramMetricFamily('controller_stage_latency_seconds', 'Controller message path stage latency',
+                                       labels=['stage', 'switch'])
+        for (stage, key), histogram in list(self.store.stages.items()):
+            family.add_metric([stage, str(key)], _buckets(histogram), histogram.sum)
+        yield family
+
+        family = HistogramMetricFamily('controller_rule_write_latency_seconds', 'P4Runtime table write latency',
+                                       labels=['table', 'operation'])
+        for (table_id, operation), histogram in list(self.store.writes.items()):
+            family.add_metric([self.store.table_name(table_id), str(operation)], _buckets(histogram), histogram.sum)
+        yield family
+
+
+def _buckets(histogram):
+    buckets, cumulative = [], 0
+    for bound, n in zip(BUCKETS, histogram.counts):
+        cumulative += n
+        buckets.append(('+Inf' if bound == float('inf') else repr(bound), cumulative))
+    return buckets
+
+
+# One store per process, like the Prometheus REGISTRY it is exported through
+LATENCY = LatencyStore()
+register_collector(LatencyCollector(LATENCY))
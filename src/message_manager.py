@@ -4,13 +4,12 @@ import threading
 import binascii
 import socket
 import re
-from scapy.all import Ether
-from tabulate import tabulate
 import ipaddress
 from collections import deque
 import time
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
+from discovery_manager import is_lldp
 
 
 
@@ -28,7 +27,7 @@ class MessageManager:
 
         self.bcast = "ff:ff:ff:ff:ff:ff"  # broadcast
 
-    async def handle_messages_for_switch(self, switch, arp_manager, digest_manager):
+    async def handle_messages_for_switch(self, switch, arp_manager, digest_manager, discovery_manager=None):
         """
         It handles digest messages for a specific switch via the stream channel.
         """
@@ -46,7 +45,11 @@ class MessageManager:
 
                     if message is not None:
                         if message.WhichOneof('update') == 'packet':
-                            arp_manager.handle_packet_for_switch(switch, message)
+                            # LLDP probes of the discovery service, everything else is ARP/IP
+                            if discovery_manager is not None and is_lldp(message.packet.payload):
+                                discovery_manager.handle_packet_for_switch(switch, message)
+                            else:
+                                arp_manager.handle_packet_for_switch(switch, message)
 
                         if message.WhichOneof('update') == 'digest':
                             digest_manager.handle_digest_for_switch(switch, message, timestamp_received)
@@ -58,13 +61,17 @@ class MessageManager:
         except Exception as e:
             print(f"Unexpected error in handle message for switch {switch.name}: {e}")
 
-    async def start(self, switches, arp_manager, digest_manager):
+    async def start(self, switches, arp_manager, digest_manager, discovery_manager=None):
             """
             Start digest management tasks for each switch.
             """
             try:
                 print(f"TREE:{TREE}")
                 print(f"📡 starting the message management for {len(switches)} switch...")
+                # Ogni listener tiene occupato un thread bloccato su next(stream): l'executor di default
+                # (min(32, cpu + 4) thread) lascerebbe fermi gli switch in eccesso sulle macchine piccole
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=len(switches) + 8, thread_name_prefix="stream"))
 
                 tasks = []
                 for switch in switches.values():
@@ -72,10 +79,14 @@ class MessageManager:
 
                         tasks.append(asyncio.create_task(switch.listen_for_messages()))
                         tasks.append(
-                            asyncio.create_task(self.handle_messages_for_switch(switch, arp_manager, digest_manager)))
+                            asyncio.create_task(self.handle_messages_for_switch(switch, arp_manager, digest_manager,
+                                                                discovery_manager)))
                     except Exception as e:
                         print(f"⚠️ Error during task startup for switch {switch}: {e}")
 
+                if discovery_manager is not None:
+                    tasks.append(asyncio.create_task(discovery_manager.run()))
+
                 # Aspetta che tutte le coroutine finiscano
                 await asyncio.gather(*tasks)
 
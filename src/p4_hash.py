@@ -0,0 +1,61 @@
+"""
+Python replica of the hashes used by advanced_tunnel.p4.
+
+The flow-feature registers are indexed by
+    hash(meta.register_index, HashAlgorithm.crc16, 0,
+         {srcAddr, dstAddr, srcPort, dstPort, protocol}, MAX_REGISTER_ENTRIES)
+BMv2's crc16 is CRC-16/ARC (poly 0x8005 reflected, init 0, no final xor) over the
+big-endian concatenation of the fields (4 + 4 + 2 + 2 + 1 bytes), and the result is
+base + crc % max. flow_slot computes it for NumPy arrays of 5-tuples.
+"""
+
+import numpy as np
+
+MAX_REGISTER_ENTRIES = 8192
+
+
+def _crc16_arc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table[byte] = crc
+    return table
+
+
+CRC16_TABLE = _crc16_arc_table()
+
+
+def crc16(data):
+    """CRC-16/ARC of a bytes object."""
+    crc = 0
+    for byte in data:
+        crc = (crc >> 8) ^ int(CRC16_TABLE[(crc ^ byte) & 0xFF])
+    return crc
+
+
+def crc16_rows(rows):
+    """CRC-16/ARC of every row of a (N, L) uint8 array."""
+    crc = np.zeros(rows.shape[0], dtype=np.uint16)
+    for column in range(rows.shape[1]):
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ rows[:, column]) & 0xFF]
+    return crc
+
+
+def flow_key_bytes(src_ip, dst_ip, src_port, dst_port, protocol):
+    """(N, 13) uint8 array with the big-endian field concatenation fed to the hash."""
+    src_ip = np.asarray(src_ip, dtype=np.uint32).reshape(-1)
+    rows = np.empty((len(src_ip), 13), dtype=np.uint8)
+    rows[:, 0:4] = src_ip.astype(">u4").view(np.uint8).reshape(-1, 4)
+    rows[:, 4:8] = np.asarray(dst_ip, dtype=np.uint32).reshape(-1).astype(">u4").view(np.uint8).reshape(-1, 4)
+    rows[:, 8:10] = np.asarray(src_port, dtype=np.uint16).reshape(-1).astype(">u2").view(np.uint8).reshape(-1, 2)
+    rows[:, 10:12] = np.asarray(dst_port, dtype=np.uint16).reshape(-1).astype(">u2").view(np.uint8).reshape(-1, 2)
+    rows[:, 12] = np.asarray(protocol, dtype=np.uint8).reshape(-1)
+    return rows
+
+
+def flow_slot(src_ip, dst_ip, src_port, dst_port, protocol, size=MAX_REGISTER_ENTRIES):
+    """Register slot of each 5-tuple (scalars or arrays), as computed by get_register_index_*."""
+    crc = crc16_rows(flow_key_bytes(src_ip, dst_ip, src_port, dst_port, protocol))
+    return crc.astype(np.int64) % size
@@ -0,0 +1,345 @@
+"""
+Shortest paths over the switch graph of SWITCH_PORTS, computed in the controller.
+
+PathEngine computes once, for a given graph, the hop distance and the next hop between
+every pair of switches: a level-synchronous BFS from all switches at once, one boolean
+matrix product per level (NumPy), so hundreds of switches take a few ms. A route is
+then a walk over the next-hop matrix, and a route constrained to cross a WL node
+(shortest_paths_constrained) is the best src -> w -> dst over the WL nodes w, chosen
+with one vectorized sum over the distance matrix. When joining the two shortest paths
+visits a switch twice for every w, through() looks for a simple path via w instead: a
+detour around one of the two legs, or, when there is none, two paths from w to src and
+to dst sharing no switch (a minimum-cost flow of two units), which always finds one if
+it exists.
+
+get_engine() caches the engines by graph hash (the links between switches and their
+ports): a topology reload or an LLDP change makes a new one, going back to a known
+graph (e.g. a link coming back) reuses the old one.
+
+Switches are named sN and numbered N as in the routes files; host N is attached to sN
+unless the topology says otherwise.
+"""
+
+import hashlib
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+UNREACHABLE = -1
+CACHE_SIZE = 8
+
+
+def graph_key(switches, switch_ports):
+    """Hash of the directed links between switches (with their ports)."""
+    names = set(switches)
+    edges = sorted((a, b, port) for a in switches for b, port in switch_ports.get(a, {}).items() if b in names)
+    return hashlib.sha256(repr((sorted(switches), edges)).encode()).hexdigest()
+
+
+class PathEngine:
+    """
+    - names: switch names, index i of the matrices
+    - dist[i, j]: hops from i to j (UNREACHABLE if none)
+    - next_hop[i, j]: neighbour of i on a shortest path to j (the lowest index among the equal ones)
+    """
+
+    def __init__(self, switches, switch_ports, key=None):
+        started = time.perf_counter()
+        self.key = key or graph_key(switches, switch_ports)
+        self.names = list(switches)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        adjacency = np.zeros((n, n), dtype=bool)
+        for a in self.names:
+            for b in switch_ports.get(a, {}):
+                if b in self.index and b != a:
+                    adjacency[self.index[a], self.index[b]] = True
+        self.adjacency = adjacency
+        self._links = None  # neighbours over the links that exist both ways, for through()
+        self.dist = self._distances(adjacency)
+        self.next_hop = self._next_hops(adjacency, self.dist)
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def _distances(adjacency):
+        n = len(adjacency)
+        dist = np.full((n, n), UNREACHABLE, dtype=np.int32)
+        np.fill_diagonal(dist, 0)
+        # links u -> v grouped by v: a sparse boolean product frontier @ adjacency costs
+        # (sources still expanding) x links per level instead of n^3
+        sources, targets = np.nonzero(adjacency)
+        order = np.argsort(targets, kind='stable')
+        sources, targets = sources[order], targets[order]
+        heads, starts = np.unique(targets, return_index=True)
+        reached = np.eye(n, dtype=bool)
+        frontier = reached.copy()
+        rows = np.arange(n)
+        level = 0
+        while len(rows) and len(sources):
+            level += 1
+            # row i: switches one hop beyond the ones at distance level - 1 from i
+            hit = np.logical_or.reduceat(frontier[:, sources], starts, axis=1)
+            frontier = np.zeros((len(rows), n), dtype=bool)
+            frontier[:, heads] = hit
+            frontier &= ~reached[rows]
+            found, columns = np.nonzero(frontier)
+            dist[rows[found], columns] = level
+            reached[rows] |= frontier
+            expanding = frontier.any(axis=1)
+            rows, frontier = rows[expanding], frontier[expanding]
+        return dist
+
+    @staticmethod
+    def _next_hops(adjacency, dist):
+        n = len(adjacency)
+        next_hop = np.full((n, n), UNREACHABLE, dtype=np.int32)
+        big = np.where(dist == UNREACHABLE, np.iinfo(np.int32).max, dist)
+        for i in range(n):
+            neighbours = np.flatnonzero(adjacency[i])
+            if not len(neighbours):
+                continue
+            # first neighbour with the lowest distance to each destination
+            best = np.argmin(big[neighbours], axis=0)
+            next_hop[i] = np.where(dist[i] > 0, neighbours[best], UNREACHABLE)
+        return next_hop
+
+    def path(self, src, dst):
+        """Shortest path from switch src to dst (names), None if unreachable."""
+        i, j = self.index[src], self.index[dst]
+        if self.dist[i, j] == UNREACHABLE:
+            return None
+        path = [i]
+        while path[-1] != j:
+            path.append(int(self.next_hop[path[-1], j]))
+        return [self.names[k] for k in path]
+
+    def constrained_path(self, src, dst, via):
+        """
+        Path from src to dst through at least one switch of via that visits no switch
+        twice (a walk cannot be a tunnel), None only if there is none. The shortest of
+        the joined shortest paths src -> w -> dst that is simple, over the w in via by
+        total length; if none is, the shortest of the paths through() finds, trying the w
+        by d(src, w) + d(w, dst) (a lower bound) while it is below the best found.
+        """
+        i, j = self.index[src], self.index[dst]
+        candidates = np.array([self.index[w] for w in via if w in self.index], dtype=np.int64)
+        if not len(candidates):
+            return None
+        to_w, from_w = self.dist[i, candidates], self.dist[candidates, j]
+        ok = (to_w != UNREACHABLE) & (from_w != UNREACHABLE)
+        candidates, total = candidates[ok], (to_w + from_w)[ok]
+        order = np.argsort(total, kind='stable')
+        for k in candidates[order]:
+            path = self.path(src, self.names[k])[:-1] + self.path(self.names[k], dst)
+            if len(set(path)) == len(path):
+                return path
+        best = None
+        for k, bound in zip(candidates[order], total[order]):
+            if best is not None and bound >= len(best) - 1:
+                break
+            path = self.through(src, self.names[k], dst)
+            if path is not None and (best is None or len(path) < len(best)):
+                best = path
+        return best
+
+    def _neighbours(self):
+        if self._links is None:
+            both = self.adjacency & self.adjacency.T
+            self._links = [np.flatnonzero(row).tolist() for row in both]
+        return self._links
+
+    def _bfs(self, i, j, blocked):
+        """Shortest path of indexes from i to j avoiding blocked, None if there is none."""
+        links = self._neighbours()
+        previous = {i: None}
+        queue = [i]
+        for u in queue:
+            if u == j:
+                path = [j]
+                while previous[path[-1]] is not None:
+                    path.append(previous[path[-1]])
+                return path[::-1]
+            for v in links[u]:
+                if v not in previous and v not in blocked:
+                    previous[v] = u
+                    queue.append(v)
+        return None
+
+    def through(self, src, w, dst, blocked=()):
+        """
+        Simple path from src to dst through w (names) that avoids the switches in blocked,
+        None only if there is none. First a detour: a shortest src -> w leg, then w -> dst
+        around it, or the other way round. When both get stuck, the two halves are found
+        together, as two paths from w, to src and to dst, sharing no switch: a minimum-cost
+        flow of two units from w (successive shortest paths, Dijkstra with potentials) with
+        every switch split into in -> out of capacity 1, the shortest such path. Only the
+        links that exist in both directions are used.
+        """
+        i, k, j = self.index[src], self.index[w], self.index[dst]
+        blocked = {self.index[name] for name in blocked if name in self.index}
+        if blocked & {i, k, j}:
+            return None
+        if k == i or k == j:
+            path = self._bfs(i, j, blocked)
+        elif i == j:
+            path = None
+        else:
+            path = self._detour(i, k, j, blocked) or self._disjoint_halves(i, k, j, blocked)
+        return None if path is None else [self.names[n] for n in path]
+
+    def _detour(self, i, k, j, blocked):
+        """The shorter of i -> k then k -> j around it, and k -> j then i -> k around it, None if both get stuck."""
+        paths = []
+        head = self._bfs(i, k, blocked | {j})
+        if head is not None:
+            tail = self._bfs(k, j, blocked | set(head[:-1]))
+            if tail is not None:
+                paths.append(head + tail[1:])
+        tail = self._bfs(k, j, blocked | {i})
+        if tail is not None:
+            head = self._bfs(i, k, blocked | set(tail[1:]))
+            if head is not None:
+                paths.append(head + tail[1:])
+        return min(paths, key=len, default=None)
+
+    def _disjoint_halves(self, i, k, j, blocked):
+        links = self._neighbours()
+        n = len(self.names)
+        sink = 2 * n
+        # node 2v is the in side of switch v, 2v + 1 its out side; edge: [to, capacity, cost, reverse, forward]
+        graph = [[] for _ in range(2 * n + 1)]
+
+        def add(u, v, cost):
+            graph[u].append([v, 1, cost, len(graph[v]), True])
+            graph[v].append([u, 0, -cost, len(graph[u]) - 1, False])
+
+        for v in range(n):
+            if v in blocked:
+                continue
+            if v == i or v == j:
+                add(2 * v, sink, 0)
+                continue
+            if v != k:
+                add(2 * v, 2 * v + 1, 0)
+            for u in links[v]:
+                if u not in blocked and u != k:
+                    add(2 * v + 1, 2 * u, 1)
+
+        source = 2 * k + 1
+        potential = [0] * len(graph)
+        for _ in range(2):
+            dist = [np.inf] * len(graph)
+            previous = [None] * len(graph)
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                for e, (v, capacity, cost, _, _) in enumerate(graph[u]):
+                    reduced = d + cost + potential[u] - potential[v]
+                    if capacity and reduced < dist[v]:
+                        dist[v], previous[v] = reduced, (u, e)
+                        heapq.heappush(heap, (reduced, v))
+            if dist[sink] == np.inf:
+                return None
+            for v, d in enumerate(dist):
+                if d != np.inf:
+                    potential[v] += d
+            v = sink
+            while v != source:
+                u, e = previous[v]
+                edge = graph[u][e]
+                edge[1] -= 1
+                graph[v][edge[3]][1] += 1
+                v = u
+
+        def used(u):
+            return [edge[0] for edge in graph[u] if edge[4] and not edge[1]]
+
+        halves = {}
+        for node in used(source):
+            half = [k]
+            while True:
+                half.append(node // 2)
+                out = used(node)[0]
+                if out == sink:
+                    break
+                node = used(out)[0]
+            halves[half[-1]] = half
+        return halves[i][::-1] + halves[j][1:]
+
+    def walk(self, points):
+        """Shortest paths joined through points (names): None if a leg is unreachable, may visit a switch twice."""
+        path = [points[0]]
+        for a, b in zip(points, points[1:]):
+            leg = self.path(a, b)
+            if leg is None:
+                return None
+            path += leg[1:]
+        return path
+
+    def summary(self):
+        return {"key": self.key, "switches": len(self.names), "links": int(self.adjacency.sum()),
+                "build_ms": round(self.build_ms, 3),
+                "unreachable_pairs": int((self.dist == UNREACHABLE).sum())}
+
+
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+
+
+def get_engine(switches, switch_ports):
+    """PathEngine of the graph, from the cache if it was already computed. Returns (engine, cached)."""
+    key = graph_key(switches, switch_ports)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is not None:
+            _engines.move_to_end(key)
+            return engine, True
+    engine = PathEngine(switches, switch_ports, key)
+    with _engines_lock:
+        _engines[key] = engine
+        while len(_engines) > CACHE_SIZE:
+            _engines.popitem(last=False)
+    return engine, False
+
+
+def switch_id(name):
+    """sN -> N, as in the routes files."""
+    return int(name[1:]) if name[1:].isdigit() else name
+
+
+def host_switches(hosts, switch_ports):
+    """Host index -> name of the switch it is attached to."""
+    attached = {neighbour: switch for switch, ports in switch_ports.items() for neighbour in ports}
+    return {i: attached.get(name, f"s{i}") for i, name in hosts.items()}
+
+
+def compute_routes(topology, pairs, via=None):
+    """
+    Routes for the (src host, dst host) pairs, as in the routes files: {"src,dst": [switch
+    ids]}. via: switch ids a route must cross (one of them), e.g. the WL nodes; None for
+    plain shortest paths. Pairs without a route are listed in "unreachable".
+    """
+    started = time.perf_counter()
+    engine, cached = get_engine(topology.switches, topology.switch_ports)
+    attached = host_switches(topology.hosts, topology.switch_ports)
+    via_names = None if via is None else [f"s{w}" for w in via]
+    routes, unreachable = {}, []
+    for src, dst in pairs:
+        src_sw, dst_sw = attached.get(src, f"s{src}"), attached.get(dst, f"s{dst}")
+        if src_sw not in engine.index or dst_sw not in engine.index:
+            unreachable.append(f"{src},{dst}")
+            continue
+        path = engine.path(src_sw, dst_sw) if via_names is None else \
+            engine.constrained_path(src_sw, dst_sw, via_names)
+        if path is None:
+            unreachable.append(f"{src},{dst}")
+        else:
+            routes[f"{src},{dst}"] = [switch_id(name) for name in path]
+    return {"routes": routes, "unreachable": unreachable, "cached": cached, "graph": engine.summary(),
+            "compute_ms": round((time.perf_counter() - started) * 1000, 3)}
@@ -0,0 +1,313 @@
+"""
+Weak-learner placement computed in the controller (POST /placement).
+
+The upload files carry the outcome of an external run: which switches host a WL
+(wl_nodes), the color of each one and the routes crossing them. Every route has to
+cross one WL of each color (in any order), so that the packet meets the whole
+ensemble. place() recomputes this on the current switch graph and traffic matrix:
+
+- greedy: one color at a time, the switch that makes the routes shortest through the
+  colors placed so far; then, up to budget WLs, the (switch, color) that lowers the
+  cost most
+- local search: removes a WL (if its color keeps another one), recolors it or moves it
+  to the best other switch, first improvement, until no move helps or time_limit runs
+  out
+
+The cost of a route is the length of the shortest walk src -> WL of a color -> ... ->
+dst over the color orders, computed for all pairs at once as min-plus products over
+the distance matrix of path_engine, with a Held-Karp recursion over the subsets of
+colors (2^colors products instead of one chain per order); for a new WL the walks
+before and after it are shared by all the candidate switches, so one greedy or move
+step prices every switch at once. A route crossing no WL of some color costs
+UNCOVERED_PENALTY times the number of switches.
+
+The routes returned are simple paths (a walk visiting a switch twice cannot be a
+tunnel): the joined shortest paths of the best walk that is one, or else, over the WL
+sequences by walk length, one leg at a time with PathEngine.through() avoiding the
+switches already used. A pair with none is not covered. solution_cost is the one of
+these routes: the sum over the pairs of weight x hops (the penalty above if not
+covered), plus node_cost per WL; the optimizer's own estimate is search.model_cost.
+The metrics are the ones of the upload files, for the REST gauges:
+num_nodes_deployed, average_path_weight (hops), percentage_covered (routes),
+solution_cost, run_time (seconds).
+"""
+
+import itertools
+import time
+
+import numpy as np
+
+from path_engine import UNREACHABLE, get_engine, host_switches, switch_id
+
+UNCOVERED_PENALTY = 4
+MAX_WALKS = 5000  # WL sequences considered when building the routes
+ROUTE_TRIES = 64  # shortest ones joined per pair before giving up on it
+
+
+def _min_plus(a, b):
+    """(min over k of a[i, k] + b[k, j]) for every i, j."""
+    return (a[:, :, None] + b[None, :, :]).min(axis=1)
+
+
+class PlacementSolver:
+    """
+    - dist: hop distances between switches (float, inf if unreachable)
+    - src / dst: switch index of each pair, weight: its traffic
+    - candidates: switch indexes that may host a WL
+    """
+
+    def __init__(self, engine, pairs, weights, colors, candidates, budget=None, node_cost=0.0):
+        if colors < 1:
+            raise ValueError("colors must be at least 1")
+        self.engine = engine
+        self.colors = colors
+        self.budget = max(budget or colors, colors)
+        self.node_cost = node_cost
+        self.dist = np.where(engine.dist == UNREACHABLE, np.inf, engine.dist).astype(np.float64)
+        self.src = np.array([s for s, _ in pairs], dtype=np.int64)
+        self.dst = np.array([d for _, d in pairs], dtype=np.int64)
+        self.weight = np.asarray(weights, dtype=np.float64)
+        self.candidates = list(candidates)
+        if len(self.candidates) < colors:
+            raise ValueError(f"{colors} colors need at least {colors} candidate switches, "
+                             f"{len(self.candidates)} given")
+        # rows and columns of the distance matrix actually needed: the pair endpoints
+        self.sources, self.src_pos = np.unique(self.src, return_inverse=True)
+        self.targets, self.dst_pos = np.unique(self.dst, return_inverse=True)
+        self.penalty = UNCOVERED_PENALTY * max(len(engine.names), 1)
+        self.evaluations = 0
+
+    def _groups(self, assignment, colors):
+        return {c: np.array([n for n, color in assignment.items() if color == c], dtype=np.int64) for c in colors}
+
+    def _walks(self, groups, colors, ends, forward=True):
+        """
+        Held-Karp over the colors: {(set of colors X, last color l): shortest walks from
+        ends through one WL of each color of X ending on the WLs of l} (ends x WLs of l);
+        backward (forward=False) the walks start on l and end at ends (WLs of l x ends).
+        """
+        walks = {}
+        for size in range(1, len(colors) + 1):
+            for subset in itertools.combinations(colors, size):
+                subset = frozenset(subset)
+                for last in subset:
+                    group = groups[last]
+                    rest = subset - {last}
+                    if not rest:
+                        walks[subset, last] = self.dist[np.ix_(ends, group)] if forward else \
+                            self.dist[np.ix_(group, ends)]
+                        continue
+                    steps = [_min_plus(walks[rest, m], self.dist[np.ix_(groups[m], group)]) if forward else
+                             _min_plus(self.dist[np.ix_(group, groups[m])], walks[rest, m]) for m in rest]
+                    walks[subset, last] = np.minimum.reduce(steps)
+        return walks
+
+    def pair_costs(self, assignment, colors=None):
+        """Shortest walk of every pair through one WL of each color of colors (all by default)."""
+        colors = list(range(1, self.colors + 1) if colors is None else colors)
+        groups = self._groups(assignment, colors)
+        if any(not len(g) for g in groups.values()):
+            return np.full(len(self.src), np.inf)
+        walks = self._walks(groups, colors, self.sources)
+        every = frozenset(colors)
+        best = np.minimum.reduce([_min_plus(walks[every, last], self.dist[np.ix_(groups[last], self.targets)])
+                                  for last in colors])
+        return best[self.src_pos, self.dst_pos]
+
+    def insertion_costs(self, assignment, color, colors=None):
+        """
+        pairs x candidates: pair_costs once a WL of color is added on each candidate. The
+        walks to the candidates over each subset of the other colors and from them over
+        the rest are computed once for all the candidates.
+        """
+        colors = sorted(set(range(1, self.colors + 1) if colors is None else colors) | {color})
+        groups = self._groups(assignment, colors)
+        others = [c for c in colors if c != color]
+        cand = np.array(self.candidates, dtype=np.int64)
+        if any(not len(groups[c]) for c in others):
+            return np.full((len(self.src), len(cand)), np.inf)
+        heads = self._walks(groups, others, self.sources)
+        tails = self._walks(groups, others, self.targets, forward=False)
+        best = None
+        for size in range(len(others) + 1):
+            for before in itertools.combinations(others, size):
+                before, after = frozenset(before), frozenset(others) - frozenset(before)
+                head = np.minimum.reduce([_min_plus(heads[before, l], self.dist[np.ix_(groups[l], cand)])
+                                          for l in before]) if before else self.dist[np.ix_(self.sources, cand)]
+                tail = np.minimum.reduce([_min_plus(self.dist[np.ix_(cand, groups[l])], tails[after, l])
+                                          for l in after]) if after else self.dist[np.ix_(cand, self.targets)]
+                costs = head[self.src_pos] + tail[:, self.dst_pos].T
+                best = costs if best is None else np.minimum(best, costs, out=best)
+        if len(groups[color]):
+            best = np.minimum(best, self.pair_costs(assignment, colors)[:, None])
+        return best
+
+    def total(self, costs, nodes):
+        """solution_cost of pair costs (a vector, or pairs x candidates) with nodes WLs."""
+        self.evaluations += 1 if costs.ndim == 1 else costs.shape[1]
+        costs = np.where(np.isinf(costs), self.penalty, costs)
+        return self.weight @ costs + self.node_cost * nodes
+
+    def cost(self, assignment, colors=None):
+        return float(self.total(self.pair_costs(assignment, colors), len(assignment)))
+
+    def best_insertion(self, assignment, color, colors=None):
+        """(cost, candidate) of the best switch not in assignment to add a WL of color on."""
+        totals = self.total(self.insertion_costs(assignment, color, colors), len(assignment) + 1)
+        totals[[k for k, n in enumerate(self.candidates) if n in assignment]] = np.inf
+        k = int(np.argmin(totals))
+        return float(totals[k]), self.candidates[k]
+
+    # ---------------- heuristic ----------------
+    def greedy(self, deadline=None):
+        """One WL per color, then WLs up to budget while they lower the cost (and deadline allows)."""
+        assignment = {}
+        for color in range(1, self.colors + 1):
+            _, node = self.best_insertion(assignment, color, range(1, color + 1))
+            assignment[node] = color
+        current = self.cost(assignment)
+        while len(assignment) < min(self.budget, len(self.candidates)) and \
+                (deadline is None or time.perf_counter() < deadline):
+            best, node, color = min(self.best_insertion(assignment, c) + (c,) for c in range(1, self.colors + 1))
+            if best >= current - 1e-9:
+                break
+            assignment[node], current = color, best
+        return assignment, current
+
+    def local_search(self, assignment, current, deadline):
+        """First improvement over: remove a WL, recolor it, move it to the best other switch."""
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for node, color in list(assignment.items()):
+                if time.perf_counter() >= deadline:
+                    break
+                rest = {n: c for n, c in assignment.items() if n != node}
+                moves = []
+                if color in rest.values():
+                    moves.append((self.cost(rest), rest))
+                    moves += [(self.cost({**rest, node: other}), {**rest, node: other})
+                              for other in range(1, self.colors + 1) if other != color]
+                cost, target = self.best_insertion(rest, color)
+                moves.append((cost, {**rest, target: color}))
+                cost, candidate = min(moves, key=lambda move: move[0])
+                if cost < current - 1e-9:
+                    assignment, current, improved = candidate, cost, True
+                    break
+        return assignment, current
+
+    # ---------------- routes ----------------
+    def waypoints(self, assignment):
+        """WL sequences a route can cross (one per color, every order) and their inner length."""
+        groups = [[n for n, c in assignment.items() if c == color] for color in range(1, self.colors + 1)]
+        sequences = itertools.islice(itertools.chain.from_iterable(
+            itertools.product(*(groups[c] for c in order)) for order in itertools.permutations(range(self.colors))),
+            MAX_WALKS)
+        sequences = np.array(list(sequences), dtype=np.int64).reshape(-1, self.colors)
+        inner = self.dist[sequences[:, :-1], sequences[:, 1:]].sum(axis=1)
+        return sequences, inner
+
+    def route(self, i, j, waypoints):
+        """
+        Simple path (switch names) from i to j through one of waypoints, None if not found:
+        the first joined walk that is simple, else the shortest leg-by-leg search over the
+        sequences while their walk length is below it.
+        """
+        sequences, inner = waypoints
+        lengths = self.dist[i, sequences[:, 0]] + inner + self.dist[sequences[:, -1], j]
+        order = np.argsort(lengths, kind='stable')
+        order = order[np.isfinite(lengths[order])]
+        for k in order[:ROUTE_TRIES]:
+            path = self.engine.walk([self.engine.names[n] for n in (i, *sequences[k], j)])
+            if len(set(path)) == len(path):
+                return path
+        best = None
+        for k in order:
+            if best is not None and lengths[k] >= len(best) - 1:
+                break
+            path = self._simple_walk([self.engine.names[n] for n in (i, *sequences[k], j)])
+            if path is not None and (best is None or len(path) < len(best)):
+                best = path
+        return best
+
+    def _simple_walk(self, points):
+        """
+        Simple path visiting points in order, one leg at a time: through() from the last
+        point reached via the next one to the one after, kept up to the next one, avoiding
+        the switches already on the path and the points still to come. None if a leg gets
+        stuck. A WL on src or dst is just the endpoint.
+        """
+        points = [p for m, p in enumerate(points) if m == 0 or p != points[m - 1]]
+        path = [points[0]]
+        for m in range(1, len(points)):
+            blocked = set(path[:-1]) | set(points[m + 2:])
+            leg = self.engine.through(path[-1], points[m], points[min(m + 1, len(points) - 1)], blocked)
+            if leg is None:
+                return None
+            path += leg[1:leg.index(points[m]) + 1]
+        return path
+
+
+def place(topology, pairs, colors, weights=None, candidates=None, budget=None, node_cost=0.0, time_limit=1.0):
+    """
+    WL placement for the (src host, dst host) pairs of topology. weights: traffic of
+    each pair (1 by default); candidates: switch ids that may host a WL (all by
+    default); budget: at most this many WLs (colors by default, one per color). Returns
+    {wl_nodes, deployment {switch id: color}, routes, uncovered, metrics}, ready for
+    WLManager.install_wl_rules(wl_nodes, switches, deployment) and the routes files.
+    """
+    started = time.perf_counter()
+    engine, cached = get_engine(topology.switches, topology.switch_ports)
+    attached = host_switches(topology.hosts, topology.switch_ports)
+    weights = [1.0] * len(pairs) if weights is None else list(weights)
+    if len(weights) != len(pairs):
+        raise ValueError("one weight per pair")
+    kept, indexes, uncovered = [], [], []
+    for (src, dst), weight in zip(pairs, weights):
+        src_sw, dst_sw = attached.get(src, f"s{src}"), attached.get(dst, f"s{dst}")
+        if src_sw in engine.index and dst_sw in engine.index:
+            kept.append((src, dst, weight))
+            indexes.append((engine.index[src_sw], engine.index[dst_sw]))
+        else:
+            uncovered.append(f"{src},{dst}")
+    if candidates is None:
+        candidate_idx = range(len(engine.names))
+    else:
+        candidate_idx = [engine.index[f"s{c}"] for c in candidates if f"s{c}" in engine.index]
+    solver = PlacementSolver(engine, indexes, [w for _, _, w in kept], colors, candidate_idx, budget, node_cost)
+
+    assignment, cost = solver.greedy(started + time_limit)
+    greedy_cost = cost
+    assignment, model_cost = solver.local_search(assignment, cost, started + time_limit)
+
+    # solution_cost of the routes actually produced, not of the walks the optimizer priced
+    cost = solver.penalty * (sum(weights) - sum(w for _, _, w in kept)) + solver.node_cost * len(assignment)
+    routes, hops = {}, []
+    waypoints = solver.waypoints(assignment)
+    for (src, dst, weight), (i, j) in zip(kept, indexes):
+        path = solver.route(i, j, waypoints)
+        if path is None:
+            uncovered.append(f"{src},{dst}")
+            cost += weight * solver.penalty
+        else:
+            routes[f"{src},{dst}"] = [switch_id(name) for name in path]
+            hops.append(len(path) - 1)
+            cost += weight * hops[-1]
+    deployment = {switch_id(engine.names[n]): color for n, color in sorted(assignment.items())}
+    run_time = time.perf_counter() - started
+    return {
+        "wl_nodes": sorted(deployment),
+        "deployment": deployment,
+        "routes": routes,
+        "uncovered": uncovered,
+        "metrics": {
+            "nodes": len(engine.names),
+            "colors": colors,
+            "run_time": round(run_time, 6),
+            "solution_cost": round(cost, 3),
+            "num_nodes_deployed": len(deployment),
+            "average_path_weight": round(sum(hops) / len(hops), 3) if hops else 0.0,
+            "percentage_covered": round(100.0 * len(routes) / len(pairs), 2) if pairs else 100.0,
+        },
+        "search": {"greedy_cost": round(greedy_cost, 3), "model_cost": round(model_cost, 3), "evaluations": solver.evaluations, "cached_graph": cached},
+    }
@@ -0,0 +1,152 @@
+"""
+Bulk snapshots of the per-flow feature registers of advanced_tunnel.p4.
+
+A snapshot reads whole register arrays with wildcard reads, several registers
+per ReadRequest, and decodes them into a NumPy structured array with one row
+per flow slot and one field per register (e.g. snapshot.data["reg_src_ip"][slot]).
+"""
+
+import logging
+import time
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Registers read per ReadRequest: 8 arrays x 8192 cells keeps a response well
+# below the 4 MB default gRPC message limit.
+DEFAULT_REGISTERS_PER_REQUEST = 8
+# Same bound for reads of individual cells
+MAX_CELLS_PER_REQUEST = 8 * 8192
+
+
+def _uint_dtype(bitwidth):
+    for size in (1, 2, 4, 8):
+        if bitwidth <= size * 8:
+            return np.dtype(f"u{size}")
+    raise ValueError(f"unsupported register width {bitwidth}")
+
+
+def decode_bitstrings(bitstrings, dtype):
+    """Decodes big-endian P4Runtime bitstrings (possibly shorter than the width) into dtype."""
+    size = dtype.itemsize
+    raw = b"".join(b.rjust(size, b"\0") for b in bitstrings)
+    return np.frombuffer(raw, dtype=dtype.newbyteorder(">")).astype(dtype)
+
+
+class RegisterSnapshot:
+    def __init__(self, switch, timestamp, data):
+        self.switch = switch
+        self.timestamp = timestamp
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class RegisterDiff:
+    """
+    Changes between two snapshots.
+
+    - slots: sorted flow slots where at least one register changed
+    - fields: {register: slots where that register changed}
+    """
+
+    def __init__(self, slots, fields, previous, current):
+        self.slots = slots
+        self.fields = fields
+        self.previous = previous
+        self.current = current
+
+    def rows(self):
+        """(old, new) structured rows of the changed slots."""
+        return self.previous.data[self.slots], self.current.data[self.slots]
+
+
+class RegisterManager:
+    def __init__(self, p4info_helper, register_names=None, registers_per_request=DEFAULT_REGISTERS_PER_REQUEST):
+        """
+        register_names: full register names to snapshot; by default every MyIngress.reg_*
+        register, i.e. the MAX_REGISTER_ENTRIES flow-feature arrays.
+        """
+        self.p4info_helper = p4info_helper
+        self.registers_per_request = registers_per_request
+
+        if register_names is None:
+            registers = [r for r in p4info_helper.p4info.registers if r.preamble.name.startswith("MyIngress.reg_")]
+        else:
+            registers = [p4info_helper.get("registers", name=name) for name in register_names]
+        if not registers:
+            raise ValueError("no registers to snapshot")
+
+        self.registers = {}  # {register_id: (field name, dtype)}
+        fields = []
+        for register in registers:
+            field = register.preamble.name.split(".")[-1]
+            dtype = _uint_dtype(register.type_spec.bitstring.bit.bitwidth)
+            self.registers[register.preamble.id] = (field, dtype)
+            fields.append((field, dtype))
+        self.size = max(register.size for register in registers)
+        self.dtype = np.dtype(fields)
+
+    def snapshot(self, sw):
+        """Reads all configured registers of a switch into a RegisterSnapshot."""
+        data = np.zeros(self.size, dtype=self.dtype)
+        register_ids = list(self.registers)
+        timestamp = time.time()
+
+        for start in range(0, len(register_ids), self.registers_per_request):
+            cells = defaultdict(lambda: ([], []))
+            for response in sw.ReadRegisterArrays(register_ids[start:start + self.registers_per_request]):
+                for entity in response.entities:
+                    entry = entity.register_entry
+                    indices, values = cells[entry.register_id]
+                    indices.append(entry.index.index)
+                    values.append(entry.data.bitstring)
+
+            for register_id, (indices, values) in cells.items():
+                field, dtype = self.registers[register_id]
+                data[field][np.asarray(indices, dtype=np.int64)] = decode_bitstrings(values, dtype)
+
+        return RegisterSnapshot(sw.name, timestamp, data)
+
+    def read_slots(self, sw, slots):
+        """
+        Reads the configured registers only at the given slots.
+        Returns a structured array with one row per slot, in the order of slots.
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        rows = np.zeros(len(slots), dtype=self.dtype)
+        if len(slots) == 0:
+            return rows
+        position = {slot: i for i, slot in enumerate(slots.tolist())}
+        cells = [(register_id, slot) for register_id in self.registers for slot in slots.tolist()]
+
+        for start in range(0, len(cells), MAX_CELLS_PER_REQUEST):
+            values = defaultdict(lambda: ([], []))
+            for response in sw.ReadRegisterCells(cells[start:start + MAX_CELLS_PER_REQUEST]):
+                for entity in response.entities:
+                    entry = entity.register_entry
+                    indices, bitstrings = values[entry.register_id]
+                    indices.append(position[entry.index.index])
+                    bitstrings.append(entry.data.bitstring)
+
+            for register_id, (indices, bitstrings) in values.items():
+                field, dtype = self.registers[register_id]
+                rows[field][np.asarray(indices, dtype=np.int64)] = decode_bitstrings(bitstrings, dtype)
+        return rows
+
+    def diff(self, previous, current, fields=None):
+        """Slots and registers that changed between two snapshots of the same switch."""
+        if previous.switch != current.switch:
+            raise ValueError(f"snapshots of different switches: {previous.switch}, {current.switch}")
+
+        changed_any = np.zeros(len(current.data), dtype=bool)
+        changed = {}
+        for field in fields or self.dtype.names:
+            mask = previous.data[field] != current.data[field]
+            if mask.any():
+                changed[field] = np.flatnonzero(mask)
+                changed_any |= mask
+        return RegisterDiff(np.flatnonzero(changed_any), changed, previous, current)
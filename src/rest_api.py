@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import os
 import sys
+# first, so that the profile also covers the imports below (/debug/startup)
+from startup_profile import STARTUP, preload_heavy_modules
+import hashlib
 import json
 import logging
 import re
@@ -9,37 +12,47 @@ from fastapi import HTTPException
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from prometheus_client import Gauge
-from fastapi.responses import Response
+from fastapi.responses import Response, FileResponse, JSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security.api_key import APIKeyHeader
+STARTUP.lap("import:web")
 
 # Import P4Runtime lib from parent utils dir
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../utils/'))
-import generate_config
 import asyncio
 import time
 
-generate_config.generate()
-
 from switch_connection_manager import SwitchConnectionManager
 from tunnelling_manager import TunnelManager
 from routing_table_manager import TableManager
 from counter_manager import CounterManager
+from flow_table_manager import FlowTableManager
 # from queue_state_manager import QueueStateManager
 from arp_manager import ArpManager
 from spanningtree_manager import SpanningTree
 from message_manager import MessageManager
 from digest_manager import DigestManager
 from WL_manager import WLManager
+from tree_compiler import compile_tree, validate_entries
+from stream_recorder import StreamRecorder
+from timeseries_store import TimeSeriesStore, DEFAULT_MAX_BYTES, DEFAULT_RAW_CAPACITY, DEFAULT_ROLLUP_CAPACITY
+from latency_metrics import LATENCY
+from warm_restart import DesiredState
+from discovery_manager import DiscoveryManager
+from failover_manager import FailoverManager
+from path_engine import compute_routes
+from placement_manager import place
 import p4runtime_lib.helper
 import p4runtime_lib.bmv2
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
 from config import MAC_IP_MAPPING
 from config import NUM_SWITCHES, SWITCH_PORTS, HOST_TO_PORT
+from topology import Topology, get_topology
 from concurrent.futures import ThreadPoolExecutor
+STARTUP.lap("import:controller")
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger('grpc')
@@ -50,6 +63,10 @@ instrumentator.instrument(app).expose(app)
 switches = {}
 controller = None
 controller_started = False
+# serializes the topology changes (/topology/reload, /topology/links, LLDP discovery):
+# topology.update mutates SWITCH_PORTS in place while the multicast and tunnel updates
+# of another change may be reading it in worker threads
+topology_lock = asyncio.Lock()
 
 nodes_gauge = Gauge("file_nodes", "Number of nodes in the input file")
 colors_gauge = Gauge("file_colors", "Number of colors in the input file")
@@ -85,30 +102,72 @@ class P4Controller:
             return
 
         self.p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
-        self.switch_manager = SwitchConnectionManager(self.p4info_helper, bmv2_file_path, NUM_SWITCHES)
+        STARTUP.lap("p4info")
+        STARTUP.info["p4info_from_cache"] = self.p4info_helper.from_cache
+        # the parsed topology is cached for the next start here, not when config is imported
+        STARTUP.info["topology_from_cache"] = get_topology().from_cache
+        get_topology().save_cache()
+        # what the controller writes is recorded so that a warm restart (P4_RESTART=warm) can reconcile against it
+        self.desired_state = DesiredState.load()
+        self.restart_report = None
+        self.switch_manager = SwitchConnectionManager(self.p4info_helper, bmv2_file_path, NUM_SWITCHES,
+                                                      desired_state=self.desired_state)
         self.tunnel_manager = TunnelManager(self.p4info_helper, self.switch_manager.switches)
         self.table_manager = TableManager(self.p4info_helper)
-        self.digest_manager = DigestManager(self.p4info_helper, self.switch_manager.switches)
+        # history of /flows/{tunnel_id}/history: memory capped by P4_HISTORY_MAX_BYTES
+        self.timeseries = TimeSeriesStore(
+            raw_capacity=int(os.environ.get("P4_HISTORY_RAW_SAMPLES", DEFAULT_RAW_CAPACITY)),
+            rollup_capacity=int(os.environ.get("P4_HISTORY_ROLLUP_BUCKETS", DEFAULT_ROLLUP_CAPACITY)),
+            max_bytes=int(os.environ.get("P4_HISTORY_MAX_BYTES", DEFAULT_MAX_BYTES)))
+        self.digest_manager = DigestManager(self.p4info_helper, self.switch_manager.switches,
+                                            timeseries=self.timeseries)
         self.arp_manager = ArpManager(self.p4info_helper, self.switch_manager.switches)
         self.message_manager = MessageManager(self.p4info_helper, self.switch_manager.switches)
         self.spanningtree_manager = SpanningTree(SWITCH_PORTS)
         self.counter_manager = CounterManager(self.p4info_helper)
+        self.flow_table_manager = FlowTableManager(self.p4info_helper)
+        self.digest_manager.flow_table = self.flow_table_manager
         # self.queue_state_manager = QueueStateManager(self.p4info_helper)
         self.WL_manager = WLManager(self.p4info_helper, self.switch_manager.switches)
+        self.stream_recorder = StreamRecorder()
+        self.latency = LATENCY
+        # LLDP discovery of the links between switches (P4_DISCOVERY=1), created once the switches are up
+        self.discovery_manager = None
+        self.failover_manager = FailoverManager(self.p4info_helper)
+        self.digest_manager.failover = self.failover_manager
+        STARTUP.lap("managers")
 
     async def run(self):
         global controller_started
         global switches
+        started = time.perf_counter()
         try:
             if not controller_started:
                 logger.info("Starting switch connections")
                 self.switch_manager.create_connections()
                 self.switch_manager.update_master()
                 controller_started = True
-            self.switch_manager.install_p4_program()
-
+                STARTUP.lap("switch connections")
+            # Only the tree: figures and Excel report are generated in a separate process (or on
+            # request with P4_TOPOLOGY_REPORT=lazy), and not at all if the topology is unchanged
             self.spanningtree_manager.build_tree()
-            self.switch_manager.create_multicast_group()
+            if os.environ.get("P4_TOPOLOGY_REPORT", "background") == "background":
+                self.spanningtree_manager.generate_report_background()
+            STARTUP.lap("spanning tree")
+
+            if os.environ.get("P4_RESTART", "cold") == "warm":
+                # pipeline pushed only where it changed, entries reconciled with the desired state
+                self.restart_report = self.switch_manager.warm_start()
+            else:
+                self.switch_manager.install_p4_program()
+                self.switch_manager.create_multicast_group()
+            STARTUP.lap("pipeline")
+            STARTUP.info["restart"] = os.environ.get("P4_RESTART", "cold")
+            STARTUP.info["switch_phases_ms"] = {phase: round(t["total_s"] * 1000, 3)
+                                                for phase, t in self.switch_manager.timings.items()}
+            # connect/arbitration/install run on all switches at once: each lasts as its slowest switch
+            logger.info("Switch setup phases (ms): %s",
+                        {phase: round(t["total_s"] * 1000, 1) for phase, t in self.switch_manager.timings.items()})
             switches = self.switch_manager.get_switches()
 
             if not switches:
@@ -117,12 +176,29 @@ class P4Controller:
                 # Recreates the dictionary with keys starting at 1 to be consistent with the switch name
                 switches = {idx + 1: switch for idx, switch in enumerate(switches.values())}
                 logger.info(f"Switches initialized: {switches}")
+                self.latency.attach(switches, self.p4info_helper)
+                # P4_STREAM_RECORD_DIR records the StreamChannel of every switch from startup
+                if os.environ.get("P4_STREAM_RECORD_DIR"):
+                    self.stream_recorder.start(switches, os.environ["P4_STREAM_RECORD_DIR"])
                 # self.WL_manager.inizializeWL(switches)
-            await self.message_manager.start(switches, self.arp_manager, self.digest_manager)
+                # Counter arrays are polled in the background, RPCs run in worker threads
+                logger.info("Starting counter polling")
+                self.counter_task = asyncio.create_task(self.counter_manager.monitor_tunnel_counters(switches))
+                self.flow_table_task = asyncio.create_task(self.flow_table_manager.monitor_flow_tables(switches))
+            self.ready_after = time.perf_counter() - started
+            logger.info("Controller ready in %.3f s", self.ready_after)
+            STARTUP.lap("monitoring")
+            STARTUP.mark("ready")
+            # scapy is needed by the first ARP packet-in: imported now, off the startup path
+            preload_heavy_modules()
+            if switches and os.environ.get("P4_DISCOVERY", "0") == "1":
+                self.discovery_manager = DiscoveryManager(self.p4info_helper, switches, get_topology(),
+                                                          on_change=apply_topology)
+                self.discovery_manager.listeners.append(self.failover_manager.on_links)
+            await self.message_manager.start(switches, self.arp_manager, self.digest_manager,
+                                             self.discovery_manager)
             # start_monitoring_threads(switches, controller, self.arp_manager, self.digest_manager)
             # self.arp_manager.start(switches)
-            # Monitor tunnel counters with ThreadPoolExecutor
-            # logger.info("Starting tunnel counter monitoring using ThreadPoolExecutor")
 
 
 
@@ -167,7 +243,24 @@ def export_with_timeout(path, switches, timeout=10, fmt=None):
             raise RuntimeError("Export timeout")
 
 
-def install_tunnel_rules():
+def _failover_path(tunnel_id, route, path, dst_eth_addr):
+    """Registers the tunnel with FailoverManager; path (switch ids) to install, the backup if the primary is broken."""
+    try:
+        ids = {sw.name: sw_id for sw_id, sw in switches.items()}
+        active = controller.failover_manager.register(tunnel_id, route, [switches[i].name for i in path],
+                                                      dst_eth_addr, switches)
+        return [ids[name] for name in active]
+    except KeyError as e:
+        logger.error("Cannot register tunnel %s for failover: %s", tunnel_id, e)
+        return path
+
+
+def install_tunnel_rules(only=None):
+    """
+    Installs the tunnels (and their ARP replies) of the routes in parsed_data.json. only:
+    set of (src_host, dst_host) routes to (re)install, e.g. after a topology reload; the
+    tables are then not read back and exported.
+    """
     logger.info("ENTER install_tunnel_rules")
     success = True
 
@@ -180,6 +273,8 @@ def install_tunnel_rules():
             return
 
         routes = {tuple(map(int, key.split(','))): value for key, value in data.get("routes", {}).items()}
+        if only is not None:
+            routes = {key: path for key, path in routes.items() if key in only}
         logger.info("Routes parsed: %s", routes)
 
         tunnels = []
@@ -207,6 +302,8 @@ def install_tunnel_rules():
                 (src_host, dst_host), path, src_eth_addr, src_ip_addr, dst_eth_addr, dst_ip_addr = tunnel
                 tunnel_id = ''.join(str(s) for s in path)
                 tunnel_ids.append(tunnel_id)
+                # the backup path (same tunnel id) if a link of the primary is down
+                path = _failover_path(int(tunnel_id), (src_host, dst_host), path, dst_eth_addr)
                 switches_id = path
                 intermediate_switches_id = path[:-1]
 
@@ -237,6 +334,7 @@ def install_tunnel_rules():
                     logger.error("Error while writing tunnel rules for tunnel %s: %s", tunnel_id, e)
                     success = False
                     continue
+                controller.failover_manager.mark_installed(int(tunnel_id), [switches[i].name for i in path])
 
                 try:
                     logger.info("source:%s, destination:%s", src_eth_addr, dst_eth_addr)
@@ -269,6 +367,10 @@ def install_tunnel_rules():
             logger.error("Error processing tunnels top-level: %s", e)
             success = False
 
+        if only is not None:
+            return
+        controller.failover_manager.retain({int(tunnel_id) for tunnel_id in tunnel_ids})
+
         try:
             for switch in switches.values():
                 logger.info("About to read table rules from %s", switch.name)
@@ -450,6 +552,26 @@ def extract_info(file_content: str) -> dict:
         else:
             logger.warning("table_entries for WL %s is not a list", k)
         table_entries[key] = parsed_list
+
+    # Trained trees (sklearn-style arrays or nested JSON) compiled into level table entries:
+    # "models": {"<wl>": {"tree": {...}, "features": [feature name or index per model column]}}
+    for k, model in parsed.get("models", {}).items():
+        try:
+            key = int(k)
+        except Exception:
+            key = k
+        try:
+            table_entries[key] = compile_tree(model["tree"], model.get("features"))
+        except (KeyError, ValueError, IndexError, TypeError) as e:
+            raise ValueError(f"Cannot compile the model of WL {k}: {e}")
+
+    # Everything is checked against the level tables before touching a switch
+    for k, entries in table_entries.items():
+        level_entries = [e for e in entries if str(e.get("table", "")).startswith("MyIngress.level")]
+        try:
+            validate_entries(level_entries)
+        except ValueError as e:
+            raise ValueError(f"WL {k}: {e}")
     data["table_entries"] = table_entries
 
     # classic shortest paths
@@ -569,9 +691,472 @@ async def metrics():
     return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
+@app.get("/flows")
+async def flows(switch: str = None, details: bool = False, include_expired: bool = True):
+    """
+    Flow tables rebuilt from the register slots: occupancy, collisions, expired slots
+    and age distribution per switch. With details=true the slots themselves are listed.
+    """
+    if controller is None or not hasattr(controller, "flow_table_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    manager = controller.flow_table_manager
+    names = [switch] if switch is not None else sorted(manager.tables)
+    result = {}
+    for name in names:
+        stats = manager.stats(name)
+        if stats is None:
+            if switch is not None:
+                raise HTTPException(status_code=404, detail=f"No flow table for switch {name}")
+            continue
+        if details:
+            stats["flows"] = manager.flows(name, include_expired=include_expired)
+        result[name] = stats
+    return {"switches": result}
+
+
+@app.get("/flows/{tunnel_id}/history")
+async def flow_history(tunnel_id: int, switch: str = None, metric: str = None, resolution: int = None,
+                       window: float = 300):
+    """
+    History of the digest metrics of a tunnel over the last `window` seconds.
+    Without `resolution` the raw samples are returned, otherwise the 1/10/60 s rollups.
+    """
+    if controller is None or not hasattr(controller, "digest_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    store = controller.digest_manager.timeseries
+    try:
+        series = store.history(tunnel_id, switch=switch, metric=metric, resolution=resolution,
+                               since=time.time() - window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not series:
+        raise HTTPException(status_code=404, detail=f"No history for tunnel {tunnel_id}")
+    return {"tunnel_id": tunnel_id, "window": window, "series": series, "store": store.stats()}
+
+
+@app.get("/debug/recording")
+async def recording_status():
+    """State of the StreamChannel recorder: directory and messages/bytes captured per switch."""
+    if controller is None or not hasattr(controller, "stream_recorder"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    return controller.stream_recorder.stats()
+
+
+@app.post("/debug/recording")
+async def start_recording(directory: str = "captures"):
+    """
+    Starts recording every StreamMessageResponse of all switches to <directory>/<switch>.p4rec,
+    to be replayed with stream_recorder.py.
+    """
+    if controller is None or not hasattr(controller, "stream_recorder") or not switches:
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    try:
+        controller.stream_recorder.start(switches, directory)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return controller.stream_recorder.stats()
+
+
+@app.delete("/debug/recording")
+async def stop_recording():
+    if controller is None or not hasattr(controller, "stream_recorder"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    if not controller.stream_recorder.recording:
+        raise HTTPException(status_code=409, detail="Not recording")
+    return controller.stream_recorder.stop()
+
+
+def _with_links(change):
+    """Copy of the shared topology with change(switch_ports) applied to its links, for apply_topology."""
+    topology = get_topology()
+    switch_ports = {switch: dict(ports) for switch, ports in topology.switch_ports.items()}
+    change(switch_ports)
+    digest = hashlib.sha256(json.dumps(switch_ports, sort_keys=True).encode()).hexdigest()
+    return Topology(list(topology.switches), dict(topology.hosts), dict(topology.host_to_port), switch_ports,
+                    dict(topology.mac_ip_mapping), f"links-{digest}", topology.path)
+
+
+@app.post("/topology/links")
+async def add_link(a: str, port_a: int, b: str, port_b: int):
+    """
+    Adds the link a:port_a <-> port_b:b between two switches to the shared topology, as
+    /topology/reload does: spanning tree, multicast groups of the switches whose flood
+    ports change, tunnels and failover backups all see it. With LLDP discovery on, the
+    next link change it detects replaces the links with the discovered ones.
+    """
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    if port_a <= 0 or port_b <= 0 or a == b:
+        raise HTTPException(status_code=400, detail="Invalid link")
+
+    def change(switch_ports):
+        switch_ports[a][b] = port_a
+        switch_ports[b][a] = port_b
+
+    # the copy is taken under the lock, so that a concurrent change is not reverted
+    async with topology_lock:
+        topology = get_topology()
+        if a not in topology.switches or b not in topology.switches:
+            raise HTTPException(status_code=404, detail=f"Unknown switch {a if a not in topology.switches else b}")
+        return await _apply_topology(_with_links(change))
+
+
+@app.delete("/topology/links")
+async def remove_link(a: str, b: str):
+    """Removes the link a <-> b (e.g. link down) from the shared topology, as POST /topology/links."""
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+
+    def change(switch_ports):
+        switch_ports[a].pop(b, None)
+        switch_ports.get(b, {}).pop(a, None)
+
+    async with topology_lock:
+        if b not in get_topology().switch_ports.get(a, {}):
+            raise HTTPException(status_code=404, detail=f"No link {a}-{b}")
+        return await _apply_topology(_with_links(change))
+
+
+def _affected_routes(diff):
+    """Routes of parsed_data.json whose tunnels or ARP replies depend on what the diff changed."""
+    try:
+        with open('parsed_data.json', 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    topology = get_topology()
+    index = {name: i for i, name in topology.hosts.items()}
+    hosts = {index[name] for name in diff["hosts_added"] + diff["hosts_changed"] if name in index}
+    # the host of switch sN is host N, as in install_tunnel_rules
+    hosts.update(int(sw[1:]) for sw in diff["host_ports"] if sw[1:].isdigit())
+    links = {frozenset(link) for link in diff["links_removed"] + diff["links_changed"]}
+    affected = set()
+    for key, path in data.get("routes", {}).items():
+        src, dst = map(int, key.split(','))
+        hops = {frozenset((f"s{a}", f"s{b}")) for a, b in zip(path, path[1:])}
+        if src in hosts or dst in hosts or hops & links:
+            affected.add((src, dst))
+    return affected
+
+
+@app.get("/topology")
+async def topology_status():
+    """File, hash and size of the topology in use."""
+    return get_topology().summary()
+
+
+@app.post("/topology/reload")
+async def reload_topology(path: str = None):
+    """
+    Applies topology.json (or path) live. The shared tables are updated in place and only
+    what changed is reprogrammed: the spanning tree around the changed links, the multicast
+    groups whose flood ports changed and the tunnels/ARP replies of the routes over the
+    changed links or to the changed hosts. New switches need a restart to be connected.
+    """
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    topology = get_topology()
+    try:
+        new = await asyncio.to_thread(Topology.load, path or topology.path)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid topology: {e}")
+    if controller.discovery_manager is not None:
+        # the links between switches stay the discovered ones, only hosts come from the file
+        new = controller.discovery_manager.discovered_topology(controller.discovery_manager.applied, base=new)
+    return await apply_topology(new)
+
+
+async def apply_topology(new):
+    """
+    Makes the shared topology equal to new and reprograms what changed (see
+    /topology/reload). Also called by the LLDP discovery when links change. One change
+    at a time: a call waits for the one in progress (topology_lock).
+    """
+    async with topology_lock:
+        return await _apply_topology(new)
+
+
+async def _apply_topology(new):
+    """apply_topology, with topology_lock already held."""
+    topology = get_topology()
+    started = time.perf_counter()
+    diff = topology.update(new)
+    if not diff["changed"]:
+        return {"changed": False, "topology": topology.summary()}
+
+    tree = controller.spanningtree_manager
+    tree_changed = tree.update_topology(SWITCH_PORTS)
+    flood = sorted(set(tree_changed) | (set(diff["host_ports"]) - set(diff["switches_removed"])))
+    updated = await asyncio.to_thread(controller.switch_manager.update_multicast_groups, flood)
+    routes = _affected_routes(diff)
+    if routes:
+        await asyncio.to_thread(install_tunnel_rules, routes)
+    controller.failover_manager.recompute()
+    done = time.perf_counter()
+    logger.info("Topology reloaded in %.3f ms: multicast groups updated on %s, %d routes reinstalled",
+                (done - started) * 1000, updated, len(routes))
+    if os.environ.get("P4_TOPOLOGY_REPORT", "background") == "background":
+        tree.generate_report_background()
+    return {
+        "changed": True,
+        "topology": topology.summary(),
+        "diff": diff,
+        "tree_changed": tree_changed,
+        "multicast_updated": updated,
+        "routes_reinstalled": sorted(f"{src},{dst}" for src, dst in routes),
+        "restart_required": diff["switches_added"],
+        "reload_ms": (done - started) * 1000,
+    }
+
+
+def _route_request(pairs, constrained, via):
+    """Host pairs and WL nodes of a /routes request: all pairs (src < dst) and the WL nodes of parsed_data.json by default."""
+    topology = get_topology()
+    try:
+        if pairs:
+            pairs = [tuple(int(h) for h in pair.split(',')) for pair in pairs.split(';') if pair]
+        else:
+            pairs = [(a, b) for a in sorted(topology.hosts) for b in sorted(topology.hosts) if a < b]
+        if not constrained:
+            return pairs, None
+        if via:
+            return pairs, [int(w) for w in via.split(',') if w]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="pairs: src,dst;src,dst... and via: n,n... as host/switch numbers")
+    try:
+        with open('parsed_data.json', 'r') as f:
+            return pairs, json.load(f).get("wl_nodes", [])
+    except (OSError, ValueError):
+        raise HTTPException(status_code=409, detail="No WL nodes: upload a file with wl_nodes or pass via")
+
+
+@app.get("/routes")
+async def get_routes(pairs: str = None, constrained: bool = False, via: str = None):
+    """
+    Shortest routes for host pairs ("1,3;2,4", all by default) over the current switch
+    graph, in the format of the routes files. constrained: through one of the via
+    switches ("2,5"), by default the WL nodes. Paths are cached by graph hash.
+    """
+    pairs, via = _route_request(pairs, constrained, via)
+    return await asyncio.to_thread(compute_routes, get_topology(), pairs, via)
+
+
+@app.post("/routes")
+async def install_routes(pairs: str = None, constrained: bool = False, via: str = None):
+    """As GET /routes, then writes the routes into parsed_data.json and installs their tunnels."""
+    if controller is None or not hasattr(controller, "tunnel_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    pairs, via = _route_request(pairs, constrained, via)
+    result = await asyncio.to_thread(compute_routes, get_topology(), pairs, via)
+    try:
+        with open('parsed_data.json', 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {"routes": {}}
+    data.setdefault("routes", {}).update(result["routes"])
+    tmp_name = "parsed_data.json.tmp"
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_name, "parsed_data.json")
+    routes = {tuple(map(int, key.split(','))) for key in result["routes"]}
+    await asyncio.to_thread(install_tunnel_rules, routes)
+    return dict(result, installed=sorted(result["routes"]))
+
+
+def _placement_request(pairs, traffic, colors, candidates, budget, node_cost, time_limit):
+    """
+    Runs place() for a /placement request: host pairs as /routes, traffic "src,dst:weight;..."
+    (1 for the pairs not listed), colors by default the ones of parsed_data.json.
+    """
+    pairs, _ = _route_request(pairs, False, None)
+    try:
+        weights = {}
+        for item in (traffic or "").split(';'):
+            if item:
+                pair, weight = item.split(':')
+                weights[tuple(int(h) for h in pair.split(','))] = float(weight)
+        candidates = [int(c) for c in candidates.split(',') if c] if candidates else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="traffic: src,dst:weight;... and candidates: n,n... as numbers")
+    if colors is None:
+        try:
+            with open('parsed_data.json', 'r') as f:
+                colors = json.load(f).get("colors")
+        except (OSError, ValueError):
+            pass
+    if not colors:
+        raise HTTPException(status_code=409, detail="No colors: upload a file with instance_info.colors or pass colors")
+    try:
+        return place(get_topology(), pairs, int(colors), [weights.get(pair, 1.0) for pair in pairs], candidates,
+                     budget, node_cost, time_limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/placement")
+async def get_placement(pairs: str = None, traffic: str = None, colors: int = None, candidates: str = None,
+                        budget: int = None, node_cost: float = 0.0, time_limit: float = 1.0):
+    """
+    WL placement on the current switch graph: which switches host a WL and their color,
+    so that every route crosses one WL of each color, with the routes and the metrics of
+    the upload files. Greedy plus local search, at most time_limit seconds of search.
+    """
+    return await asyncio.to_thread(_placement_request, pairs, traffic, colors, candidates, budget, node_cost,
+                                   time_limit)
+
+
+@app.post("/placement")
+async def apply_placement(pairs: str = None, traffic: str = None, colors: int = None, candidates: str = None,
+                          budget: int = None, node_cost: float = 0.0, time_limit: float = 1.0):
+    """
+    As GET /placement, then installs it: WL and color rules on the switches, the routes
+    and the placement into parsed_data.json, their tunnels, and the file gauges.
+    """
+    if controller is None or not hasattr(controller, "WL_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    result = await asyncio.to_thread(_placement_request, pairs, traffic, colors, candidates, budget, node_cost,
+                                     time_limit)
+    metrics = result["metrics"]
+    await asyncio.to_thread(controller.WL_manager.install_wl_rules, result["wl_nodes"], switches,
+                            result["deployment"])
+    try:
+        with open('parsed_data.json', 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {"routes": {}}
+    data.update(metrics, wl_nodes=result["wl_nodes"], deployment=result["deployment"])
+    data.setdefault("routes", {}).update(result["routes"])
+    tmp_name = "parsed_data.json.tmp"
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_name, "parsed_data.json")
+
+    nodes_gauge.set(metrics["nodes"])
+    colors_gauge.set(metrics["colors"])
+    runtime_gauge.set(metrics["run_time"])
+    solution_cost_gauge.set(metrics["solution_cost"])
+    num_nodes_deployed_gauge.set(metrics["num_nodes_deployed"])
+    average_path_weight_gauge.set(metrics["average_path_weight"])
+    percentage_covered_gauge.set(metrics["percentage_covered"])
+
+    routes = {tuple(map(int, key.split(','))) for key in result["routes"]}
+    await asyncio.to_thread(install_tunnel_rules, routes)
+    # the trees of the upload stay on the switches they were given for
+    models = {str(k) for k, entries in data.get("table_entries", {}).items() if entries}
+    return dict(result, installed=sorted(result["routes"]),
+                without_model=[n for n in result["wl_nodes"] if str(n) not in models])
+
+
+@app.get("/failover")
+async def failover_status():
+    """Tunnels with their primary, backup and active path, links down and the last failovers."""
+    if controller is None or not hasattr(controller, "failover_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    return controller.failover_manager.status()
+
+
+@app.post("/failover/links/{a}/{b}")
+async def failover_link(a: str, b: str, state: str = "down"):
+    """
+    Link a-b (switch names) reported down or up by an external monitor (port status):
+    the tunnels crossing it move to their backup, or back to their primary.
+    """
+    if controller is None or not hasattr(controller, "failover_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    if state not in ("down", "up"):
+        raise HTTPException(status_code=400, detail="state must be down or up")
+    failover = controller.failover_manager
+    action = failover.link_down if state == "down" else failover.link_up
+    return {"event": await asyncio.to_thread(action, a, b), "status": failover.status()}
+
+
+@app.get("/discovery")
+async def discovery_status():
+    """Links found by LLDP (applied and last seen per direction), probe and reply counters."""
+    if controller is None or getattr(controller, "discovery_manager", None) is None:
+        raise HTTPException(status_code=503, detail="LLDP discovery not running (P4_DISCOVERY=1)")
+    return controller.discovery_manager.status()
+
+
+@app.post("/discovery/probe", status_code=202)
+async def discovery_probe():
+    """Starts a discovery round now instead of at the next interval."""
+    if controller is None or getattr(controller, "discovery_manager", None) is None:
+        raise HTTPException(status_code=503, detail="LLDP discovery not running (P4_DISCOVERY=1)")
+    controller.discovery_manager.probe_now.set()
+    return controller.discovery_manager.status()
+
+
+@app.get("/topology/report")
+async def topology_report_status():
+    """Topology hash, whether the figures and Excel report are up to date, and their paths."""
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    return controller.spanningtree_manager.report_status()
+
+
+@app.post("/topology/report", status_code=202)
+async def generate_topology_report(force: bool = False):
+    """Generates the figures and the Excel report in a background process (skipped if up to date unless force)."""
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    controller.spanningtree_manager.generate_report_background(force=force)
+    return controller.spanningtree_manager.report_status()
+
+
+@app.get("/topology/report/{kind}")
+async def topology_report_file(kind: str):
+    """
+    Serves a report file (topology, spt or excel). If it is missing or out of date the
+    generation is started and 202 is returned: retry when it is done.
+    """
+    if controller is None or not hasattr(controller, "spanningtree_manager"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    tree = controller.spanningtree_manager
+    files = tree.report_files()
+    if kind not in files:
+        raise HTTPException(status_code=404, detail=f"Unknown report file {kind}, expected one of {sorted(files)}")
+    if not tree.report_up_to_date():
+        tree.generate_report_background()
+        return JSONResponse(status_code=202, content=tree.report_status())
+    return FileResponse(files[kind], filename=os.path.basename(files[kind]))
+
+
+@app.get("/debug/latency")
+async def latency_summary():
+    """
+    Latency of the message path stages (stream receive, queue wait, digest decoding...)
+    and of the table writes since start or the last reset, in ms. The same histograms
+    are exported on /metrics.
+    """
+    if controller is None or not hasattr(controller, "latency"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    return controller.latency.summary()
+
+
+@app.delete("/debug/latency")
+async def reset_latency():
+    if controller is None or not hasattr(controller, "latency"):
+        raise HTTPException(status_code=503, detail="Controller not initialized")
+    controller.latency.reset()
+    return controller.latency.summary()
+
+
+@app.get("/debug/startup")
+async def startup_profile():
+    """
+    Startup phases in ms (imports, p4info, managers, switch connections, pipeline...),
+    time to "ready" and to the first digest, and which heavyweight modules are loaded.
+    """
+    return STARTUP.summary()
+
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Server starting...")
+    STARTUP.lap("server startup")
     global controller
     controller = P4Controller()
     logger.info("Controller initialized successfully.")
@@ -581,6 +1166,12 @@ async def startup_event():
     logger.info("Controller started in the event loop.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if controller is not None and hasattr(controller, "desired_state"):
+        controller.desired_state.flush()
+
+
 if __name__ == "__main__":
     import uvicorn
 
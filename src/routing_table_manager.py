@@ -4,7 +4,6 @@ import os
 import sys
 import time
 import grpc
-from tabulate import tabulate
 from pathlib import Path
 import json
 
@@ -149,6 +148,7 @@ class TableManager:
                         f.write("_No table entries_\n\n")
                         continue
                     headers = ["Table Name", "Match Fields", "Action", "Action Params"]
+                    from tabulate import tabulate
                     f.write(tabulate(rows, headers=headers, tablefmt='github'))
                     f.write("\n\n")
         elif fmt == 'json':
@@ -12,49 +12,75 @@ SpanningTree class
     * 'Summary' sheet (root, visited/unvisited, paths to images)
     * 'Log' sheet (last N log lines)
 - preserves method signatures and updates global TREE from config
+
+add_link/remove_link update the tree incrementally at runtime: only the switches detached
+by a removed link, or made reachable by a new one, are (re)attached, at minimum depth;
+the rest of the tree is left unchanged so that as few flood port sets as possible change.
+
+build_tree only computes the tree: the drawings and the Excel report are produced by
+generate_report (in-process) or generate_report_background (separate process), and are
+skipped when they already exist for the same topology and tree (content hash in report_hash_file).
 """
 
 from collections import deque
+import heapq
+from concurrent.futures import Future, ProcessPoolExecutor
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import math
+import threading
+
+# Drawing and Excel libs are imported by _load_report_libs() when a report is generated
+# (usually in the report process): importing them here took ~1.2 s of controller startup.
+HAS_DRAW = HAS_PIL = HAS_NUMPY = HAS_EXCEL = None  # None: not loaded yet
+_report_libs_lock = threading.Lock()
+
+
+def _load_report_libs():
+    global HAS_DRAW, HAS_PIL, HAS_NUMPY, HAS_EXCEL
+    global nx, plt, OffsetImage, AnnotationBbox, FancyArrowPatch, Image, np, pd, load_workbook, XLImage
+    with _report_libs_lock:
+        if HAS_DRAW is not None:
+            return
+
+        # Optional drawing libs (headless backend)
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            import networkx as nx
+            import matplotlib.pyplot as plt
+            from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+            from matplotlib.patches import FancyArrowPatch
+            HAS_DRAW = True
+        except Exception:
+            HAS_DRAW = False
+
+        # optional PIL for icons
+        try:
+            from PIL import Image
+            HAS_PIL = True
+        except Exception:
+            HAS_PIL = False
+
+        # optional numeric support
+        try:
+            import numpy as np
+            HAS_NUMPY = True
+        except Exception:
+            HAS_NUMPY = False
+
+        # Excel/report libs (used only if present)
+        try:
+            import pandas as pd
+            from openpyxl import load_workbook
+            from openpyxl.drawing.image import Image as XLImage
+            HAS_EXCEL = True
+        except Exception:
+            HAS_EXCEL = False
 
-# Force headless backend for scripts
-import matplotlib
-matplotlib.use('Agg')
-
-# Optional drawing libs
-try:
-    import networkx as nx
-    import matplotlib.pyplot as plt
-    from matplotlib.offsetbox import OffsetImage, AnnotationBbox
-    from matplotlib.patches import FancyArrowPatch
-    HAS_DRAW = True
-except Exception:
-    HAS_DRAW = False
-
-# optional PIL for icons
-try:
-    from PIL import Image
-    HAS_PIL = True
-except Exception:
-    HAS_PIL = False
-
-# optional numeric support
-try:
-    import numpy as np
-    HAS_NUMPY = True
-except Exception:
-    HAS_NUMPY = False
-
-# Excel/report libs (used only if present)
-try:
-    import pandas as pd
-    from openpyxl import load_workbook
-    from openpyxl.drawing.image import Image as XLImage
-    HAS_EXCEL = True
-except Exception:
-    HAS_EXCEL = False
 
 # global TREE required by project
 from config import TREE
@@ -63,18 +89,22 @@ logger = logging.getLogger(__name__)
 
 
 class SpanningTree:
-    def __init__(self, topology):
+    def __init__(self, topology, log_mode='w'):
         """
         topology: dict mapping node -> {neighbor: port, ...}
         Root: lexicographically smallest non-host node (name not starting with 'h').
+        log_mode: 'a' appends to log_file instead of truncating it.
         """
-        self.topology = topology
+        # own copy: links added or removed at runtime must not change the static config
+        self.topology = {node: dict(neighbors) for node, neighbors in topology.items()}
 
         # pick root as lexicographically smallest non-host switch
         switch_candidates = [n for n in topology.keys() if not str(n).startswith('h')]
         self.root = min(switch_candidates) if switch_candidates else 's1'
 
         self.spanning_tree = {}
+        self.parent = {}  # switch -> parent switch in the tree (root excluded)
+        self.depth = {}   # switch -> hops from the root, for the switches in the tree
 
         # outputs & options
         self.log_file = "spanning_tree.log"
@@ -84,6 +114,7 @@ class SpanningTree:
         self.export_excel = True               # toggle Excel export
         self.excel_embed_figures = True        # embed the two PNGs into 'Figures' sheet
         self.excel_log_lines = 500
+        self.report_hash_file = "spanning_report.hash"  # topology hash of the last generated report
 
         # icons (auto-detected from Images/)
         self.host_icon = "Images/pc.png" if os.path.exists("Images/pc.png") else None
@@ -104,12 +135,16 @@ class SpanningTree:
         # curvature for parallel edges
         self.max_rad = 0.42
 
+        self.visited = set()
+        self.unvisited = set()
+        self._report_future = None
+
         # file logger
         self._file_logger = None
-        self._setup_file_logger(self.log_file)
+        self._setup_file_logger(self.log_file, log_mode)
 
     # ---------------- logging ----------------
-    def _setup_file_logger(self, filename):
+    def _setup_file_logger(self, filename, mode='w'):
         if self._file_logger is not None:
             for h in list(self._file_logger.handlers):
                 self._file_logger.removeHandler(h)
@@ -117,7 +152,7 @@ class SpanningTree:
         self._file_logger.setLevel(logging.INFO)
         existing_files = [getattr(h, "baseFilename", None) for h in self._file_logger.handlers]
         if filename not in existing_files:
-            fh = logging.FileHandler(filename, mode='w')
+            fh = logging.FileHandler(filename, mode=mode)
             fmt = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
             fh.setFormatter(fmt)
             self._file_logger.addHandler(fh)
@@ -248,6 +283,7 @@ class SpanningTree:
 
     # ---------------- draw full topology ----------------
     def _draw_full_topology(self, filename=None):
+        _load_report_libs()
         filename = filename or self.topology_image
         if not HAS_DRAW:
             msg = "Drawing libs not available (networkx/matplotlib). Skipping full topology image."
@@ -403,6 +439,7 @@ class SpanningTree:
 
     # ---------------- draw SPT ----------------
     def _draw_spt(self, filename=None):
+        _load_report_libs()
         filename = filename or self.spt_image
         if not HAS_DRAW:
             msg = "Drawing libs not available (networkx/matplotlib). Skipping SPT image."
@@ -500,6 +537,7 @@ class SpanningTree:
          - 'Log' sheet: last N lines from log
         Embedding images requires openpyxl + pillow; if not available, only sheets are written.
         """
+        _load_report_libs()
         excel_filename = excel_filename or self.excel_report
         log_last_n = log_last_n or self.excel_log_lines
 
@@ -704,10 +742,10 @@ class SpanningTree:
                 logger.info(ln)
 
     # ---------------- core algorithm (public) ----------------
-    def build_tree(self):
+    def build_tree(self, report=False):
         """
-        Build the spanning tree, draw topology and spt images (best-effort), update TREE,
-        write summary and optionally export Excel report with embedded figures.
+        Build the spanning tree, update TREE and write the summary. With report=True the
+        images and the Excel report are generated too (see generate_report).
         """
         try:
             self._validate_topology()
@@ -722,6 +760,8 @@ class SpanningTree:
                 raise KeyError(f"Root switch {self.root} not found in the topology.")
 
             self.spanning_tree = {switch: {} for switch in filtered_topology}
+            self.parent = {}
+            self.depth = {self.root: 0}
             visited = set([self.root])
             queue = deque()
 
@@ -744,6 +784,8 @@ class SpanningTree:
 
                 self.spanning_tree[parent][child] = port
                 self.spanning_tree[child][parent] = reverse_port
+                self.parent[child] = parent
+                self.depth[child] = self.depth[parent] + 1
                 visited.add(child)
 
                 for nb, nb_port in sorted(child_ports.items()):
@@ -770,25 +812,10 @@ class SpanningTree:
                 TREE = {}
                 TREE.update(self.spanning_tree)
 
-            # auto-detect icons again in case they were added during runtime
-            if not self.host_icon and os.path.exists("Images/pc.png"):
-                self.host_icon = "Images/pc.png"
-            if not self.switch_icon and os.path.exists("Images/switch.png"):
-                self.switch_icon = "Images/switch.png"
-
-            # generate drawings
-            try:
-                self._draw_full_topology(self.topology_image)
-                self._draw_spt(self.spt_image)
-            except Exception:
-                logger.exception("Error while drawing topology or SPT (continuing).")
-                if self._file_logger:
-                    self._file_logger.exception("Error while drawing topology or SPT (continuing).")
-
-            # write summary to log and export report
+            self.visited, self.unvisited = visited, unvisited
             self._write_summary(visited, unvisited)
-            if self.export_excel:
-                self._export_report(self.excel_report, log_last_n=self.excel_log_lines, embed_images=self.excel_embed_figures)
+            if report:
+                self.generate_report()
 
             logger.info("Spanning tree built successfully. Visited %d nodes.", len(visited))
             if self._file_logger:
@@ -803,6 +830,250 @@ class SpanningTree:
             if self._file_logger:
                 self._file_logger.exception("Unexpected error while building spanning tree.")
 
+    # ---------------- incremental updates ----------------
+    @staticmethod
+    def _is_host(node):
+        return str(node).startswith('h')
+
+    def _switch_links(self, node):
+        return {nb: port for nb, port in self.topology.get(node, {}).items() if not self._is_host(nb)}
+
+    def add_link(self, a, port_a, b, port_b):
+        """
+        Adds the link a:port_a <-> port_b:b. Switches it makes reachable from the root are
+        attached to the tree; a link between two switches already in the tree does not
+        change it. Returns the switches whose tree ports changed.
+        """
+        before = {node: dict(ports) for node, ports in self.spanning_tree.items()}
+        self.topology.setdefault(a, {})[b] = port_a
+        self.topology.setdefault(b, {})[a] = port_b
+        if not self._is_host(a) and not self._is_host(b):
+            for node in (a, b):
+                self.spanning_tree.setdefault(node, {})
+            if b in self.spanning_tree[a]:
+                # tree link re-added with other ports
+                self.spanning_tree[a][b] = port_a
+                self.spanning_tree[b][a] = port_b
+            if (a in self.depth) != (b in self.depth):
+                outside = b if a in self.depth else a
+                self._attach(self._detached_component(outside))
+        return self._apply(before, f"link {a}:{port_a}-{port_b}:{b} added")
+
+    def remove_link(self, a, b):
+        """
+        Removes the link a <-> b. If it was a tree link, the subtree cut off is attached
+        again through its other links (unreachable switches stay out of the tree).
+        Returns the switches whose tree ports changed.
+        """
+        before = {node: dict(ports) for node, ports in self.spanning_tree.items()}
+        self.topology.get(a, {}).pop(b, None)
+        self.topology.get(b, {}).pop(a, None)
+        child = a if self.parent.get(a) == b else b if self.parent.get(b) == a else None
+        if child is not None:
+            orphans = self._subtree(child)
+            previous = {node: self.parent.get(node) for node in orphans}
+            for node in orphans:
+                for nb in list(self.spanning_tree.get(node, {})):
+                    self.spanning_tree[node].pop(nb, None)
+                    self.spanning_tree.get(nb, {}).pop(node, None)
+                self.parent.pop(node, None)
+                self.depth.pop(node, None)
+            self._attach(orphans, previous)
+        return self._apply(before, f"link {a}-{b} removed")
+
+    def update_topology(self, topology):
+        """
+        Moves the tree to a new topology (e.g. topology.json reloaded) through remove_link
+        and add_link: links that disappeared or changed ports are removed first, then the
+        new ones are added, so only the switches around the changed links get new tree
+        ports. Returns the switches whose tree ports changed (removed switches excluded).
+        """
+        def links(topo):
+            return {(a, b): port for a, neighbors in topo.items() if not self._is_host(a)
+                    for b, port in neighbors.items() if not self._is_host(b)}
+
+        changed = set()
+        old, new = links(self.topology), links(topology)
+        for (a, b), port in old.items():
+            if a < b and (new.get((a, b)) != port or new.get((b, a)) != old.get((b, a))):
+                changed.update(self.remove_link(a, b))
+        current = links(self.topology)
+        for (a, b), port in new.items():
+            if a < b and (a, b) not in current and (b, a) in new:
+                changed.update(self.add_link(a, port, b, new[(b, a)]))
+
+        removed = set(self.topology) - set(topology)
+        for node in removed:
+            self.topology.pop(node, None)
+            self.spanning_tree.pop(node, None)
+            TREE.pop(node, None)
+        # host links: no effect on the tree, kept for the report
+        for node, neighbors in topology.items():
+            self.topology[node] = dict(neighbors)
+        self.visited = set(self.depth)
+        self.unvisited = set(self.spanning_tree) - self.visited
+        return sorted(changed - removed)
+
+    def _subtree(self, node):
+        children = {}
+        for child, parent in self.parent.items():
+            children.setdefault(parent, []).append(child)
+        nodes, stack = set(), [node]
+        while stack:
+            current = stack.pop()
+            nodes.add(current)
+            stack.extend(children.get(current, []))
+        return nodes
+
+    def _detached_component(self, node):
+        nodes, stack = set(), [node]
+        while stack:
+            current = stack.pop()
+            if current in nodes or current in self.depth:
+                continue
+            nodes.add(current)
+            stack.extend(self._switch_links(current))
+        return nodes
+
+    def _attach(self, nodes, previous=None):
+        """
+        Attaches the switches in nodes to the tree at minimum depth. At equal depth a switch
+        keeps its previous parent (fewer flood port changes), then ties are broken by name.
+        """
+        previous = previous or {}
+
+        def candidate(depth, parent, child):
+            return depth, previous.get(child) != parent, parent, child
+
+        heap = []
+        for node in nodes:
+            for nb in self._switch_links(node):
+                if nb in self.depth:
+                    heapq.heappush(heap, candidate(self.depth[nb] + 1, nb, node))
+        while heap:
+            depth, _, parent, child = heapq.heappop(heap)
+            if child in self.depth:
+                continue
+            port = self._switch_links(parent).get(child)
+            reverse_port = self._switch_links(child).get(parent)
+            if port is None or reverse_port is None:
+                continue
+            self.spanning_tree.setdefault(parent, {})[child] = port
+            self.spanning_tree.setdefault(child, {})[parent] = reverse_port
+            self.parent[child] = parent
+            self.depth[child] = depth
+            for nb in self._switch_links(child):
+                if nb in nodes and nb not in self.depth:
+                    heapq.heappush(heap, candidate(depth + 1, child, nb))
+
+    def _apply(self, before, change):
+        changed = sorted(node for node in self.spanning_tree
+                         if set(self.spanning_tree[node].items()) != set(before.get(node, {}).items()))
+        self.visited = set(self.depth)
+        self.unvisited = set(self.spanning_tree) - self.visited
+        # only the entries of the switches that changed are replaced in the global TREE
+        for node in changed:
+            TREE[node] = dict(self.spanning_tree[node])
+        msg = f"{change}: tree ports changed on {changed or 'no switch'}"
+        if self.unvisited:
+            msg += f", unreached {sorted(self.unvisited)}"
+        logger.info(msg)
+        if self._file_logger:
+            self._file_logger.info(msg)
+        return changed
+
+    # ---------------- reporting (off the startup path) ----------------
+    def topology_hash(self):
+        """Content hash of the topology, tree, root and drawing options the report depends on."""
+        content = {
+            "topology": self.topology, "tree": self.spanning_tree, "root": self.root,
+            "options": [self.export_excel, self.excel_embed_figures, bool(self.host_icon), bool(self.switch_icon),
+                        self.full_k, self.spt_k, self.layout_iterations],
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def report_files(self):
+        files = {"topology": self.topology_image, "spt": self.spt_image}
+        if self.export_excel:
+            files["excel"] = self.excel_report
+        return files
+
+    def report_up_to_date(self, digest=None):
+        digest = digest or self.topology_hash()
+        try:
+            with open(self.report_hash_file) as f:
+                stored = f.read().strip()
+        except OSError:
+            return False
+        return stored == digest and all(os.path.exists(path) for path in self.report_files().values())
+
+    def generate_report(self, force=False):
+        """
+        Draws the complete topology and the SPT and exports the Excel report, unless the
+        files already exist for the same topology hash. Returns True if they were (re)generated.
+        """
+        digest = self.topology_hash()
+        if not force and self.report_up_to_date(digest):
+            logger.info("Topology unchanged (%s), report not regenerated.", digest[:12])
+            return False
+
+        # auto-detect icons again in case they were added during runtime
+        if not self.host_icon and os.path.exists("Images/pc.png"):
+            self.host_icon = "Images/pc.png"
+        if not self.switch_icon and os.path.exists("Images/switch.png"):
+            self.switch_icon = "Images/switch.png"
+
+        # generate drawings
+        try:
+            self._draw_full_topology(self.topology_image)
+            self._draw_spt(self.spt_image)
+        except Exception:
+            logger.exception("Error while drawing topology or SPT (continuing).")
+            if self._file_logger:
+                self._file_logger.exception("Error while drawing topology or SPT (continuing).")
+
+        if self.export_excel:
+            self._export_report(self.excel_report, log_last_n=self.excel_log_lines, embed_images=self.excel_embed_figures)
+        with open(self.report_hash_file, "w") as f:
+            f.write(digest)
+        return True
+
+    def generate_report_background(self, force=False):
+        """
+        Runs generate_report in a separate process (matplotlib and openpyxl would otherwise
+        hold the GIL on the controller). Returns the concurrent.futures.Future; a report
+        already being generated is not started twice.
+        """
+        if self._report_future is not None and not self._report_future.done():
+            return self._report_future
+        if not force and self.report_up_to_date():
+            # nothing to render: no need to start a process
+            self._report_future = Future()
+            self._report_future.set_result(False)
+            return self._report_future
+        options = {name: getattr(self, name) for name in REPORT_OPTIONS}
+        # the tree kept by add_link/remove_link, which the multicast groups are programmed from:
+        # rebuilding it from the topology in the report process could give a different one
+        tree = {node: dict(ports) for node, ports in self.spanning_tree.items()}
+        # spawn: forking a process with live gRPC channels is not safe
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self._report_future = executor.submit(_generate_report, self.topology, tree, dict(self.parent), options,
+                                              force)
+        executor.shutdown(wait=False)
+        return self._report_future
+
+    def report_status(self):
+        future = self._report_future
+        status = {
+            "hash": self.topology_hash(),
+            "up_to_date": self.report_up_to_date(),
+            "running": future is not None and not future.done(),
+            "files": {kind: os.path.abspath(path) for kind, path in self.report_files().items()},
+        }
+        if future is not None and future.done() and future.exception() is not None:
+            status["error"] = str(future.exception())
+        return status
+
     def print_tree(self):
         print("Spanning Tree:")
         for switch, connections in self.spanning_tree.items():
@@ -811,3 +1082,21 @@ class SpanningTree:
 
     def get_tree(self):
         return self.spanning_tree
+
+
+REPORT_OPTIONS = ("root", "log_file", "topology_image", "spt_image", "excel_report", "export_excel",
+                  "excel_embed_figures", "excel_log_lines", "report_hash_file", "host_icon", "switch_icon",
+                  "full_k", "spt_k", "layout_iterations")
+
+
+def _generate_report(topology, spanning_tree, parent, options, force):
+    """Entry point of the report process: generates the report of the tree of the controller."""
+    # append to the log of the controller instead of truncating it
+    tree = SpanningTree(topology, log_mode='a')
+    for name, value in options.items():
+        setattr(tree, name, value)
+    tree._setup_file_logger(tree.log_file, mode='a')
+    tree.spanning_tree, tree.parent = spanning_tree, parent
+    tree.visited = {tree.root} | set(parent)
+    tree.unvisited = set(spanning_tree) - tree.visited
+    return tree.generate_report(force)
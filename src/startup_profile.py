@@ -0,0 +1,93 @@
+"""
+Startup profile of the controller, served by /debug/startup.
+
+rest_api imports this module first and calls STARTUP.lap(name) at the end of each
+startup step (import groups, p4info loading, switch connection, pipeline, tree...):
+a lap lasts from the previous one to now, so the laps cover the whole startup without
+gaps. mark(name) records a point in time, e.g. "ready" and "first_digest" (the first
+digest accepted by DigestManager), as seconds since this module was imported.
+
+HEAVY_MODULES are imported only by the code paths that need them (reports, Excel,
+packet-in parsing); summary() lists the ones already loaded so that an import moving
+back onto the startup path shows up.
+"""
+
+import os
+import sys
+import threading
+import time
+
+HEAVY_MODULES = ('pandas', 'matplotlib', 'networkx', 'PIL', 'openpyxl', 'scapy', 'tabulate')
+
+
+def _process_age():
+    """Seconds since the interpreter started (Linux), to account for what ran before this import."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.started = time.time()
+        self.before_import = _process_age()
+        self.last = self.t0
+        self.laps = []   # (name, seconds since t0 at the start, duration)
+        self.marks = {}  # name -> seconds since t0
+        self.info = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.laps.append((name, self.last - self.t0, now - self.last))
+        self.last = now
+
+    def mark(self, name):
+        """Records name the first time only."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.t0
+
+    def summary(self):
+        def ms(seconds):
+            return round(seconds * 1000, 3)
+
+        return {
+            "started": self.started,
+            "before_import_ms": None if self.before_import is None else ms(self.before_import),
+            "laps": [{"name": name, "start_ms": ms(start), "duration_ms": ms(duration)}
+                     for name, start, duration in self.laps],
+            "marks_ms": {name: ms(offset) for name, offset in self.marks.items()},
+            "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+            "info": self.info,
+        }
+
+
+def preload_heavy_modules(names=('scapy.all',)):
+    """
+    Imports modules in a daemon thread once the controller is ready, so the first
+    packet-in does not pay for them. Disabled with P4_PRELOAD=0.
+    """
+    if os.environ.get("P4_PRELOAD", "1") == "0":
+        return None
+
+    def run():
+        import importlib
+        for name in names:
+            started = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                continue
+            STARTUP.info.setdefault("preloaded_ms", {})[name] = round((time.perf_counter() - started) * 1000, 3)
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+STARTUP = StartupProfile()
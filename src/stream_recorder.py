@@ -0,0 +1,293 @@
+"""
+Recording and replay of the P4Runtime StreamChannel.
+
+StreamRecorder wraps the response stream of each SwitchConnection and appends every
+StreamMessageResponse (digests, packet-ins, arbitration...) with its receive time to
+<directory>/<switch>.p4rec (p4runtime_lib.record_io format), so a live run can be
+reproduced later.
+
+StreamReplayer feeds captures back into the real message path: each capture replaces
+the response stream of a SwitchConnection, so SwitchConnection.listen_for_messages,
+MessageManager and the Digest/ARP managers process the messages exactly as live ones.
+Replay runs at the original pace, N times faster (speed=N) or as fast as possible
+(speed=None). The relative timing between switches is preserved.
+
+Usage (replay against fake switches, see utils/fake_p4runtime_switch.py):
+    python3 stream_recorder.py captures/ [--speed 10 | --speed max] [--p4info ...]
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../utils/'))
+from p4.v1 import p4runtime_pb2
+from p4runtime_lib.record_io import RecordWriter, read_header, read_records
+
+logger = logging.getLogger(__name__)
+
+REPLAYED = ('digest', 'packet')  # message types handled by MessageManager
+
+
+class RecordingStream:
+    """Iterator over a gRPC response stream that records what it yields."""
+
+    def __init__(self, stream, writer, lock):
+        self.stream = stream
+        self.writer = writer
+        self.lock = lock
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = next(self.stream)
+        received = time.time_ns()
+        with self.lock:
+            if self.writer is not None:
+                self.writer.write(message, received)
+        return message
+
+    def __getattr__(self, name):
+        # cancel(), code(), ... of the underlying call
+        return getattr(self.stream, name)
+
+
+class StreamRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directory = None
+        self.started = None
+        self.attached = {}  # switch name -> (switch, original stream, RecordingStream)
+
+    @property
+    def recording(self):
+        return bool(self.attached)
+
+    def start(self, switches, directory):
+        """Starts recording all the switches into directory; one file per switch."""
+        with self.lock:
+            if self.attached:
+                raise RuntimeError(f"already recording to {self.directory}")
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+            self.started = time.time()
+            for sw in switches.values():
+                writer = RecordWriter(os.path.join(directory, f"{sw.name}.p4rec"),
+                                      header={"switch": sw.name, "device_id": sw.device_id, "started": self.started})
+                stream = RecordingStream(sw.stream_msg_resp, writer, self.lock)
+                self.attached[sw.name] = (sw, sw.stream_msg_resp, stream)
+                sw.stream_msg_resp = stream
+        logger.info("Recording the stream of %d switches to %s", len(self.attached), directory)
+
+    def stop(self):
+        """Restores the original streams and closes the capture files; returns stats()."""
+        stats = self.stats()
+        with self.lock:
+            for sw, original, stream in self.attached.values():
+                if sw.stream_msg_resp is stream:
+                    sw.stream_msg_resp = original
+                stream.writer.close()
+                stream.writer = None
+            self.attached = {}
+        logger.info("Recording stopped: %s", stats)
+        return stats
+
+    def stats(self):
+        with self.lock:
+            return {
+                "recording": bool(self.attached),
+                "directory": self.directory,
+                "started": self.started,
+                "switches": {name: {"messages": stream.writer.records, "bytes": stream.writer.bytes}
+                             for name, (_, _, stream) in self.attached.items()},
+            }
+
+
+def load_capture(path):
+    """(header, [(timestamp_ns, StreamMessageResponse)]) of a capture file."""
+    header = read_header(path)
+    records = [(ts, message) for ts, _, message in read_records(path, p4runtime_pb2.StreamMessageResponse)]
+    return header, records
+
+
+class ReplayStream:
+    """Iterator yielding the messages of a capture on the replay schedule."""
+
+    def __init__(self, records, origin_ns, start, speed):
+        self.records = [(ts, m) for ts, m in records if m.WhichOneof('update') in REPLAYED]
+        self.skipped = len(records) - len(self.records)
+        self.origin_ns = origin_ns
+        self.start = start
+        self.speed = speed
+        self.position = 0
+        self.scheduled = collections.deque()  # perf_counter() due time of the messages yielded
+
+    def due(self, timestamp_ns):
+        if not self.speed:
+            return time.perf_counter()
+        return self.start + (timestamp_ns - self.origin_ns) / 1e9 / self.speed
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position >= len(self.records):
+            raise StopIteration
+        timestamp_ns, message = self.records[self.position]
+        self.position += 1
+        due = self.due(timestamp_ns)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.scheduled.append(due)
+        return message
+
+    @property
+    def finished(self):
+        return self.position >= len(self.records)
+
+
+class StreamReplayer:
+    def __init__(self, captures):
+        """captures: {switch name: capture path}."""
+        self.captures = {name: load_capture(path) for name, path in captures.items()}
+        self.streams = {}
+        self.lag = []
+        self.processed = 0
+
+    @classmethod
+    def from_directory(cls, directory):
+        captures = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.p4rec*"))):
+            captures[read_header(path).get("switch", os.path.basename(path).split('.')[0])] = path
+        return cls(captures)
+
+    def attach(self, switches, speed=1.0):
+        """Replaces the response stream of the switches that have a capture."""
+        timestamps = [records[0][0] for _, records in self.captures.values() if records]
+        origin_ns = min(timestamps) if timestamps else 0
+        start = time.perf_counter() + 0.1
+        for sw in switches.values():
+            if sw.name not in self.captures:
+                continue
+            _, records = self.captures[sw.name]
+            self.streams[sw.name] = ReplayStream(records, origin_ns, start, speed)
+            sw.stream_msg_resp = self.streams[sw.name]
+
+    def instrument(self, digest_manager, arp_manager):
+        """Measures how late each message is processed with respect to its replay time."""
+        handle_digest = digest_manager.handle_digest_for_switch
+        handle_packet = arp_manager.handle_packet_for_switch
+
+        def done(switch):
+            stream = self.streams.get(switch.name)
+            if stream is not None and stream.scheduled:
+                self.lag.append(time.perf_counter() - stream.scheduled.popleft())
+                self.processed += 1
+
+        def on_digest(switch, message, timestamp_received):
+            handle_digest(switch, message, timestamp_received)
+            done(switch)
+
+        def on_packet(switch, message):
+            handle_packet(switch, message)
+            done(switch)
+
+        digest_manager.handle_digest_for_switch = on_digest
+        arp_manager.handle_packet_for_switch = on_packet
+
+    @property
+    def total(self):
+        return sum(len(stream.records) for stream in self.streams.values())
+
+    def done(self):
+        return all(stream.finished for stream in self.streams.values()) and self.processed >= self.total
+
+    def stats(self, elapsed):
+        lag = sorted(self.lag)
+
+        def pct(p):
+            return lag[min(len(lag) - 1, int(p * len(lag)))] * 1000 if lag else None
+
+        return {
+            "messages": self.total, "processed": self.processed,
+            "skipped": sum(stream.skipped for stream in self.streams.values()),
+            "elapsed_s": elapsed, "rate": self.processed / elapsed if elapsed else 0.0,
+            "lag_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": lag[-1] * 1000 if lag else None},
+        }
+
+
+def replay(directory, speed, p4info_path, base_port, timeout):
+    """Replays a capture directory into a controller connected to fake switches."""
+    import p4runtime_lib.helper
+    from p4runtime_lib.switch import SwitchConnection
+    from fake_p4runtime_switch import start_fake_switches
+    from arp_manager import ArpManager
+    from digest_manager import DigestManager
+    from message_manager import MessageManager
+
+    replayer = StreamReplayer.from_directory(directory)
+    if not replayer.captures:
+        raise SystemExit(f"no captures in {directory}")
+    helper = p4runtime_lib.helper.P4InfoHelper(p4info_path)
+    servers = start_fake_switches(helper.p4info, len(replayer.captures), base_port=base_port)
+    switches = {}
+    for i, (name, (header, _)) in enumerate(sorted(replayer.captures.items())):
+        sw = SwitchConnection(name=name, address=f'127.0.0.1:{base_port + i + 1}', device_id=i + 1,
+                              proto_dump_file=None)
+        sw.MasterArbitrationUpdate()
+        sw.WritePREEntry(helper.buildMCEntry(multicast_group_id=1, replicas=[]))
+        switches[i + 1] = sw
+
+    digest_manager = DigestManager(helper, switches)
+    arp_manager = ArpManager(helper, switches)
+    message_manager = MessageManager(helper, switches)
+    replayer.instrument(digest_manager, arp_manager)
+    replayer.attach(switches, speed)
+
+    async def run():
+        task = asyncio.create_task(message_manager.start(switches, arp_manager, digest_manager))
+        start = time.perf_counter()
+        while not replayer.done() and time.perf_counter() - start < timeout:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        return time.perf_counter() - start
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        elapsed = asyncio.run(run())
+    for server, _ in servers:
+        server.stop(None)
+    digest_manager.stop_excel_thread()
+    return replayer.stats(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay StreamChannel captures into the controller")
+    parser.add_argument("directory")
+    parser.add_argument("--speed", default="1", help="replay speed factor, or 'max'")
+    parser.add_argument("--p4info", default="../p4src/build/advanced_tunnel.p4.p4info.txt")
+    parser.add_argument("--base-port", type=int, default=53050)
+    parser.add_argument("--timeout", type=float, default=3600)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    speed = None if args.speed == "max" else float(args.speed)
+    stats = replay(args.directory, speed, args.p4info, args.base_port, args.timeout)
+    print(f"replayed {stats['processed']}/{stats['messages']} messages ({stats['skipped']} skipped) "
+          f"in {stats['elapsed_s']:.2f} s: {stats['rate']:.0f} msg/s")
+    print(f"processing lag p50 {stats['lag_ms']['p50']} ms, p99 {stats['lag_ms']['p99']} ms, "
+          f"max {stats['lag_ms']['max']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import os
 import sys
 import time
 import grpc
+from concurrent.futures import ThreadPoolExecutor
 from config import SWITCH_PORTS, HOST_TO_PORT, NUM_PORTS
 
 # Import P4Runtime lib from parent utils dir
@@ -13,48 +14,162 @@ sys.path.append(
                  '../utils/'))
 import p4runtime_lib.bmv2
 import p4runtime_lib.helper
+from p4.v1 import p4runtime_pb2
 from config import TREE
+from warm_restart import DesiredState, entity_key, read_state, reconcile
 
 
 class SwitchConnectionManager:
-    def __init__(self, p4info_helper, bmv2_file_path, switch_count):
+    def __init__(self, p4info_helper, bmv2_file_path, switch_count, host='127.0.0.1', base_port=50050,
+                 log_options=None, desired_state=None):
+        # host/base_port also allow pointing the controller at utils/fake_p4runtime_switch.py
         self.p4info_helper = p4info_helper
+        self.host = host
+        self.base_port = base_port
+        # GrpcRequestLogger options (rotation, compression, per-method sampling) of the request logs
+        self.log_options = log_options
         self.switches = {}
         self.switch_count = switch_count
         self.bmv2_file_path = bmv2_file_path
+        self.timings = {}  # phase -> times of the last run (see _run_parallel)
+        # warm_restart.DesiredState recording what is written on the switches, for warm_start
+        self.desired_state = desired_state
+
+    def _run_parallel(self, phase, action, switches):
+        """
+        Runs action(switch) on all the switches at once (one thread each: the calls block on
+        gRPC), so a phase lasts as long as its slowest switch. Per-switch and total times are
+        kept in self.timings[phase]. Returns {switch: exception} of the failed ones.
+        """
+        started = time.perf_counter()
+        per_switch, errors = {}, {}
+
+        def run(sw):
+            t = time.perf_counter()
+            try:
+                action(sw)
+            except Exception as e:
+                errors[sw] = e
+            per_switch[getattr(sw, 'name', sw)] = time.perf_counter() - t
+
+        if switches:
+            with ThreadPoolExecutor(max_workers=len(switches), thread_name_prefix=phase) as pool:
+                list(pool.map(run, switches))
+        total = time.perf_counter() - started
+        self.timings[phase] = {
+            "total_s": total,
+            "slowest_s": max(per_switch.values(), default=0.0),
+            "sum_s": sum(per_switch.values()),
+            "switches": per_switch,
+        }
+        print(f"{phase}: {len(switches)} switches in {total * 1000:.1f} ms "
+              f"(slowest {self.timings[phase]['slowest_s'] * 1000:.1f} ms)")
+        return errors
 
     def create_connections(self):
-        for i in range(self.switch_count):
+        def connect(i):
             switch_name = f's{i + 1}'
             self.switches[i] = p4runtime_lib.bmv2.Bmv2SwitchConnection(
                 name=switch_name,
-                address=f'127.0.0.1:{50050 + i + 1}',
+                address=f'{self.host}:{self.base_port + i + 1}',
                 device_id=i+1,
-                proto_dump_file=f'../p4src/logs/{switch_name}-p4runtime-requests.txt'
+                proto_dump_file=f'../p4src/logs/{switch_name}-p4runtime-requests.p4rtlog',
+                log_options=self.log_options
 
             )
             print(f"Connection to switch {switch_name}")
 
+        errors = self._run_parallel("connect", connect, list(range(self.switch_count)))
+        for i, e in errors.items():
+            print(f"Error connecting to switch s{i + 1}: {e}")
+        # same order as the switch indexes, whatever the order the threads finished in
+        self.switches = {i: self.switches[i] for i in sorted(self.switches)}
+        if self.desired_state is not None:
+            self.desired_state.attach(self.switches)
+
     def update_master(self):
-        for switch in self.switches.values():
-            try:
-                switch.MasterArbitrationUpdate()
-                print(f"Master arbitration updated for {switch.name}")
-            except Exception as e:
-                print(f"Error updating master on {switch.name}: {e}")
+        def arbitrate(switch):
+            switch.MasterArbitrationUpdate()
+            print(f"Master arbitration updated for {switch.name}")
 
-    def install_p4_program(self):
-        for switch in self.switches.values():
-            try:
-                switch.SetForwardingPipelineConfig(
-                    p4info=self.p4info_helper.p4info,
-                    bmv2_json_file_path=self.bmv2_file_path
-                )
+        errors = self._run_parallel("arbitration", arbitrate, list(self.switches.values()))
+        for switch, e in errors.items():
+            print(f"Error updating master on {switch.name}: {e}")
 
-                self.sendDigestEntry(sw=switch, digest_name="congestion_digest_t")
-                print(f"Installed P4 Program on {switch.name}")
-            except Exception as e:
-                print(f"Error installing P4 Program on {switch.name}: {e}")
+    def pipeline_config(self):
+        """p4info and BMv2 device config serialized once and pushed to every switch."""
+        return p4runtime_lib.bmv2.buildPipelineConfig(self.p4info_helper.p4info, self.bmv2_file_path)
+
+    def install_p4_program(self):
+        started = time.perf_counter()
+        config = self.pipeline_config()
+        self.timings["pipeline_build"] = {"total_s": time.perf_counter() - started}
+
+        def install(switch):
+            switch.SetForwardingPipelineConfig(config=config)
+            if self.desired_state is not None:
+                # tables wiped by the push
+                self.desired_state.reset(switch.name, config.cookie.cookie)
+            self.sendDigestEntry(sw=switch, digest_name="congestion_digest_t")
+            print(f"Installed P4 Program on {switch.name}")
+
+        errors = self._run_parallel("install", install, list(self.switches.values()))
+        for switch, e in errors.items():
+            print(f"Error installing P4 Program on {switch.name}: {e}")
+
+    def startup_entities(self, switch):
+        """What every switch gets at startup: the digest config and the flood multicast group."""
+        digest = p4runtime_pb2.Entity()
+        digest.digest_entry.CopyFrom(self.p4info_helper.buildDigestEntry(digest_name="congestion_digest_t"))
+        group = p4runtime_pb2.Entity()
+        replicas = [{'port': port, 'instance': 0} for port in sorted(self.flood_ports(switch.name))]
+        group.packet_replication_engine_entry.CopyFrom(
+            self.p4info_helper.buildMCEntry(multicast_group_id=1, replicas=replicas))
+        return [digest, group]
+
+    def warm_start(self):
+        """
+        Warm restart, in place of install_p4_program + create_multicast_group (see
+        warm_restart.py; the spanning tree must be built first). The pipeline is pushed only
+        where the cookie differs; then every switch is read back and reconciled with the
+        desired state in one Read and one Write. Returns {switch: what was done}.
+        """
+        started = time.perf_counter()
+        config = self.pipeline_config()
+        cookie = config.cookie.cookie
+        self.timings["pipeline_build"] = {"total_s": time.perf_counter() - started}
+        desired_state = self.desired_state or DesiredState(path=None)
+        reports = {}
+
+        def start(switch):
+            current = switch.GetForwardingPipelineConfig(
+                p4runtime_pb2.GetForwardingPipelineConfigRequest.COOKIE_ONLY).cookie.cookie
+            pushed = current != cookie
+            if pushed:
+                switch.SetForwardingPipelineConfig(config=config)
+                desired_state.reset(switch.name, cookie)
+                actual = {}
+            else:
+                actual = read_state(switch)
+            desired = desired_state.get(switch.name, cookie)
+            adopted = desired is None
+            if adopted:
+                # nothing recorded for this pipeline: keep what the switch has
+                desired_state.reset(switch.name, cookie, actual)
+                desired = dict(actual)
+            for entity in self.startup_entities(switch):
+                desired[entity_key(entity)] = entity
+                desired_state.set(switch.name, entity)
+            counts = reconcile(switch, desired, actual, prune=not adopted)
+            reports[switch.name] = dict(counts, pipeline_pushed=pushed, adopted=adopted, read=len(actual))
+            print(f"Warm start of {switch.name}: {reports[switch.name]}")
+
+        errors = self._run_parallel("warm_start", start, list(self.switches.values()))
+        for switch, e in errors.items():
+            print(f"Error in the warm start of {switch.name}: {e}")
+            reports[switch.name] = {"error": str(e)}
+        desired_state.flush()
+        return reports
 
     def sendDigestEntry(self, sw, digest_name):
         digest_entry = self.p4info_helper.buildDigestEntry(digest_name=digest_name)
@@ -68,24 +183,22 @@ class SwitchConnectionManager:
     def get_switch(self, index):
         return self.switches.get(index)
 
+    def flood_ports(self, switch_name):
+        """Ports of the multicast group of a switch: spanning tree ports plus the host port."""
+        ports = set(TREE.get(switch_name, {}).values())
+        host_port = HOST_TO_PORT.get(switch_name, None)
+        if host_port:
+            ports.add(host_port)
+        return ports
+
     def create_multicast_group(self):
         """
         Configures the multicast group based on spanning tree and includes ports connected to hosts.
         """
         for sw in self.switches.values():
             try:
-
-                spanning_tree_ports = TREE.get(sw.name, {}).values()
-
-
-                host_port = HOST_TO_PORT.get(sw.name, None)
-                if host_port:
-                    all_ports = set(spanning_tree_ports).union({host_port})
-                else:
-                    all_ports = set(spanning_tree_ports)
-
                 # Crea le repliche per tutte le porte valide
-                replicas = [{'port': port, 'instance': 0} for port in all_ports]
+                replicas = [{'port': port, 'instance': 0} for port in self.flood_ports(sw.name)]
                 print(f"replicas for {sw.name}: {replicas}")
 
                 # Configura il gruppo multicast
@@ -98,3 +211,19 @@ class SwitchConnectionManager:
 
             except Exception as e:
                 print(f"Error installing multicast group on {sw.name}: {e}")
+
+    def update_multicast_groups(self, switch_names):
+        """
+        Rewrites (MODIFY) the multicast group of the given switches only, e.g. after a
+        spanning tree update. Returns the names of the switches updated.
+        """
+        updated = []
+        for sw in self.switches.values():
+            if sw.name not in switch_names:
+                continue
+            replicas = [{'port': port, 'instance': 0} for port in sorted(self.flood_ports(sw.name))]
+            mc_group_entry = self.p4info_helper.buildMCEntry(multicast_group_id=1, replicas=replicas)
+            sw.ModifyPREEntry(pre_entry=mc_group_entry)
+            print(f"Updated multicast group on switch {sw.name}: {replicas}")
+            updated.append(sw.name)
+        return updated
@@ -0,0 +1,195 @@
+"""
+Fixed-memory time-series store for the values decoded from digests.
+
+Each (switch, tunnel_id, metric) series owns preallocated NumPy ring buffers:
+the last raw samples plus min/max/mean/p95 rollups at 1 s, 10 s and 60 s.
+The number of series is bounded by max_bytes; when a new series does not fit,
+the least recently updated one is evicted.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_RESOLUTIONS = (1, 10, 60)
+DEFAULT_RAW_CAPACITY = 600
+DEFAULT_ROLLUP_CAPACITY = 360
+DEFAULT_P95_SAMPLES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+ROLLUP_FIELDS = ("start", "min", "max", "mean", "p95", "count")
+
+
+class _Rollup:
+    """Closed buckets of one resolution plus the bucket currently being filled."""
+
+    def __init__(self, resolution, capacity, p95_samples, rng):
+        self.resolution = resolution
+        self.data = np.full((len(ROLLUP_FIELDS), capacity), np.nan)
+        self.pos = 0
+        self.size = 0
+        self.rng = rng
+
+        self.bucket = None
+        self.b_min = self.b_max = self.b_sum = 0.0
+        self.b_count = 0
+        self.samples = np.empty(p95_samples)
+
+    def add(self, timestamp, value):
+        bucket = int(timestamp // self.resolution)
+        if bucket != self.bucket:
+            if self.bucket is not None:
+                self._close()
+            self.bucket = bucket
+            self.b_min = self.b_max = self.b_sum = value
+            self.b_count = 1
+            self.samples[0] = value
+            return
+
+        if value < self.b_min:
+            self.b_min = value
+        if value > self.b_max:
+            self.b_max = value
+        self.b_sum += value
+        # Reservoir sampling keeps the p95 estimate bounded in memory for busy buckets
+        if self.b_count < len(self.samples):
+            self.samples[self.b_count] = value
+        else:
+            slot = self.rng.integers(0, self.b_count + 1)
+            if slot < len(self.samples):
+                self.samples[slot] = value
+        self.b_count += 1
+
+    def _open_stats(self):
+        kept = self.samples[:min(self.b_count, len(self.samples))]
+        return (float(self.bucket * self.resolution), self.b_min, self.b_max, self.b_sum / self.b_count,
+                float(np.percentile(kept, 95)), self.b_count)
+
+    def _close(self):
+        self.data[:, self.pos] = self._open_stats()
+        self.pos = (self.pos + 1) % self.data.shape[1]
+        self.size = min(self.size + 1, self.data.shape[1])
+
+    def buckets(self, since=None):
+        """Closed buckets in time order followed by the open one (marked partial)."""
+        capacity = self.data.shape[1]
+        order = (np.arange(self.size) + self.pos - self.size) % capacity
+        data = self.data[:, order]
+        if since is not None:
+            data = data[:, data[0] + self.resolution > since]
+        result = [dict(zip(ROLLUP_FIELDS, column), partial=False) for column in data.T.tolist()]
+        if self.bucket is not None and (since is None or (self.bucket + 1) * self.resolution > since):
+            result.append(dict(zip(ROLLUP_FIELDS, self._open_stats()), partial=True))
+        for bucket in result:
+            bucket["count"] = int(bucket["count"])
+        return result
+
+
+class _Series:
+    def __init__(self, raw_capacity, rollup_capacity, resolutions, p95_samples, rng):
+        self.times = np.zeros(raw_capacity)
+        self.values = np.zeros(raw_capacity)
+        self.pos = 0
+        self.size = 0
+        self.rollups = {r: _Rollup(r, rollup_capacity, p95_samples, rng) for r in resolutions}
+
+    def add(self, timestamp, value):
+        self.times[self.pos] = timestamp
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.times)
+        self.size = min(self.size + 1, len(self.times))
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, value)
+
+    def raw(self, since=None):
+        order = (np.arange(self.size) + self.pos - self.size) % len(self.times)
+        times, values = self.times[order], self.values[order]
+        if since is not None:
+            mask = times >= since
+            times, values = times[mask], values[mask]
+        return {"t": times.tolist(), "v": values.tolist()}
+
+    def nbytes(self):
+        total = self.times.nbytes + self.values.nbytes
+        for rollup in self.rollups.values():
+            total += rollup.data.nbytes + rollup.samples.nbytes
+        return total
+
+
+class TimeSeriesStore:
+    """
+    In-process history of digest metrics keyed by (switch, tunnel_id, metric).
+
+    Memory is preallocated per series, so the total is bounded by
+    max_series * bytes_per_series, with max_series derived from max_bytes.
+    """
+
+    def __init__(self, raw_capacity=DEFAULT_RAW_CAPACITY, rollup_capacity=DEFAULT_ROLLUP_CAPACITY,
+                 resolutions=DEFAULT_RESOLUTIONS, p95_samples=DEFAULT_P95_SAMPLES, max_bytes=DEFAULT_MAX_BYTES):
+        self.raw_capacity = raw_capacity
+        self.rollup_capacity = rollup_capacity
+        self.resolutions = tuple(sorted(resolutions))
+        self.p95_samples = p95_samples
+        self._rng = np.random.default_rng(0)
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+        self.bytes_per_series = self._new_series().nbytes()
+        self.max_series = max(1, max_bytes // self.bytes_per_series)
+
+    def _new_series(self):
+        return _Series(self.raw_capacity, self.rollup_capacity, self.resolutions, self.p95_samples, self._rng)
+
+    def record(self, switch, tunnel_id, timestamp, values):
+        """Append one sample per metric in values ({metric: number}); None values are skipped."""
+        with self._lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                key = (switch, tunnel_id, metric)
+                series = self._series.get(key)
+                if series is None:
+                    if len(self._series) >= self.max_series:
+                        self._series.popitem(last=False)
+                        self.evicted += 1
+                    series = self._series[key] = self._new_series()
+                else:
+                    self._series.move_to_end(key)
+                series.add(timestamp, float(value))
+
+    def history(self, tunnel_id, switch=None, metric=None, resolution=None, since=None):
+        """
+        Samples of every series of a tunnel, optionally filtered by switch and metric.
+        resolution=None returns raw samples, otherwise the rollup buckets of that resolution.
+        """
+        if resolution is not None and resolution not in self.resolutions:
+            raise ValueError(f"unsupported resolution {resolution}, available: {list(self.resolutions)}")
+
+        with self._lock:
+            result = []
+            for (sw, tid, name), series in self._series.items():
+                if tid != tunnel_id or (switch is not None and sw != switch) or \
+                        (metric is not None and name != metric):
+                    continue
+                entry = {"switch": sw, "metric": name}
+                if resolution is None:
+                    entry.update(series.raw(since))
+                else:
+                    entry["resolution"] = resolution
+                    entry["buckets"] = series.rollups[resolution].buckets(since)
+                result.append(entry)
+        result.sort(key=lambda e: (e["switch"], e["metric"]))
+        return result
+
+    def stats(self):
+        with self._lock:
+            num_series = len(self._series)
+        return {
+            "series": num_series,
+            "max_series": self.max_series,
+            "bytes_per_series": self.bytes_per_series,
+            "bytes_used": num_series * self.bytes_per_series,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,216 @@
+"""
+Network topology shared by the controller managers.
+
+The topology file (p4src/topology.json, or P4_TOPOLOGY_FILE) is parsed once per process
+into a Topology; config.py exports its tables, so every manager importing them sees the
+same dicts. A compact form of the parsed tables is cached in p4src/.topology_cache/,
+keyed by the sha256 of the file, so an unchanged file is not parsed again at startup.
+The cache is read on load but only written by save_cache, which the controller calls at
+startup: importing config (or anything that imports it) never writes into the tree.
+
+Topology.update applies a new file live: the shared dicts are changed in place (never
+rebound, the managers hold references to them) and the returned diff tells which
+switches, ports and hosts changed, so that only those are reprogrammed (/topology/reload).
+NUM_SWITCHES and NUM_PORTS in config are the values at startup: use num_switches and
+num_ports of get_topology() for the current ones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from generate_config import parse_topology, export_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.environ.get("P4_TOPOLOGY_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '../p4src/topology.json')
+CACHE_DIR = ".topology_cache"
+CACHE_VERSION = 1
+
+
+class Topology:
+    """
+    - switches: switch names, in file order
+    - hosts: host index (as in MAC_IP_MAPPING, from 1) -> host name
+    - host_to_port: switch -> port of its host
+    - switch_ports: switch -> {neighbour switch or host: port}
+    - mac_ip_mapping: host index -> (mac, ip)
+    """
+
+    def __init__(self, switches, hosts, host_to_port, switch_ports, mac_ip_mapping, digest=None, path=None):
+        self.switches = switches
+        self.hosts = hosts
+        self.host_to_port = host_to_port
+        self.switch_ports = switch_ports
+        self.mac_ip_mapping = mac_ip_mapping
+        self.digest = digest
+        self.path = path
+        self.from_cache = False
+        self.lock = threading.Lock()
+
+    @property
+    def num_switches(self):
+        return len(self.switches)
+
+    @property
+    def num_ports(self):
+        return max((max(ports.values()) for ports in self.switch_ports.values() if ports), default=0)
+
+    @classmethod
+    def from_json(cls, topology, digest=None, path=None):
+        host_to_port, switch_ports, mac_ip_mapping, _, _, _ = parse_topology(topology)
+        hosts = {i: name for i, name in enumerate(topology["hosts"], start=1)}
+        return cls(list(topology["switches"]), hosts, host_to_port, switch_ports, mac_ip_mapping, digest, path)
+
+    def compact(self):
+        """Plain lists, no JSON objects keyed by int: what the cache stores."""
+        return {
+            "version": CACHE_VERSION,
+            "switches": self.switches,
+            "hosts": [[i, name, mac, ip] for i, name in self.hosts.items()
+                      for mac, ip in [self.mac_ip_mapping[i]]],
+            "ports": [[switch, neighbour, port] for switch, ports in self.switch_ports.items()
+                      for neighbour, port in ports.items()],
+            "host_ports": [[switch, port] for switch, port in self.host_to_port.items()],
+        }
+
+    @classmethod
+    def from_compact(cls, data, digest=None, path=None):
+        if data.get("version") != CACHE_VERSION:
+            raise ValueError(f"unsupported cache version {data.get('version')}")
+        switch_ports = {switch: {} for switch in data["switches"]}
+        for switch, neighbour, port in data["ports"]:
+            switch_ports.setdefault(switch, {})[neighbour] = port
+        return cls(list(data["switches"]),
+                   {i: name for i, name, _, _ in data["hosts"]},
+                   {switch: port for switch, port in data["host_ports"]},
+                   switch_ports,
+                   {i: (mac, ip) for i, _, mac, ip in data["hosts"]},
+                   digest, path)
+
+    @staticmethod
+    def cache_file(path, digest):
+        return os.path.join(os.path.dirname(path), CACHE_DIR, f"{digest}.json")
+
+    @classmethod
+    def load(cls, path=None, use_cache=True):
+        """
+        Parses the topology file, or reads its tables from the cache if the file is unchanged.
+        The cache is not written here (see save_cache).
+        """
+        path = os.path.abspath(path or DEFAULT_PATH)
+        with open(path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if use_cache:
+            cache_file = cls.cache_file(path, digest)
+            try:
+                with open(cache_file) as f:
+                    topology = cls.from_compact(json.load(f), digest, path)
+                topology.from_cache = True
+                return topology
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("Ignoring topology cache %s: %s", cache_file, e)
+        return cls.from_json(json.loads(raw), digest, path)
+
+    def save_cache(self):
+        """Writes the cache entry of the file this topology was parsed from, if it is not there yet."""
+        if self.from_cache or self.path is None or self.digest is None:
+            return
+        cache_file = self.cache_file(self.path, self.digest)
+        if os.path.exists(cache_file):
+            return
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.compact(), f, separators=(',', ':'))
+            os.replace(tmp, cache_file)
+        except OSError as e:
+            logger.warning("Cannot write topology cache %s: %s", cache_file, e)
+
+    def diff(self, other):
+        """What changes going from this topology to other (names, no indexes, JSON-friendly)."""
+        switches = set(self.switches)
+        new_switches = set(other.switches)
+        ports_changed = sorted(s for s in switches | new_switches
+                               if self.switch_ports.get(s) != other.switch_ports.get(s))
+
+        def links(switch_ports):
+            return {(a, b): (port, switch_ports.get(b, {}).get(a)) for a, ports in switch_ports.items()
+                    for b, port in ports.items() if a < b or a not in switch_ports.get(b, {})}
+
+        old_links, new_links = links(self.switch_ports), links(other.switch_ports)
+        hosts = {name: (i, self.mac_ip_mapping[i]) for i, name in self.hosts.items()}
+        new_hosts = {name: (i, other.mac_ip_mapping[i]) for i, name in other.hosts.items()}
+        host_ports = {s: [self.host_to_port.get(s), other.host_to_port.get(s)]
+                      for s in sorted(set(self.host_to_port) | set(other.host_to_port))
+                      if self.host_to_port.get(s) != other.host_to_port.get(s)}
+
+        diff = {
+            "switches_added": sorted(new_switches - switches),
+            "switches_removed": sorted(switches - new_switches),
+            "ports_changed": ports_changed,
+            "links_added": sorted([a, b] for (a, b) in new_links.keys() - old_links.keys()),
+            "links_removed": sorted([a, b] for (a, b) in old_links.keys() - new_links.keys()),
+            "links_changed": sorted([a, b] for (a, b) in old_links.keys() & new_links.keys()
+                                    if old_links[(a, b)] != new_links[(a, b)]),
+            "host_ports": host_ports,
+            "hosts_added": sorted(new_hosts.keys() - hosts.keys()),
+            "hosts_removed": sorted(hosts.keys() - new_hosts.keys()),
+            "hosts_changed": sorted(name for name in hosts.keys() & new_hosts.keys()
+                                    if hosts[name] != new_hosts[name]),
+        }
+        diff["changed"] = any(diff.values())
+        return diff
+
+    def update(self, other):
+        """
+        Makes this topology equal to other, changing the shared dicts in place: keys are
+        set before the stale ones are dropped, so a concurrent reader never sees a table
+        missing an entry that exists in both topologies. Returns diff(other).
+        """
+        with self.lock:
+            diff = self.diff(other)
+            for mine, theirs in ((self.host_to_port, other.host_to_port),
+                                 (self.mac_ip_mapping, other.mac_ip_mapping),
+                                 (self.hosts, other.hosts)):
+                mine.update(theirs)
+                for key in set(mine) - set(theirs):
+                    del mine[key]
+            for switch, ports in other.switch_ports.items():
+                if self.switch_ports.get(switch) != ports:
+                    self.switch_ports[switch] = dict(ports)
+            for switch in set(self.switch_ports) - set(other.switch_ports):
+                del self.switch_ports[switch]
+            self.switches[:] = other.switches
+            self.digest, self.path, self.from_cache = other.digest, other.path, other.from_cache
+        if diff["changed"]:
+            export_metrics(self.host_to_port, self.switch_ports, self.num_switches, self.num_ports)
+            logger.info("Topology updated from %s (%s)", self.path, self.digest[:12])
+        return diff
+
+    def summary(self):
+        return {"path": self.path, "hash": self.digest, "switches": self.num_switches,
+                "hosts": len(self.hosts), "ports": self.num_ports}
+
+
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def get_topology():
+    """The Topology shared by the managers of this process, loaded on first use."""
+    global _topology
+    with _topology_lock:
+        if _topology is None:
+            _topology = Topology.load()
+            export_metrics(_topology.host_to_port, _topology.switch_ports, _topology.num_switches,
+                           _topology.num_ports)
+            logger.info("Topology loaded from %s (%s)", _topology.path, _topology.digest[:12])
+        return _topology
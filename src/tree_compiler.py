@@ -0,0 +1,250 @@
+"""
+Compiles a decision tree into entries for the MyIngress.level1..level8 tables.
+
+Data-plane semantics (advanced_tunnel.p4):
+  - classification starts with node_id=0, prevFeature=0, isTrue=1 and applies
+    level1..level8 while meta.class == CLASS_NOT_SET;
+  - an entry of level k is keyed by (parent node_id, parent feature, branch) and
+    runs CheckFeature(node_id, f, threshold), i.e. isTrue = feature_f <= (bit<w>)threshold,
+    or SetClass(node_id, class);
+  - a miss leaves the class unset, which ends as class 0.
+
+So a node at depth d becomes one entry in level d+1, and the compiler can:
+  - turn float thresholds into integer ones (features are integers: x <= t <=> x <= floor(t));
+  - drop tests that are always true/false given the feature width and the tests on the path;
+  - collapse nodes whose two subtrees are identical (including same-class leaves);
+  - omit class-0 leaves, which the table miss already produces.
+
+Accepted inputs: a fitted sklearn DecisionTreeClassifier, a dict of sklearn-style
+arrays (children_left, children_right, feature, threshold, value or class), or a
+nested dict ({"feature", "threshold", "left", "right"} / {"class"}).
+"""
+
+import logging
+import math
+
+from wl_features import (LEVEL_TABLES, LEVEL_TABLE_SIZE, CHECK_FEATURE, SET_CLASS, NODE_ID_BITS,
+                         FEATURE_INDEX_BITS, THRESHOLD_BITS, CLASS_BITS, CLASS_NOT_SET, DEFAULT_CLASS,
+                         FEATURE_BITS, feature_index, feature_max)
+
+logger = logging.getLogger(__name__)
+
+ACTION_PARAM_COUNT = {CHECK_FEATURE: 3, SET_CLASS: 2}
+START_KEY = (0, 0, 1)
+
+
+class TreeNode:
+    __slots__ = ("feature", "threshold", "left", "right", "klass", "_signature")
+
+    def __init__(self, feature=None, threshold=None, left=None, right=None, klass=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.klass = klass
+        self._signature = None
+
+    @property
+    def is_leaf(self):
+        return self.klass is not None
+
+    def signature(self):
+        """Structural identity used to detect identical subtrees."""
+        if self._signature is None:
+            if self.is_leaf:
+                self._signature = ("class", self.klass)
+            else:
+                self._signature = (self.feature, self.threshold, self.left.signature(), self.right.signature())
+        return self._signature
+
+    def count(self):
+        return 1 if self.is_leaf else 1 + self.left.count() + self.right.count()
+
+
+def _resolve_feature(model_feature, feature_map):
+    if feature_map is None:
+        return feature_index(model_feature)
+    return feature_index(feature_map[model_feature])
+
+
+def _leaf_class(value, classes):
+    if isinstance(value, (list, tuple)) or hasattr(value, "__len__"):
+        counts = list(value[0]) if len(value) == 1 and hasattr(value[0], "__len__") else list(value)
+        best = max(range(len(counts)), key=counts.__getitem__)
+        return int(classes[best]) if classes is not None else best
+    return int(value)
+
+
+def _from_arrays(left, right, feature, threshold, leaf_class, feature_map):
+    def build(i):
+        if left[i] == right[i]:  # sklearn marks leaves with children_left == children_right == -1
+            return TreeNode(klass=leaf_class(i))
+        return TreeNode(feature=_resolve_feature(int(feature[i]), feature_map),
+                        threshold=math.floor(float(threshold[i])),
+                        left=build(int(left[i])), right=build(int(right[i])))
+    return build(0)
+
+
+def _from_nested(node, feature_map):
+    if "class" in node:
+        return TreeNode(klass=int(node["class"]))
+    if "value" in node:
+        return TreeNode(klass=_leaf_class(node["value"], node.get("classes")))
+    feature = node["feature"]
+    if isinstance(feature, str):
+        feature = feature_index(feature) if feature_map is None else feature_index(feature_map[feature])
+    else:
+        feature = _resolve_feature(int(feature), feature_map)
+    return TreeNode(feature=feature, threshold=math.floor(float(node["threshold"])),
+                    left=_from_nested(node["left"], feature_map), right=_from_nested(node["right"], feature_map))
+
+
+def load_tree(model, feature_map=None):
+    """
+    Builds a TreeNode tree from a supported model format.
+    feature_map maps model feature ids/names to P4 feature indices or names
+    (a list indexed by model column, or a dict); None means they already match.
+    """
+    if hasattr(model, "tree_"):
+        tree = model.tree_
+        classes = list(model.classes_)
+        return _from_arrays(tree.children_left, tree.children_right, tree.feature, tree.threshold,
+                            lambda i: _leaf_class(tree.value[i], classes), feature_map)
+    if isinstance(model, dict) and "children_left" in model:
+        if "class" in model:
+            leaf_class = lambda i: int(model["class"][i])
+        else:
+            leaf_class = lambda i: _leaf_class(model["value"][i], model.get("classes"))
+        return _from_arrays(model["children_left"], model["children_right"], model["feature"],
+                            model["threshold"], leaf_class, feature_map)
+    if isinstance(model, dict):
+        return _from_nested(model, feature_map)
+    raise ValueError(f"unsupported tree format: {type(model).__name__}")
+
+
+def simplify(node, bounds=None):
+    """
+    Removes tests decided by the feature ranges reachable on the path and collapses
+    nodes whose subtrees are identical. bounds: {feature: (lo, hi)} known on the path.
+    """
+    if node.is_leaf:
+        return node
+    bounds = bounds or {}
+    lo, hi = bounds.get(node.feature, (0, feature_max(node.feature)))
+    if node.threshold >= hi:
+        return simplify(node.left, bounds)
+    if node.threshold < lo:
+        return simplify(node.right, bounds)
+
+    left = simplify(node.left, {**bounds, node.feature: (lo, node.threshold)})
+    right = simplify(node.right, {**bounds, node.feature: (node.threshold + 1, hi)})
+    if left.signature() == right.signature():
+        return left
+    return TreeNode(feature=node.feature, threshold=node.threshold, left=left, right=right)
+
+
+def emit_entries(root, omit_default_class=True):
+    """
+    Level table entries in the upload format. Node ids are assigned breadth first
+    starting from 1, so ids are compact and never clash with the start key.
+    """
+    entries = []
+    next_id = 1
+    frontier = [(root, START_KEY)]
+    for level in range(len(LEVEL_TABLES) + 1):
+        if not frontier:
+            break
+        if level == len(LEVEL_TABLES):
+            raise ValueError(f"tree is deeper than the {len(LEVEL_TABLES)} level tables")
+        table = LEVEL_TABLES[level]
+        children = []
+        for node, key in frontier:
+            if node.is_leaf and omit_default_class and node.klass == DEFAULT_CLASS:
+                continue
+            node_id = next_id
+            next_id += 1
+            if node.is_leaf:
+                entries.append({"table": table, "action": SET_CLASS,
+                                "match_fields": list(key), "action_params": [node_id, node.klass]})
+            else:
+                entries.append({"table": table, "action": CHECK_FEATURE, "match_fields": list(key),
+                                "action_params": [node_id, node.feature, node.threshold]})
+                children.append((node.left, (node_id, node.feature, 1)))
+                children.append((node.right, (node_id, node.feature, 0)))
+        frontier = children
+    return entries
+
+
+def compile_tree(model, feature_map=None, omit_default_class=True):
+    """Loads, minimizes and emits a tree; the result is validated before being returned."""
+    tree = load_tree(model, feature_map)
+    minimized = simplify(tree)
+    entries = emit_entries(minimized, omit_default_class)
+    validate_entries(entries)
+    logger.info("Tree compiled: %d nodes -> %d nodes after pruning -> %d table entries",
+                tree.count(), minimized.count(), len(entries))
+    return entries
+
+
+def validate_entries(entries):
+    """
+    Checks level table entries against the P4 program: table names, actions and
+    parameter counts, key/parameter bitwidths, threshold vs. feature width, class
+    range, duplicate keys and the 1024-entry table size. Raises ValueError listing
+    every problem; returns the number of entries per table otherwise.
+    """
+    errors = []
+    per_table = {table: 0 for table in LEVEL_TABLES}
+    keys = set()
+
+    def fits(value, bits):
+        return isinstance(value, int) and 0 <= value < (1 << bits)
+
+    for i, entry in enumerate(entries):
+        table, action = entry.get("table"), entry.get("action")
+        match, params = entry.get("match_fields", []), entry.get("action_params", [])
+        where = f"entry {i} ({table})"
+        if table not in per_table:
+            errors.append(f"{where}: unknown table")
+            continue
+        per_table[table] += 1
+
+        if len(match) != 3:
+            errors.append(f"{where}: expected 3 match fields (node_id, prevFeature, isTrue), got {len(match)}")
+        else:
+            node_id, prev_feature, is_true = match
+            if not fits(node_id, NODE_ID_BITS) or not fits(prev_feature, FEATURE_INDEX_BITS):
+                errors.append(f"{where}: match fields {match} do not fit bit<16>")
+            if is_true not in (0, 1):
+                errors.append(f"{where}: isTrue must be 0 or 1, got {is_true}")
+            if (table, tuple(match)) in keys:
+                errors.append(f"{where}: duplicate key {match}")
+            keys.add((table, tuple(match)))
+
+        if action not in ACTION_PARAM_COUNT:
+            errors.append(f"{where}: unknown action {action}")
+            continue
+        if len(params) != ACTION_PARAM_COUNT[action]:
+            errors.append(f"{where}: {action} expects {ACTION_PARAM_COUNT[action]} params, got {len(params)}")
+            continue
+        if not fits(params[0], NODE_ID_BITS):
+            errors.append(f"{where}: node_id {params[0]} does not fit bit<16>")
+        if action == CHECK_FEATURE:
+            feature, threshold = params[1], params[2]
+            if feature not in FEATURE_BITS:
+                errors.append(f"{where}: feature index {feature} is not defined in CheckFeature")
+            elif not fits(threshold, THRESHOLD_BITS) or threshold > feature_max(feature):
+                # CheckFeature casts the threshold to the feature width, larger values would wrap
+                errors.append(f"{where}: threshold {threshold} out of range for the "
+                              f"{FEATURE_BITS[feature]}-bit feature {feature}")
+        else:
+            if not fits(params[1], CLASS_BITS) or params[1] == CLASS_NOT_SET:
+                errors.append(f"{where}: class {params[1]} out of range 0..{CLASS_NOT_SET - 1}")
+
+    for table, count in per_table.items():
+        if count > LEVEL_TABLE_SIZE:
+            errors.append(f"{table}: {count} entries exceed the table size {LEVEL_TABLE_SIZE}")
+
+    if errors:
+        raise ValueError("invalid level table entries:\n  " + "\n  ".join(errors))
+    return per_table
@@ -0,0 +1,214 @@
+"""
+Warm restart of the controller (P4_RESTART=warm).
+
+A cold start pushes the pipeline with VERIFY_AND_COMMIT, which wipes every table, PRE
+group and digest config: all the tunnel, ARP and WL rules must be installed again and
+traffic is lost meanwhile. A warm start instead:
+
+1. reads the pipeline cookie of each switch (GetForwardingPipelineConfig COOKIE_ONLY)
+   and pushes the pipeline only where it differs from p4runtime_lib.bmv2.pipelineCookie;
+2. reads back table entries, PRE entries and digest configs in a single Read;
+3. reconciles them with the desired state in one Write per switch: missing entities
+   are inserted, different ones modified, and the ones the controller did not write
+   are deleted.
+
+DesiredState is the desired config. Every successful write of a SwitchConnection is
+recorded through its state_observer, and the state is saved per switch to a
+record_io file (channel = switch name, payload = p4runtime Entity). It is only trusted
+for the pipeline cookie it was recorded with. For a switch with no saved state (first
+warm start, state file lost) the entities read back are adopted as they are: nothing
+is deleted.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from p4.v1 import p4runtime_pb2
+from p4runtime_lib.record_io import RecordWriter, read_header, read_records
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.environ.get("P4_DESIRED_STATE", "../p4src/state/desired_state.p4rec")
+
+INSERT, MODIFY, DELETE = p4runtime_pb2.Update.INSERT, p4runtime_pb2.Update.MODIFY, p4runtime_pb2.Update.DELETE
+
+
+def entity_key(entity):
+    """What identifies an entity on a switch: table + match + priority, PRE group/session id, digest id."""
+    kind = entity.WhichOneof("entity")
+    if kind == "table_entry":
+        entry = entity.table_entry
+        if entry.is_default_action:
+            return None
+        match = tuple(sorted(m.SerializeToString(deterministic=True) for m in entry.match))
+        return "table", entry.table_id, entry.priority, match
+    if kind == "packet_replication_engine_entry":
+        pre = entity.packet_replication_engine_entry
+        if pre.WhichOneof("type") == "multicast_group_entry":
+            return "multicast", pre.multicast_group_entry.multicast_group_id
+        return "clone", pre.clone_session_entry.session_id
+    if kind == "digest_entry":
+        return "digest", entity.digest_entry.digest_id
+    return None
+
+
+def canonical(entity):
+    """Serialized entity without what a switch may return differently (replica order, counters, meters)."""
+    entity = p4runtime_pb2.Entity.FromString(entity.SerializeToString())
+    kind = entity.WhichOneof("entity")
+    if kind == "table_entry":
+        entry = entity.table_entry
+        entry.ClearField("counter_data")
+        entry.ClearField("meter_config")
+        match = sorted(entry.match, key=lambda m: m.field_id)
+        entry.ClearField("match")
+        entry.match.extend(match)
+    elif kind == "packet_replication_engine_entry":
+        pre = entity.packet_replication_engine_entry
+        group = pre.multicast_group_entry if pre.WhichOneof("type") == "multicast_group_entry" \
+            else pre.clone_session_entry
+        replicas = sorted(group.replicas, key=lambda r: r.SerializeToString(deterministic=True))
+        group.ClearField("replicas")
+        group.replicas.extend(replicas)
+    return entity.SerializeToString(deterministic=True)
+
+
+def read_state(sw):
+    """Table entries, PRE entries and digest configs of a switch, in a single Read: {key: Entity}."""
+    entities = [p4runtime_pb2.Entity(), p4runtime_pb2.Entity(), p4runtime_pb2.Entity(), p4runtime_pb2.Entity()]
+    entities[0].table_entry.table_id = 0
+    entities[1].packet_replication_engine_entry.multicast_group_entry.multicast_group_id = 0
+    entities[2].packet_replication_engine_entry.clone_session_entry.session_id = 0
+    entities[3].digest_entry.digest_id = 0
+    state = {}
+    for entity in sw.ReadEntities(entities):
+        key = entity_key(entity)
+        if key is not None:
+            state[key] = entity
+    return state
+
+
+class DesiredState:
+    """
+    - entities: {switch name: {key: Entity}} last written by the controller
+    - cookies: {switch name: pipeline cookie the entities were written for}
+    Saved (coalesced, at most every save_delay seconds) to path.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, save_delay=1.0):
+        self.path = path
+        self.save_delay = save_delay
+        self.entities = {}
+        self.cookies = {}
+        self.lock = threading.Lock()
+        self._timer = None
+
+    def attach(self, switches):
+        for sw in switches.values():
+            sw.state_observer = self.record
+
+    def record(self, switch_name, update_type, entity):
+        key = entity_key(entity)
+        if key is None:
+            return
+        with self.lock:
+            entities = self.entities.setdefault(switch_name, {})
+            if update_type == DELETE:
+                entities.pop(key, None)
+            else:
+                entities[key] = p4runtime_pb2.Entity.FromString(entity.SerializeToString())
+        self._schedule_save()
+
+    def set(self, switch_name, entity):
+        """Makes entity part of the desired state without writing it (reconcile() will)."""
+        self.record(switch_name, INSERT, entity)
+
+    def reset(self, switch_name, cookie, entities=None):
+        """New pipeline on the switch (tables wiped): entities, if given, are what it holds now."""
+        with self.lock:
+            self.cookies[switch_name] = cookie
+            self.entities[switch_name] = dict(entities or {})
+        self._schedule_save()
+
+    def get(self, switch_name, cookie):
+        """Desired entities of a switch, or None if unknown or recorded for another pipeline."""
+        with self.lock:
+            if switch_name not in self.entities or self.cookies.get(switch_name) != cookie:
+                return None
+            return dict(self.entities[switch_name])
+
+    # ---------------- persistence ----------------
+    def _schedule_save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.save_delay, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def save(self):
+        with self.lock:
+            self._timer = None
+            snapshot = {name: list(entities.values()) for name, entities in self.entities.items()}
+            cookies = dict(self.cookies)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        now = time.time_ns()
+        with RecordWriter(tmp, header={"cookies": {name: str(c) for name, c in cookies.items()},
+                                       "switches": sorted(snapshot), "saved": now}) as writer:
+            for name, entities in snapshot.items():
+                for entity in entities:
+                    writer.write(entity, now, channel=name)
+        os.replace(tmp, self.path)
+
+    def flush(self):
+        with self.lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH, save_delay=1.0):
+        state = cls(path, save_delay)
+        if path is None or not os.path.exists(path):
+            return state
+        try:
+            header = read_header(path)
+            state.cookies = {name: int(c) for name, c in header.get("cookies", {}).items()}
+            state.entities = {name: {} for name in header.get("switches", [])}
+            for _, name, entity in read_records(path, p4runtime_pb2.Entity):
+                key = entity_key(entity)
+                if key is not None:
+                    state.entities.setdefault(name, {})[key] = entity
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring desired state %s: %s", path, e)
+            state.entities, state.cookies = {}, {}
+        return state
+
+
+def reconcile(sw, desired, actual, prune=True):
+    """
+    Brings the switch from actual to desired ({key: Entity}) with one batched Write:
+    deletes (only with prune), then modifies, then inserts. Returns the update counts.
+    """
+    deletes, modifies, inserts = [], [], []
+    for key, entity in desired.items():
+        current = actual.get(key)
+        if current is None:
+            inserts.append(p4runtime_pb2.Update(type=INSERT, entity=entity))
+        elif canonical(current) != canonical(entity):
+            modifies.append(p4runtime_pb2.Update(type=MODIFY, entity=entity))
+    if prune:
+        for key, entity in actual.items():
+            if key not in desired:
+                deletes.append(p4runtime_pb2.Update(type=DELETE, entity=entity))
+    updates = deletes + modifies + inserts
+    if updates:
+        sw.WriteUpdates(updates)
+    return {"insert": len(inserts), "modify": len(modifies), "delete": len(deletes), "unchanged":
+            len(desired) - len(inserts) - len(modifies)}
@@ -0,0 +1,140 @@
+"""
+Offline evaluator of the weak-learner level tables.
+
+Loads the same level1..level8 table_entries the controller installs and classifies
+a batch of flows at once, reproducing the data-plane integer semantics:
+  - features are held in bit<w> metadata, so inputs wrap modulo 2^w;
+  - CheckFeature compares feature <= (bit<w>)threshold, i.e. the threshold is
+    truncated to the feature width as well;
+  - a table miss runs NoAction and keeps (node_id, prevFeature, isTrue), so the
+    next level is looked up with the same key;
+  - levels are applied while class == CLASS_NOT_SET, which finally becomes class 0;
+  - for duplicate keys the last entry wins, as with the controller's upserts.
+
+Input: an (N, 43) integer array, column i being meta.feature<i> (see wl_features.FEATURES).
+"""
+
+import numpy as np
+
+from wl_features import (LEVEL_TABLES, CHECK_FEATURE, SET_CLASS, CLASS_NOT_SET, DEFAULT_CLASS,
+                         FEATURE_BITS, NUM_FEATURES)
+
+FEATURE_MASKS = np.array([(1 << FEATURE_BITS[i]) - 1 for i in range(NUM_FEATURES)], dtype=np.uint64)
+CLASS_MASK = 0x7
+
+
+def _encode_key(node_id, prev_feature, is_true):
+    return (np.asarray(node_id, dtype=np.int64) << 17) | (np.asarray(prev_feature, dtype=np.int64) << 1) | \
+        np.asarray(is_true, dtype=np.int64)
+
+
+class _LevelTable:
+    """Sorted keys of one level and the action data of each entry."""
+
+    def __init__(self, entries):
+        by_key = {}
+        for entry in entries:
+            node_id, prev_feature, is_true = entry["match_fields"]
+            by_key[int(_encode_key(node_id, prev_feature, is_true))] = entry
+
+        keys = sorted(by_key)
+        self.keys = np.array(keys, dtype=np.int64)
+        self.is_check = np.zeros(len(keys), dtype=bool)
+        self.node_id = np.zeros(len(keys), dtype=np.int64)
+        self.feature = np.zeros(len(keys), dtype=np.int64)
+        self.threshold = np.zeros(len(keys), dtype=np.uint64)
+        self.klass = np.zeros(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            entry = by_key[key]
+            params = entry["action_params"]
+            self.node_id[i] = params[0] & 0xFFFF
+            if entry["action"] == CHECK_FEATURE:
+                self.is_check[i] = True
+                self.feature[i] = params[1] & 0xFFFF
+                self.threshold[i] = params[2] & 0xFFFFFFFFFFFFFFFF
+            elif entry["action"] == SET_CLASS:
+                self.klass[i] = params[1] & CLASS_MASK
+            else:
+                raise ValueError(f"unsupported action {entry['action']}")
+
+    def lookup(self, keys):
+        """Entry index for each key, -1 on miss."""
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        position = np.searchsorted(self.keys, keys)
+        position = np.minimum(position, len(self.keys) - 1)
+        return np.where(self.keys[position] == keys, position, -1)
+
+
+class WLEvaluator:
+    def __init__(self, table_entries):
+        """table_entries: the list of entries of one WL, in the upload format."""
+        per_level = {table: [] for table in LEVEL_TABLES}
+        for entry in table_entries:
+            if entry["table"] in per_level:
+                per_level[entry["table"]].append(entry)
+        self.levels = [_LevelTable(per_level[table]) for table in LEVEL_TABLES]
+
+        for level in self.levels:
+            unknown = level.feature[level.is_check] >= NUM_FEATURES
+            if unknown.any():
+                # CheckFeature has no branch for these indices: isTrue is left unchanged
+                raise ValueError(f"CheckFeature on undefined feature index {int(level.feature[level.is_check][unknown][0])}")
+
+    def evaluate(self, features, return_path=False):
+        """
+        Classes of an (N, 43) batch of flows. With return_path=True also returns
+        the (N, 8) node_id after each level (-1 where the level was not applied).
+        """
+        features = np.asarray(features)
+        if features.ndim != 2 or features.shape[1] != NUM_FEATURES:
+            raise ValueError(f"expected an (N, {NUM_FEATURES}) feature array, got {features.shape}")
+        features = features.astype(np.uint64) & FEATURE_MASKS
+        rows = np.arange(len(features))
+
+        node_id = np.zeros(len(features), dtype=np.int64)
+        prev_feature = np.zeros(len(features), dtype=np.int64)
+        is_true = np.ones(len(features), dtype=np.int64)
+        klass = np.full(len(features), CLASS_NOT_SET, dtype=np.int64)
+        path = np.full((len(features), len(self.levels)), -1, dtype=np.int64)
+
+        for depth, level in enumerate(self.levels):
+            pending = np.flatnonzero(klass == CLASS_NOT_SET)
+            if len(pending) == 0:
+                break
+            hit = level.lookup(_encode_key(node_id[pending], prev_feature[pending], is_true[pending]))
+            pending, hit = pending[hit >= 0], hit[hit >= 0]
+
+            check = level.is_check[hit]
+            flows, entry = pending[check], hit[check]
+            feature = level.feature[entry]
+            threshold = level.threshold[entry] & FEATURE_MASKS[feature]
+            is_true[flows] = features[rows[flows], feature] <= threshold
+            prev_feature[flows] = feature
+            node_id[flows] = level.node_id[entry]
+
+            flows, entry = pending[~check], hit[~check]
+            klass[flows] = level.klass[entry]
+            node_id[flows] = level.node_id[entry]
+            path[pending, depth] = node_id[pending]
+
+        klass[klass == CLASS_NOT_SET] = DEFAULT_CLASS
+        if return_path:
+            return klass, path
+        return klass
+
+    def score(self, features, labels):
+        """Accuracy of the table verdicts against the expected labels."""
+        return float(np.mean(self.evaluate(features) == np.asarray(labels)))
+
+
+def majority_vote(verdicts):
+    """
+    Combines the verdicts of several WLs, a (num_wl, N) array, by majority;
+    ties go to the lowest class.
+    """
+    verdicts = np.asarray(verdicts, dtype=np.int64)
+    counts = np.zeros((CLASS_MASK + 1, verdicts.shape[1]), dtype=np.int64)
+    for row in verdicts:
+        counts[row, np.arange(verdicts.shape[1])] += 1
+    return counts.argmax(axis=0)
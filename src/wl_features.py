@@ -0,0 +1,89 @@
+"""
+Feature layout of the weak-learner level tables in advanced_tunnel.p4.
+
+CheckFeature(node_id, f_inout, threshold) compares meta.feature<f_inout> against
+threshold cast to the feature width, so the compiler and the emulator need the
+index, name and bitwidth of every feature. The order follows init_features();
+note that feature41 holds idle_max and feature42 idle_min there.
+"""
+
+LEVEL_TABLES = [f"MyIngress.level{i}" for i in range(1, 9)]
+LEVEL_TABLE_SIZE = 1024
+
+CHECK_FEATURE = "MyIngress.CheckFeature"
+SET_CLASS = "MyIngress.SetClass"
+
+# Widths of the level table keys and action parameters
+NODE_ID_BITS = 16
+FEATURE_INDEX_BITS = 16
+THRESHOLD_BITS = 64
+CLASS_BITS = 3
+
+CLASS_NOT_SET = 7
+DEFAULT_CLASS = 0  # assigned when no level sets a class
+
+# (index, name, bitwidth)
+FEATURES = [
+    (0, "fin_flag_count", 8),
+    (1, "syn_flag_count", 8),
+    (2, "rst_flag_count", 8),
+    (3, "psh_flag_count", 8),
+    (4, "ack_flag_count", 8),
+    (5, "urg_flag_count", 8),
+    (6, "ece_flag_count", 8),
+    (7, "tot_fwd_pkts", 8),
+    (8, "tot_bwd_pkts", 8),
+    (9, "totlen_fwd_pkts", 32),
+    (10, "totlen_bwd_pkts", 32),
+    (11, "fwd_pkt_len_min", 32),
+    (12, "fwd_pkt_len_max", 32),
+    (13, "fwd_pkt_len_mean", 32),
+    (14, "bwd_pkt_len_min", 32),
+    (15, "bwd_pkt_len_max", 32),
+    (16, "bwd_pkt_len_mean", 32),
+    (17, "pkt_len_max", 32),
+    (18, "pkt_len_min", 32),
+    (19, "pkt_len_mean", 32),
+    (20, "fwd_header_len", 16),
+    (21, "fwd_seg_size_min", 16),
+    (22, "bwd_header_len", 16),
+    (23, "init_fwd_win_byts", 16),
+    (24, "init_bwd_win_byts", 16),
+    (25, "fwd_act_data_pkts", 32),
+    (26, "flow_iat_min", 32),
+    (27, "flow_iat_max", 32),
+    (28, "flow_iat_mean", 32),
+    (29, "fwd_iat_min", 32),
+    (30, "fwd_iat_max", 32),
+    (31, "fwd_iat_tot", 32),
+    (32, "fwd_iat_mean", 32),
+    (33, "bwd_iat_min", 32),
+    (34, "bwd_iat_max", 32),
+    (35, "bwd_iat_tot", 32),
+    (36, "bwd_iat_mean", 32),
+    (37, "active_mean", 32),
+    (38, "active_min", 32),
+    (39, "active_max", 32),
+    (40, "idle_mean", 32),
+    (41, "idle_max", 32),
+    (42, "idle_min", 32),
+]
+
+FEATURE_INDEX = {name: index for index, name, _ in FEATURES}
+FEATURE_BITS = {index: bits for index, _, bits in FEATURES}
+NUM_FEATURES = len(FEATURES)
+
+
+def feature_index(feature):
+    """P4 feature index from an index or a feature name."""
+    if isinstance(feature, str):
+        if feature not in FEATURE_INDEX:
+            raise ValueError(f"unknown feature {feature!r}")
+        return FEATURE_INDEX[feature]
+    if feature not in FEATURE_BITS:
+        raise ValueError(f"feature index {feature} out of range 0..{NUM_FEATURES - 1}")
+    return int(feature)
+
+
+def feature_max(index):
+    return (1 << FEATURE_BITS[index]) - 1
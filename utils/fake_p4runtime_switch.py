@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+In-process stand-in for a BMv2 P4Runtime server, for controller tests and benchmarks
+without Mininet.
+
+A FakeP4RuntimeSwitch loads a p4info (e.g. advanced_tunnel.p4.p4info.txt) and keeps
+in memory what the controller can touch through P4Runtime:
+  - table entries (INSERT/MODIFY/DELETE with the usual ALREADY_EXISTS/NOT_FOUND errors,
+    default actions), PRE multicast groups and clone sessions, digest configurations;
+  - counters and registers sized from the p4info, readable with wildcards and
+    settable from the test;
+  - StreamChannel with master arbitration (highest election id wins), PacketOut
+    capture, digest lists and packet-ins pushed to the master stream.
+Data-plane behaviour is not emulated: traffic is scripted with inject_digest(),
+inject_packet_in(), add_counter()/set_register() or the schedule() generator.
+
+Every RPC can be delayed with `latency`: seconds, a {rpc_name: seconds} dict or a
+callable(rpc_name) -> seconds.
+
+Usage:
+    python3 fake_p4runtime_switch.py --p4info ../p4src/build/advanced_tunnel.p4.p4info.txt \
+        --count 12 --base-port 50051 [--latency-ms 1] [--digest-rate 100]
+"""
+
+import argparse
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent import futures
+
+import google.protobuf.text_format
+import grpc
+from google.rpc import code_pb2, status_pb2
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+logger = logging.getLogger(__name__)
+
+READ_BATCH = 1000  # entities per ReadResponse
+
+
+class FakeSwitchError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def load_p4info(p4info):
+    """P4Info message from a text p4info file path or an existing message."""
+    if isinstance(p4info, p4info_pb2.P4Info):
+        return p4info
+    message = p4info_pb2.P4Info()
+    with open(p4info) as f:
+        google.protobuf.text_format.Merge(f.read(), message, allow_unknown_field=True)
+    return message
+
+
+def encode_bits(value, bitwidth):
+    return int(value).to_bytes(max(1, (bitwidth + 7) // 8), "big")
+
+
+def _canonical(value):
+    """P4Runtime bytestrings compare without their leading zeros."""
+    return value.lstrip(b"\x00") or b"\x00"
+
+
+def _match_key(entry):
+    fields = []
+    for m in entry.match:
+        kind = m.WhichOneof("field_match_type")
+        if kind == "exact":
+            fields.append((m.field_id, kind, _canonical(m.exact.value)))
+        elif kind == "lpm":
+            fields.append((m.field_id, kind, _canonical(m.lpm.value), m.lpm.prefix_len))
+        elif kind == "ternary":
+            fields.append((m.field_id, kind, _canonical(m.ternary.value), _canonical(m.ternary.mask)))
+        elif kind == "range":
+            fields.append((m.field_id, kind, _canonical(m.range.low), _canonical(m.range.high)))
+        else:
+            fields.append((m.field_id, kind, m.SerializeToString()))
+    return tuple(sorted(fields)), entry.priority
+
+
+class _Stream:
+    """Outgoing queue of one StreamChannel."""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.election_id = None
+        self.queue = queue.Queue()
+
+
+class FakeP4RuntimeSwitch(p4runtime_pb2_grpc.P4RuntimeServicer):
+    def __init__(self, p4info, device_id=1, name=None, latency=0.0, stream_buffer=0):
+        self.device_id = device_id
+        self.name = name or f"s{device_id}"
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.streams = []
+        self.master_election_id = None
+        self.packet_outs = queue.Queue()  # PacketOut messages received from the controller
+        self.digest_acks = []
+        self.list_ids = itertools.count(1)
+        self.rpc_count = {}
+        self.stream_buffer = stream_buffer  # max responses queued per stream, 0: unbounded
+        self.dropped_digests = 0
+        self.dropped_packet_ins = 0
+        self.pending_digests = {}  # digest_id -> (samples waiting for their list, flush timer)
+        self.device_config = b""
+        self.cookie = 0
+        self.load_pipeline(load_p4info(p4info))
+
+    # ------------------------------------------------------------------ state
+
+    def load_pipeline(self, p4info):
+        with self.lock:
+            self.p4info = p4info
+            self.tables = {t.preamble.id: t for t in p4info.tables}
+            self.entries = {table_id: {} for table_id in self.tables}
+            self.default_entries = {}
+            self.multicast_groups = {}
+            self.clone_sessions = {}
+            self.digest_configs = {}
+            self.counter_sizes = {c.preamble.id: c.size for c in p4info.counters}
+            self.counters = {counter_id: [[0, 0] for _ in range(size)]
+                             for counter_id, size in self.counter_sizes.items()}
+            self.register_widths = {r.preamble.id: r.type_spec.bitstring.bit.bitwidth for r in p4info.registers}
+            self.registers = {r.preamble.id: [0] * r.size for r in p4info.registers}
+            self.ids = {}
+            for kind in ("tables", "actions", "counters", "registers", "digests", "controller_packet_metadata"):
+                for item in getattr(p4info, kind):
+                    self.ids[(kind, item.preamble.name)] = item.preamble.id
+
+    def _id(self, kind, name_or_id):
+        if isinstance(name_or_id, int):
+            return name_or_id
+        try:
+            return self.ids[(kind, name_or_id)]
+        except KeyError:
+            raise KeyError(f"{self.name}: no {kind} named {name_or_id!r} in the p4info")
+
+    def add_counter(self, counter, index, packets=1, byte_count=0):
+        with self.lock:
+            cell = self.counters[self._id("counters", counter)][index]
+            cell[0] += packets
+            cell[1] += byte_count
+
+    def set_register(self, register, index, value):
+        register_id = self._id("registers", register)
+        with self.lock:
+            self.registers[register_id][index] = int(value) & ((1 << self.register_widths[register_id]) - 1)
+
+    def table_entries(self, table):
+        with self.lock:
+            return list(self.entries[self._id("tables", table)].values())
+
+    def _delay(self, rpc):
+        self.rpc_count[rpc] = self.rpc_count.get(rpc, 0) + 1
+        latency = self.latency
+        if callable(latency):
+            latency = latency(rpc)
+        elif isinstance(latency, dict):
+            latency = latency.get(rpc, 0.0)
+        if latency:
+            time.sleep(latency)
+
+    # ------------------------------------------------------------------ unary RPCs
+
+    def Capabilities(self, request, context):
+        self._delay("Capabilities")
+        return p4runtime_pb2.CapabilitiesResponse(p4runtime_api_version="1.3.0")
+
+    def SetForwardingPipelineConfig(self, request, context):
+        self._delay("SetForwardingPipelineConfig")
+        if not self._is_master(request.election_id):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "not master")
+        self.device_config = request.config.p4_device_config
+        self.cookie = request.config.cookie.cookie
+        self.load_pipeline(request.config.p4info)
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        self._delay("GetForwardingPipelineConfig")
+        response = p4runtime_pb2.GetForwardingPipelineConfigResponse()
+        response.config.cookie.cookie = self.cookie
+        if request.response_type != p4runtime_pb2.GetForwardingPipelineConfigRequest.COOKIE_ONLY:
+            response.config.p4info.CopyFrom(self.p4info)
+            response.config.p4_device_config = self.device_config
+        return response
+
+    def Write(self, request, context):
+        self._delay("Write")
+        if not self._is_master(request.election_id):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "not master: write rejected")
+        try:
+            with self.lock:
+                for update in request.updates:
+                    self._apply(update)
+        except FakeSwitchError as e:
+            context.abort(e.code, str(e))
+        return p4runtime_pb2.WriteResponse()
+
+    def _is_master(self, election_id):
+        with self.lock:
+            return self.master_election_id is not None and \
+                (election_id.high, election_id.low) == self.master_election_id
+
+    def _apply(self, update):
+        entity = update.entity
+        kind = entity.WhichOneof("entity")
+        if kind == "table_entry":
+            self._write_table_entry(update.type, entity.table_entry)
+        elif kind == "packet_replication_engine_entry":
+            pre = entity.packet_replication_engine_entry
+            if pre.WhichOneof("type") == "multicast_group_entry":
+                self._write_keyed(self.multicast_groups, pre.multicast_group_entry.multicast_group_id,
+                                  update.type, pre.multicast_group_entry, "multicast group")
+            else:
+                self._write_keyed(self.clone_sessions, pre.clone_session_entry.session_id,
+                                  update.type, pre.clone_session_entry, "clone session")
+        elif kind == "digest_entry":
+            if entity.digest_entry.digest_id not in {d.preamble.id for d in self.p4info.digests}:
+                raise FakeSwitchError(grpc.StatusCode.NOT_FOUND, f"unknown digest id {entity.digest_entry.digest_id}")
+            self._write_keyed(self.digest_configs, entity.digest_entry.digest_id, update.type,
+                              entity.digest_entry, "digest config")
+        elif kind == "counter_entry":
+            entry = entity.counter_entry
+            if update.type != p4runtime_pb2.Update.MODIFY or entry.counter_id not in self.counters:
+                raise FakeSwitchError(grpc.StatusCode.INVALID_ARGUMENT, "counters only support MODIFY")
+            for index in self._indices(entry, self.counter_sizes[entry.counter_id]):
+                self.counters[entry.counter_id][index] = [entry.data.packet_count, entry.data.byte_count]
+        elif kind == "register_entry":
+            entry = entity.register_entry
+            if update.type != p4runtime_pb2.Update.MODIFY or entry.register_id not in self.registers:
+                raise FakeSwitchError(grpc.StatusCode.INVALID_ARGUMENT, "registers only support MODIFY")
+            value = int.from_bytes(entry.data.bitstring, "big")
+            for index in self._indices(entry, len(self.registers[entry.register_id])):
+                self.registers[entry.register_id][index] = value
+        else:
+            raise FakeSwitchError(grpc.StatusCode.UNIMPLEMENTED, f"{kind} writes are not supported")
+
+    @staticmethod
+    def _indices(entry, size):
+        if entry.HasField("index"):
+            if not 0 <= entry.index.index < size:
+                raise FakeSwitchError(grpc.StatusCode.OUT_OF_RANGE, f"index {entry.index.index} out of range")
+            return [entry.index.index]
+        return range(size)
+
+    @staticmethod
+    def _write_keyed(store, key, update_type, message, what):
+        if update_type == p4runtime_pb2.Update.INSERT:
+            if key in store:
+                raise FakeSwitchError(grpc.StatusCode.ALREADY_EXISTS, f"{what} {key} already exists")
+            store[key] = type(message)()
+            store[key].CopyFrom(message)
+        elif update_type == p4runtime_pb2.Update.MODIFY:
+            if key not in store:
+                raise FakeSwitchError(grpc.StatusCode.NOT_FOUND, f"{what} {key} not found")
+            store[key].CopyFrom(message)
+        elif update_type == p4runtime_pb2.Update.DELETE:
+            if store.pop(key, None) is None:
+                raise FakeSwitchError(grpc.StatusCode.NOT_FOUND, f"{what} {key} not found")
+        else:
+            raise FakeSwitchError(grpc.StatusCode.INVALID_ARGUMENT, "unspecified update type")
+
+    def _write_table_entry(self, update_type, entry):
+        table = self.tables.get(entry.table_id)
+        if table is None:
+            raise FakeSwitchError(grpc.StatusCode.NOT_FOUND, f"unknown table id {entry.table_id}")
+        action = entry.action.action
+        if entry.action.HasField("action") and \
+                action.action_id not in {ref.id for ref in table.action_refs}:
+            raise FakeSwitchError(grpc.StatusCode.INVALID_ARGUMENT,
+                                  f"action {action.action_id} not allowed in {table.preamble.name}")
+        if entry.is_default_action:
+            if update_type != p4runtime_pb2.Update.MODIFY:
+                raise FakeSwitchError(grpc.StatusCode.INVALID_ARGUMENT, "default actions can only be modified")
+            self.default_entries[entry.table_id] = entry
+            return
+        entries = self.entries[entry.table_id]
+        key = _match_key(entry)
+        if update_type == p4runtime_pb2.Update.INSERT and key not in entries and len(entries) >= table.size > 0:
+            raise FakeSwitchError(grpc.StatusCode.RESOURCE_EXHAUSTED, f"{table.preamble.name} is full")
+        stored = p4runtime_pb2.TableEntry()
+        stored.CopyFrom(entry)
+        self._write_keyed(entries, key, update_type, stored, f"entry of {table.preamble.name}")
+
+    def Read(self, request, context):
+        self._delay("Read")
+        entities = []
+        with self.lock:
+            for entity in request.entities:
+                entities.extend(self._read(entity))
+        for start in range(0, len(entities), READ_BATCH):
+            response = p4runtime_pb2.ReadResponse()
+            response.entities.extend(entities[start:start + READ_BATCH])
+            yield response
+        if not entities:
+            yield p4runtime_pb2.ReadResponse()
+
+    def _read(self, entity):
+        kind = entity.WhichOneof("entity")
+        result = []
+        if kind == "table_entry":
+            table_ids = [entity.table_entry.table_id] if entity.table_entry.table_id else list(self.entries)
+            for table_id in table_ids:
+                for entry in self.entries.get(table_id, {}).values():
+                    out = p4runtime_pb2.Entity()
+                    out.table_entry.CopyFrom(entry)
+                    result.append(out)
+        elif kind == "counter_entry":
+            request = entity.counter_entry
+            counter_ids = [request.counter_id] if request.counter_id else list(self.counters)
+            for counter_id in counter_ids:
+                cells = self.counters[counter_id]
+                for index in self._indices(request, len(cells)):
+                    out = p4runtime_pb2.Entity()
+                    out.counter_entry.counter_id = counter_id
+                    out.counter_entry.index.index = index
+                    out.counter_entry.data.packet_count, out.counter_entry.data.byte_count = cells[index]
+                    result.append(out)
+        elif kind == "register_entry":
+            request = entity.register_entry
+            register_ids = [request.register_id] if request.register_id else list(self.registers)
+            for register_id in register_ids:
+                cells, width = self.registers[register_id], self.register_widths[register_id]
+                for index in self._indices(request, len(cells)):
+                    out = p4runtime_pb2.Entity()
+                    out.register_entry.register_id = register_id
+                    out.register_entry.index.index = index
+                    out.register_entry.data.bitstring = encode_bits(cells[index], width)
+                    result.append(out)
+        elif kind == "packet_replication_engine_entry":
+            for group in self.multicast_groups.values():
+                out = p4runtime_pb2.Entity()
+                out.packet_replication_engine_entry.multicast_group_entry.CopyFrom(group)
+                result.append(out)
+            for session in self.clone_sessions.values():
+                out = p4runtime_pb2.Entity()
+                out.packet_replication_engine_entry.clone_session_entry.CopyFrom(session)
+                result.append(out)
+        elif kind == "digest_entry":
+            for config in self.digest_configs.values():
+                out = p4runtime_pb2.Entity()
+                out.digest_entry.CopyFrom(config)
+                result.append(out)
+        return result
+
+    # ------------------------------------------------------------------ stream channel
+
+    def StreamChannel(self, request_iterator, context):
+        stream = _Stream(context.peer())
+        with self.lock:
+            self.streams.append(stream)
+        context.add_callback(lambda: stream.queue.put(None))
+        reader = threading.Thread(target=self._read_stream, args=(request_iterator, stream), daemon=True)
+        reader.start()
+        try:
+            while True:
+                message = stream.queue.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            with self.lock:
+                self.streams.remove(stream)
+                if stream.election_id == self.master_election_id:
+                    self.master_election_id = max((s.election_id for s in self.streams if s.election_id),
+                                                  default=None)
+
+    def _read_stream(self, request_iterator, stream):
+        try:
+            for request in request_iterator:
+                kind = request.WhichOneof("update")
+                if kind == "arbitration":
+                    self._delay("StreamChannel.arbitration")
+                    self._arbitrate(stream, request.arbitration)
+                elif kind == "packet":
+                    self._delay("StreamChannel.packet")
+                    self.packet_outs.put(request.packet)
+                elif kind == "digest_ack":
+                    self.digest_acks.append((request.digest_ack.digest_id, request.digest_ack.list_id))
+        except grpc.RpcError:
+            pass
+        finally:
+            stream.queue.put(None)
+
+    def _arbitrate(self, stream, arbitration):
+        election_id = (arbitration.election_id.high, arbitration.election_id.low)
+        with self.lock:
+            stream.election_id = election_id
+            if self.master_election_id is None or election_id >= self.master_election_id:
+                self.master_election_id = election_id
+            # Every client learns who the master is; only the master gets OK
+            for s in self.streams:
+                if s.election_id is None:
+                    continue
+                response = p4runtime_pb2.StreamMessageResponse()
+                response.arbitration.device_id = self.device_id
+                response.arbitration.election_id.high, response.arbitration.election_id.low = self.master_election_id
+                is_master = s.election_id == self.master_election_id
+                response.arbitration.status.CopyFrom(status_pb2.Status(
+                    code=code_pb2.OK if is_master else code_pb2.ALREADY_EXISTS,
+                    message="Is master" if is_master else "Is slave"))
+                if s is stream or is_master:
+                    s.queue.put(response)
+
+    def _master_stream(self):
+        with self.lock:
+            for stream in self.streams:
+                if stream.election_id is not None and stream.election_id == self.master_election_id:
+                    return stream
+        return None
+
+    # ------------------------------------------------------------------ scripted traffic
+
+    def _struct_widths(self, digest_id):
+        digest = next(d for d in self.p4info.digests if d.preamble.id == digest_id)
+        struct_name = digest.type_spec.struct.name
+        if struct_name in self.p4info.type_info.structs:
+            return [m.type_spec.bitstring.bit.bitwidth for m in self.p4info.type_info.structs[struct_name].members]
+        return None
+
+    def build_digest_lists(self, digest, samples, list_size=None):
+        """DigestList responses carrying samples (tuples of ints, one per struct member)."""
+        digest_id = self._id("digests", digest)
+        widths = self._struct_widths(digest_id)
+        list_size = list_size or len(samples) or 1
+        responses = []
+        for start in range(0, len(samples), list_size):
+            response = p4runtime_pb2.StreamMessageResponse()
+            response.digest.digest_id = digest_id
+            response.digest.list_id = next(self.list_ids)
+            response.digest.timestamp = time.time_ns()
+            for sample in samples[start:start + list_size]:
+                data = response.digest.data.add()
+                for k, value in enumerate(sample):
+                    width = widths[k] if widths else max(8, int(value).bit_length())
+                    data.struct.members.add().bitstring = encode_bits(value, width)
+            responses.append(response)
+        return responses
+
+    def build_packet_in(self, payload, metadata=None):
+        """PacketIn response, metadata given as {name: value} of the "packet_in" controller header."""
+        response = p4runtime_pb2.StreamMessageResponse()
+        response.packet.payload = bytes(payload)
+        header = next((h for h in self.p4info.controller_packet_metadata if h.preamble.name == "packet_in"), None)
+        for name, value in (metadata or {}).items():
+            field = next(m for m in header.metadata if m.name == name)
+            response.packet.metadata.add(metadata_id=field.id, value=encode_bits(value, field.bitwidth))
+        return response
+
+    def _send(self, stream, response):
+        # Like the BMv2 digest/packet-in buffers, a full stream buffer drops the message
+        if self.stream_buffer and stream.queue.qsize() >= self.stream_buffer:
+            return False
+        stream.queue.put(response)
+        return True
+
+    def inject_digest(self, digest, samples, batch=False):
+        """
+        Sends samples as digest lists on the master stream, split according to the
+        configured max_list_size. Returns the list ids actually sent; samples are dropped
+        while the digest is not enabled by a DigestEntry or the stream buffer is full.
+
+        With batch=True the samples are buffered like BMv2 does: a list is sent when it
+        reaches max_list_size or max_timeout_ns after its first sample, whichever comes
+        first (the list timestamp is the send time).
+        """
+        digest_id = self._id("digests", digest)
+        config = self.digest_configs.get(digest_id)
+        if config is None or self._master_stream() is None:
+            self.dropped_digests += len(samples)
+            return []
+        if not batch:
+            return self._send_digest(digest_id, list(samples), config.config.max_list_size)
+
+        list_size = config.config.max_list_size or 1
+        with self.lock:
+            pending, timer = self.pending_digests.pop(digest_id, ([], None))
+            pending.extend(samples)
+            full = len(pending) - len(pending) % list_size
+            ready, pending = pending[:full], pending[full:]
+            if ready and timer is not None:
+                timer.cancel()
+                timer = None
+            if pending:
+                if timer is None:
+                    # the timeout starts with the first sample of the list
+                    timer = threading.Timer(config.config.max_timeout_ns / 1e9, self.flush_digests, (digest_id,))
+                    timer.daemon = True
+                    timer.start()
+                self.pending_digests[digest_id] = (pending, timer)
+        return self._send_digest(digest_id, ready, list_size) if ready else []
+
+    def flush_digests(self, digest=None):
+        """Sends the samples buffered by inject_digest(batch=True) now."""
+        with self.lock:
+            digest_ids = [self._id("digests", digest)] if digest is not None else list(self.pending_digests)
+            ready = {}
+            for digest_id in digest_ids:
+                pending, timer = self.pending_digests.pop(digest_id, ([], None))
+                if timer is not None:
+                    timer.cancel()
+                if pending:
+                    ready[digest_id] = pending
+        list_ids = []
+        for digest_id, samples in ready.items():
+            config = self.digest_configs.get(digest_id)
+            list_ids += self._send_digest(digest_id, samples, config.config.max_list_size if config else None)
+        return list_ids
+
+    def _send_digest(self, digest_id, samples, list_size):
+        stream = self._master_stream()
+        if stream is None:
+            self.dropped_digests += len(samples)
+            return []
+        list_ids = []
+        for response in self.build_digest_lists(digest_id, samples, list_size):
+            if self._send(stream, response):
+                list_ids.append(response.digest.list_id)
+            else:
+                self.dropped_digests += len(response.digest.data)
+        return list_ids
+
+    def inject_packet_in(self, payload, metadata=None):
+        """Sends a PacketIn on the master stream; False if it was dropped."""
+        stream = self._master_stream()
+        if stream is None or not self._send(stream, self.build_packet_in(payload, metadata)):
+            self.dropped_packet_ins += 1
+            return False
+        return True
+
+    def schedule(self, rate, count, event):
+        """
+        Calls event(i) for i in range(count) at `rate` calls per second (0: as fast as
+        possible) in a background thread, e.g. event=lambda i: sw.inject_digest(...).
+        Returns the thread; the schedule is fixed, so runs are reproducible.
+        """
+        def run():
+            start = time.perf_counter()
+            for i in range(count):
+                if rate:
+                    delay = start + i / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                event(i)
+
+        thread = threading.Thread(target=run, name=f"{self.name}-schedule", daemon=True)
+        thread.start()
+        return thread
+
+
+def start_fake_switches(p4info, count, host="127.0.0.1", base_port=50050, latency=0.0, stream_buffer=0,
+                        max_workers=16):
+    """
+    Serves `count` fake switches s1..sN on host:base_port+1.. (the addresses used by
+    SwitchConnectionManager). Returns [(server, switch)]; stop with server.stop(None).
+    """
+    p4info = load_p4info(p4info)
+    started = []
+    for i in range(count):
+        switch = FakeP4RuntimeSwitch(p4info, device_id=i + 1, latency=latency, stream_buffer=stream_buffer)
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(switch, server)
+        port = server.add_insecure_port(f"{host}:{base_port + i + 1}")
+        if port == 0:
+            raise RuntimeError(f"cannot bind {host}:{base_port + i + 1}")
+        server.start()
+        started.append((server, switch))
+        logger.info("Fake switch %s listening on %s:%d", switch.name, host, port)
+    return started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake P4Runtime switches for controller tests")
+    parser.add_argument("--p4info", default="../p4src/build/advanced_tunnel.p4.p4info.txt")
+    parser.add_argument("--count", type=int, default=12)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=50050, help="switch i listens on base-port + i")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every RPC")
+    parser.add_argument("--digest-rate", type=float, default=0.0,
+                        help="congestion digests per second per switch once the controller enables them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    started = start_fake_switches(args.p4info, args.count, args.host, args.base_port, args.latency_ms / 1000.0)
+    if args.digest_rate:
+        for _, switch in started:
+            members = len(switch._struct_widths(switch._id("digests", "congestion_digest_t")) or [])
+
+            def event(i, switch=switch, members=members):
+                # tunnel 1, in_port 1, increasing timestamps, everything else 0
+                switch.inject_digest("congestion_digest_t", [(1, 1) + (0,) * 5 + (i,) + (0,) * (members - 8)])
+
+            switch.schedule(args.digest_rate, 1 << 62, event)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server, _ in started:
+            server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
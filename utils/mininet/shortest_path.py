@@ -11,20 +11,28 @@ class ShortestPath:
 
     def get(self, a, b, exclude=lambda node: False):
         # Shortest path from a to b
-        return self._recPath(a, b, [], exclude)
+        return self._bfsPath(a, b, exclude)
 
-    def _recPath(self, a, b, visited, exclude):
+    def _bfsPath(self, a, b, exclude):
+        # Breadth-first: linear in the edges (the recursive search was exponential);
+        # excluded nodes can only be the destination
         if a == b: return [a]
-        new_visited = visited + [a]
-        paths = []
-        for neighbor in self.neighbors[a]:
-            if neighbor in new_visited: continue
-            if exclude(neighbor) and neighbor != b: continue
-            path = self._recPath(neighbor, b, new_visited, exclude)
-            if path: paths.append(path)
-
-        paths.sort(key=len)
-        return [a] + paths[0] if len(paths) else None
+        previous = {a: None}
+        frontier = [a]
+        while frontier and b not in previous:
+            next_frontier = []
+            for node in frontier:
+                for neighbor in sorted(self.neighbors.get(node, ())):
+                    if neighbor in previous: continue
+                    if exclude(neighbor) and neighbor != b: continue
+                    previous[neighbor] = node
+                    next_frontier.append(neighbor)
+            frontier = next_frontier
+        if b not in previous: return None
+        path = [b]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        return path[::-1]
 
 if __name__ == '__main__':
 
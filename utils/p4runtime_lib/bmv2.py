@@ -12,10 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import hashlib
+import os
+import threading
+
 from p4.tmp import p4config_pb2
+from p4.v1 import p4runtime_pb2
 
 from .switch import SwitchConnection
 
+# (path, mtime, size) -> serialized P4DeviceConfig: the BMv2 JSON is read once for all switches
+_device_config_cache = {}
+_device_config_lock = threading.Lock()
+
 
 def buildDeviceConfig(bmv2_json_file_path=None):
     "Builds the device config for BMv2"
@@ -26,6 +35,35 @@ def buildDeviceConfig(bmv2_json_file_path=None):
     return device_config
 
 
+def deviceConfigBytes(bmv2_json_file_path):
+    "Serialized device config of a BMv2 JSON, cached until the file changes"
+    stat = os.stat(bmv2_json_file_path)
+    key = (os.path.abspath(bmv2_json_file_path), stat.st_mtime_ns, stat.st_size)
+    with _device_config_lock:
+        data = _device_config_cache.get(key)
+        if data is None:
+            data = buildDeviceConfig(bmv2_json_file_path).SerializeToString()
+            _device_config_cache.clear()
+            _device_config_cache[key] = data
+    return data
+
+
+def pipelineCookie(p4info, device_config):
+    "64-bit cookie identifying a p4info + device config pair (compared on warm restart)"
+    digest = hashlib.sha256(p4info.SerializeToString(deterministic=True))
+    digest.update(device_config)
+    return int.from_bytes(digest.digest()[:8], 'big')
+
+
+def buildPipelineConfig(p4info, bmv2_json_file_path):
+    "ForwardingPipelineConfig to push on every switch: SetForwardingPipelineConfig(config=...)"
+    config = p4runtime_pb2.ForwardingPipelineConfig()
+    config.p4info.CopyFrom(p4info)
+    config.p4_device_config = deviceConfigBytes(bmv2_json_file_path)
+    config.cookie.cookie = pipelineCookie(p4info, config.p4_device_config)
+    return config
+
+
 class Bmv2SwitchConnection(SwitchConnection):
     def buildDeviceConfig(self, **kwargs):
         return buildDeviceConfig(**kwargs)
@@ -13,7 +13,9 @@
 # limitations under the License.
 #
 import re
+import hashlib
 import ipaddress
+import os
 import google.protobuf.text_format
 import traceback
 from p4.v1 import p4runtime_pb2
@@ -22,13 +24,40 @@ from p4.config.v1 import p4info_pb2
 from .convert import encode
 
 
+P4INFO_CACHE_DIR = ".p4info_cache"
+
+
 class P4InfoHelper(object):
-    def __init__(self, p4_info_filepath):
+    def __init__(self, p4_info_filepath, cache=True):
         p4info = p4info_pb2.P4Info()
-        # Load the p4info file into a skeleton P4Info object
-        with open(p4_info_filepath) as p4info_f:
-            google.protobuf.text_format.Merge(p4info_f.read(), p4info,
-                                              allow_unknown_field=True)
+        with open(p4_info_filepath, 'rb') as p4info_f:
+            text = p4info_f.read()
+        # text_format.Merge is slow: the binary P4Info is cached next to the file, keyed by its hash
+        cache_file = None
+        if cache:
+            cache_file = os.path.join(os.path.dirname(os.path.abspath(p4_info_filepath)), P4INFO_CACHE_DIR,
+                                      hashlib.sha256(text).hexdigest() + ".bin")
+        self.from_cache = False
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    p4info.ParseFromString(f.read())
+                self.from_cache = True
+            except Exception as e:
+                print(f"Ignoring p4info cache {cache_file}: {e}")
+                p4info.Clear()
+        if not self.from_cache:
+            # Load the p4info file into a skeleton P4Info object
+            google.protobuf.text_format.Merge(text.decode('utf-8'), p4info, allow_unknown_field=True)
+            if cache_file is not None:
+                try:
+                    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                    tmp = f"{cache_file}.{os.getpid()}.tmp"
+                    with open(tmp, 'wb') as f:
+                        f.write(p4info.SerializeToString())
+                    os.replace(tmp, cache_file)
+                except OSError as e:
+                    print(f"Cannot write p4info cache {cache_file}: {e}")
         self.p4info = p4info
 
     def get(self, entity_type, name=None, id=None):
@@ -0,0 +1,97 @@
+"""
+Renders binary P4Runtime logs as text: request logs written by GrpcRequestLogger and
+StreamChannel captures (src/stream_recorder.py).
+
+Usage:
+    python3 -m p4runtime_lib.log_decoder ../p4src/logs/s1-p4runtime-requests.p4rtlog [--method Write]
+        [--since 2025-01-28T20:27:10] [--limit 100] [--summary]
+Rotated files (log.1, log.2, ...) can be passed as well, oldest first.
+"""
+
+import argparse
+import collections
+import datetime
+import sys
+
+from google.protobuf import text_format
+from p4.v1 import p4runtime_pb2
+
+from .record_io import read_header, read_records
+
+REQUEST_TYPES = {
+    "Write": p4runtime_pb2.WriteRequest,
+    "Read": p4runtime_pb2.ReadRequest,
+    "SetForwardingPipelineConfig": p4runtime_pb2.SetForwardingPipelineConfigRequest,
+    "GetForwardingPipelineConfig": p4runtime_pb2.GetForwardingPipelineConfigRequest,
+    "Capabilities": p4runtime_pb2.CapabilitiesRequest,
+    "stream": p4runtime_pb2.StreamMessageResponse,
+}
+
+
+def decode(payload, channel):
+    message_class = REQUEST_TYPES.get(channel.rsplit('/', 1)[-1])
+    if message_class is None:
+        return None
+    message = message_class()
+    message.ParseFromString(payload)
+    return message
+
+
+def iter_log(paths, method=None, since_ns=0):
+    for path in paths:
+        for timestamp_ns, channel, payload in read_records(path):
+            if timestamp_ns < since_ns:
+                continue
+            if method is not None and channel.rsplit('/', 1)[-1] != method:
+                continue
+            yield timestamp_ns, channel, payload
+
+
+def render(timestamp_ns, channel, payload, out):
+    ts = datetime.datetime.utcfromtimestamp(timestamp_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    out.write("\n[%s] %s\n---\n" % (ts, channel))
+    message = decode(payload, channel)
+    if message is None:
+        out.write("(%d bytes, unknown message type)\n" % len(payload))
+    else:
+        out.write(text_format.MessageToString(message))
+    out.write('---\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render binary P4Runtime logs as text")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--method", help="only this method, e.g. Write")
+    parser.add_argument("--since", help="ISO timestamp (UTC)")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--summary", action="store_true", help="count and bytes per method instead of the messages")
+    args = parser.parse_args(argv)
+
+    since_ns = 0
+    if args.since:
+        since = datetime.datetime.fromisoformat(args.since).replace(tzinfo=datetime.timezone.utc)
+        since_ns = int(since.timestamp() * 1e9)
+
+    records = iter_log(args.paths, args.method, since_ns)
+    if args.summary:
+        count, size = collections.Counter(), collections.Counter()
+        for _, channel, payload in records:
+            count[channel] += 1
+            size[channel] += len(payload)
+        for path in args.paths:
+            print(f"{path}: {read_header(path)}")
+        for channel in sorted(count):
+            print(f"{channel:<50} {count[channel]:>10} messages {size[channel]:>14} bytes")
+        return
+
+    try:
+        for n, (timestamp_ns, channel, payload) in enumerate(records):
+            if args.limit is not None and n >= args.limit:
+                break
+            render(timestamp_ns, channel, payload, sys.stdout)
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Compact binary capture files for P4Runtime messages.
+
+Layout:
+    MAGIC, varint length + JSON header (free-form metadata, e.g. the switch name)
+    records: varint length + <uint64 timestamp_ns, uint16 channel> + payload
+
+Channels tag the records of a file (e.g. "stream" or a gRPC method name). They are
+declared in-band the first time they are used, by a record on DEFINE_CHANNEL whose
+payload is the channel name, so a file can be read without knowing them in advance.
+Files ending in .gz are written gzip compressed; readers detect compression from the
+content, whatever the name.
+"""
+
+import gzip
+import json
+import struct
+
+MAGIC = b"P4RTREC1"
+RECORD_HEADER = struct.Struct("<QH")
+DEFINE_CHANNEL = 0xFFFF
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(f):
+    result = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift:
+                raise EOFError("truncated varint")
+            return None
+        result |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            return result
+        shift += 7
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _open(path, mode):
+    if "r" in mode:
+        with open(path, "rb") as f:
+            compressed = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    else:
+        compressed = str(path).endswith(".gz")
+    return gzip.open(path, mode) if compressed else open(path, mode)
+
+
+class RecordWriter:
+    """Appends records to a capture file. Not thread safe: callers serialize writes."""
+
+    def __init__(self, path, header=None):
+        self.path = path
+        self.f = _open(path, "wb")
+        self.channels = {}
+        self.records = 0
+        self.bytes = 0
+        meta = json.dumps(header or {}).encode()
+        self._raw(MAGIC + _encode_varint(len(meta)) + meta)
+
+    def _raw(self, data):
+        self.f.write(data)
+        self.bytes += len(data)
+
+    def _record(self, timestamp_ns, channel, payload):
+        body_len = RECORD_HEADER.size + len(payload)
+        self._raw(_encode_varint(body_len) + RECORD_HEADER.pack(timestamp_ns, channel) + payload)
+
+    def write(self, payload, timestamp_ns, channel="stream"):
+        """payload: bytes or a protobuf message."""
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = payload.SerializeToString()
+        channel_id = self.channels.get(channel)
+        if channel_id is None:
+            channel_id = self.channels[channel] = len(self.channels)
+            self._record(timestamp_ns, DEFINE_CHANNEL, channel.encode())
+        self._record(timestamp_ns, channel_id, payload)
+        self.records += 1
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path):
+    with _open(path, "rb") as f:
+        return _read_header(f)
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a P4Runtime capture file")
+    length = _read_varint(f)
+    return json.loads(f.read(length) or b"{}")
+
+
+def read_records(path, message_class=None):
+    """
+    Yields (timestamp_ns, channel, payload) for every record; payloads are parsed into
+    message_class when given. A truncated last record (capture still being written or
+    interrupted) ends the iteration.
+    """
+    channels = []
+    with _open(path, "rb") as f:
+        _read_header(f)
+        while True:
+            try:
+                length = _read_varint(f)
+            except EOFError:
+                return
+            if length is None:
+                return
+            body = f.read(length)
+            if len(body) < length:
+                return
+            timestamp_ns, channel = RECORD_HEADER.unpack_from(body)
+            payload = body[RECORD_HEADER.size:]
+            if channel == DEFINE_CHANNEL:
+                channels.append(payload.decode())
+                continue
+            if message_class is not None:
+                message = message_class()
+                message.ParseFromString(payload)
+                payload = message
+            yield timestamp_ns, channels[channel], payload
@@ -13,8 +13,11 @@
 # limitations under the License.
 #
 from abc import abstractmethod
-from datetime import datetime
+from collections import deque
 from queue import Queue
+import atexit
+import os
+import threading
 import time
 import queue
 import asyncio
@@ -23,34 +26,51 @@ from p4.tmp import p4config_pb2
 from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
 import logging
 
-MSG_LOG_MAX_LEN = 1024
+from .record_io import RecordWriter
 
 # List of all active connections
 connections = []
 
+STREAM_END = object()
+
 
 def ShutdownAllSwitchConnections():
     for c in connections:
         c.shutdown()
 
 
+def _next_timed(stream):
+    # runs in the executor thread: the perf_counter() of the return measures the hop to the event loop
+    return next(stream, STREAM_END), time.perf_counter()
+
+
 class SwitchConnection(object):
 
     def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
-                 proto_dump_file="grpc.pcap"):
+                 proto_dump_file="grpc.p4rtlog", log_options=None):
         self.name = name
         self.address = address
         self.device_id = device_id
         self.p4info = None
         self.channel = grpc.insecure_channel(self.address)
         if proto_dump_file is not None:
-            interceptor = GrpcRequestLogger(proto_dump_file)
-            self.channel = grpc.intercept_channel(self.channel, interceptor)
+            # log_options: GrpcRequestLogger keyword arguments (rotation, compression, sampling)
+            self.request_logger = GrpcRequestLogger(proto_dump_file, **(log_options or {}))
+            self.channel = grpc.intercept_channel(self.channel, self.request_logger)
+        else:
+            self.request_logger = None
         self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
         self.requests_stream = IterableQueue()
         self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests_stream))
         self.proto_dump_file = proto_dump_file
         self.queues = {}
+        # Optional latency callbacks (see src/latency_metrics.py):
+        # latency_observer(stage, switch_name, seconds), write_observer(table_id, operation, seconds)
+        self.latency_observer = None
+        self.write_observer = None
+        # Optional state_observer(switch_name, update_type, entity), called after each successful
+        # write of a table entry, PRE entry or digest entry (see src/warm_restart.py)
+        self.state_observer = None
         connections.append(self)
 
     @abstractmethod
@@ -60,6 +80,8 @@ class SwitchConnection(object):
     def shutdown(self):
         self.requests_stream.close()
         self.stream_msg_resp.cancel()
+        if self.request_logger is not None:
+            self.request_logger.close()
 
     def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
         request = p4runtime_pb2.StreamMessageRequest()
@@ -74,15 +96,17 @@ class SwitchConnection(object):
             for item in self.stream_msg_resp:
                 return item  # just one
 
-    def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
-        device_config = self.buildDeviceConfig(**kwargs)
+    def SetForwardingPipelineConfig(self, p4info=None, dry_run=False, config=None, **kwargs):
+        # config: a ForwardingPipelineConfig built once for all the switches (bmv2.buildPipelineConfig)
         request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
         request.election_id.low = 1
         request.device_id = self.device_id
-        config = request.config
-
-        config.p4info.CopyFrom(p4info)
-        config.p4_device_config = device_config.SerializeToString()
+        if config is not None:
+            request.config.CopyFrom(config)
+        else:
+            device_config = self.buildDeviceConfig(**kwargs)
+            request.config.p4info.CopyFrom(p4info)
+            request.config.p4_device_config = device_config.SerializeToString()
 
         request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
         if dry_run:
@@ -90,6 +114,44 @@ class SwitchConnection(object):
         else:
             self.client_stub.SetForwardingPipelineConfig(request)
 
+    def GetForwardingPipelineConfig(self, response_type=p4runtime_pb2.GetForwardingPipelineConfigRequest.ALL,
+                                    dry_run=False):
+        request = p4runtime_pb2.GetForwardingPipelineConfigRequest()
+        request.device_id = self.device_id
+        request.response_type = response_type
+        if dry_run:
+            print("P4Runtime GetForwardingPipelineConfig:", request)
+        else:
+            return self.client_stub.GetForwardingPipelineConfig(request).config
+
+    def ReadEntities(self, entities, dry_run=False):
+        """One Read of several (wildcard) entities; yields the entities read."""
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        request.entities.extend(entities)
+        if dry_run:
+            print("P4Runtime Read:", request)
+        else:
+            for response in self.client_stub.Read(request):
+                yield from response.entities
+
+    def WriteUpdates(self, updates, dry_run=False):
+        """One Write carrying all the updates (p4runtime_pb2.Update), e.g. a reconciliation batch."""
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        request.election_id.low = 1
+        request.updates.extend(updates)
+        if dry_run:
+            print("P4Runtime Write:", request)
+        elif updates:
+            self.client_stub.Write(request)
+            self._observe_state(request)
+
+    def _observe_state(self, request):
+        if self.state_observer is not None:
+            for update in request.updates:
+                self.state_observer(self.name, update.type, update.entity)
+
     def WriteTableEntry(self, table_entry, dry_run=False):
         try:
 
@@ -108,7 +170,7 @@ class SwitchConnection(object):
                 print("P4Runtime Write (dry run):", request)
             else:
                 print("writing rule...")
-                self.client_stub.Write(request)
+                self._write_table(request, table_entry.table_id, "insert")
         except grpc.RpcError as e:
             print(f"gRPC RpcError: {e.code()} - {e.details()}")
 
@@ -126,7 +188,7 @@ class SwitchConnection(object):
         if dry_run:
             print("P4Runtime Modify: ", request)
         else:
-            self.client_stub.Write(request)
+            self._write_table(request, table_entry.table_id, "modify")
 
     def DeleteTableEntry(self, table_entry, dry_run=False):
         request = p4runtime_pb2.WriteRequest()
@@ -139,7 +201,19 @@ class SwitchConnection(object):
         if dry_run:
             print("P4Runtime Delete: ", request)
         else:
-            self.client_stub.Write(request)
+            self._write_table(request, table_entry.table_id, "delete")
+
+    def _write_table(self, request, table_id, operation):
+        if self.write_observer is None:
+            response = self.client_stub.Write(request)
+        else:
+            start = time.perf_counter()
+            try:
+                response = self.client_stub.Write(request)
+            finally:
+                self.write_observer(table_id, operation, time.perf_counter() - start)
+        self._observe_state(request)
+        return response
 
     def ReadTableEntries(self, table_id=None, dry_run=False):
         request = p4runtime_pb2.ReadRequest()
@@ -206,6 +280,51 @@ class SwitchConnection(object):
         except Exception as e:
             print(f"Exception during ReadRegisters: {e}")
 
+    def ReadRegisterArrays(self, register_ids, dry_run=False):
+        """
+        Reads every cell of several register arrays with a single ReadRequest
+        (one wildcard register_entry per id). Errors are raised to the caller.
+        """
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        for register_id in register_ids:
+            request.entities.add().register_entry.register_id = register_id
+        if dry_run:
+            print("P4Runtime Read (Dry Run):", request)
+            return
+        for response in self.client_stub.Read(request):
+            yield response
+
+    def ReadCounterArray(self, counter_id, dry_run=False):
+        """
+        Reads every cell of a counter array with a wildcard ReadRequest. Unlike ReadCounters,
+        errors (including a stream interrupted midway) are raised to the caller.
+        """
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        request.entities.add().counter_entry.counter_id = counter_id
+        if dry_run:
+            print("P4Runtime Read (Dry Run):", request)
+            return
+        for response in self.client_stub.Read(request):
+            yield response
+
+    def ReadRegisterCells(self, cells, dry_run=False):
+        """
+        Reads selected register cells, given as (register_id, index) pairs, with a single ReadRequest.
+        """
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        for register_id, index in cells:
+            register_entry = request.entities.add().register_entry
+            register_entry.register_id = register_id
+            register_entry.index.index = index
+        if dry_run:
+            print("P4Runtime Read (Dry Run):", request)
+            return
+        for response in self.client_stub.Read(request):
+            yield response
+
     def check_queue_status(self):
         try:
             msg_list = list(self.stream_msg_resp)
@@ -228,10 +347,9 @@ class SwitchConnection(object):
                 print(f"⚠️ No packages available for the switch {self.name}.")
                 return None, None
 
-            message, timestamp_received = item
-            #start_time = time.time()
-
-            #processing_time = start_time - timestamp_received
+            message, timestamp_received, queued = item
+            if self.latency_observer is not None:
+                self.latency_observer("queue_wait", self.name, time.perf_counter() - queued)
 
             return message, timestamp_received
         except asyncio.TimeoutError:
@@ -249,12 +367,18 @@ class SwitchConnection(object):
         while True:
             try:
 
-                item = await asyncio.to_thread(next, self.stream_msg_resp)
+                # StopIteration cannot cross the executor future: end of stream is a sentinel
+                item, returned = await asyncio.to_thread(_next_timed, self.stream_msg_resp)
+                if item is STREAM_END:
+                    raise StopIteration
                 if item is not None:
 
                     timestamp_received = time.time()
+                    queued = time.perf_counter()
+                    if self.latency_observer is not None:
+                        self.latency_observer("stream_receive", self.name, queued - returned)
                     print(f"📥 New message received from {self.name}: {item} at time: {timestamp_received}")
-                    await self.queues[self.name].put((item, timestamp_received))
+                    await self.queues[self.name].put((item, timestamp_received, queued))
                 else:
                     print(f"⚠️ Empty package received for switch {self.name}, ignored.")
 
@@ -326,6 +450,7 @@ class SwitchConnection(object):
             print("P4Runtime write DigestEntry: ", request)
         else:
             self.client_stub.Write(request)
+            self._observe_state(request)
 
     def DigestListAck(self, digest_ack, dry_run=False, **kwargs):
         try:
@@ -385,6 +510,7 @@ class SwitchConnection(object):
 
                 print("Sending the Write request to the P4Runtime server...")
                 response = self.client_stub.Write(request)
+                self._observe_state(request)
 
                 print("Successful writing to P4Runtime")
                 print(f"Response received: {response}")
@@ -411,6 +537,7 @@ class SwitchConnection(object):
             else:
 
                 response = self.client_stub.Write(request)
+                self._observe_state(request)
 
                 print("Successful writing to P4Runtime")
                 print(f"Response received: {response}")
@@ -425,24 +552,89 @@ class SwitchConnection(object):
 
 class GrpcRequestLogger(grpc.UnaryUnaryClientInterceptor,
                         grpc.UnaryStreamClientInterceptor):
-    """Implementation of a gRPC interceptor that logs request to a file"""
-
-    def __init__(self, log_file):
-        self.log_file = log_file
-        with open(self.log_file, 'w') as f:
-            # Clear content if it exists.
-            f.write("")
+    """
+    gRPC interceptor that logs the requests to a binary file (record_io format, one
+    channel per method) from a background thread; render it with log_decoder.py.
+
+    The caller only serializes the request into an in-memory ring buffer of
+    `buffer_size` records: when the writer falls behind, the oldest records are dropped
+    and counted. The file is rotated at `max_bytes` keeping `backups` old files
+    (log, log.1, ...), gzip compressed with compress=True (log.gz, log.1.gz, ...);
+    max_bytes counts the bytes before compression. `sampling` maps method names
+    (full "/p4.v1.P4Runtime/Write" or just "Write") to the fraction of calls logged,
+    0 disables a method.
+    """
+
+    def __init__(self, log_file, max_bytes=64 * 1024 * 1024, backups=3, compress=False, sampling=None,
+                 buffer_size=100000, flush_interval=1.0):
+        self.log_file = log_file + ('.gz' if compress and not log_file.endswith('.gz') else '')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sampling = {method.rsplit('/', 1)[-1]: rate for method, rate in (sampling or {}).items()}
+        self.calls = {}
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=buffer_size)
+        self.wakeup = threading.Event()
+        self.running = True
+        self.writer = RecordWriter(self.log_file, header={"log": "p4runtime-requests"})
+        self.thread = threading.Thread(target=self._writer_loop, name="grpc-request-logger", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _sampled(self, method_name):
+        rate = self.sampling.get(method_name.rsplit('/', 1)[-1], 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        count = self.calls.get(method_name, 0)
+        self.calls[method_name] = count + 1
+        # every 1/rate-th call, deterministic
+        return int(count * rate) != int((count + 1) * rate)
 
     def log_message(self, method_name, body):
-        with open(self.log_file, 'a') as f:
-            ts = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            msg = str(body)
-            f.write("\n[%s] %s\n---\n" % (ts, method_name))
-            if len(msg) < MSG_LOG_MAX_LEN:
-                f.write(str(body))
-            else:
-                f.write("Message too long (%d bytes)! Skipping log...\n" % len(msg))
-            f.write('---\n')
+        if not self._sampled(method_name):
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((time.time_ns(), method_name, body.SerializeToString()))
+        self.wakeup.set()
+
+    def _backup(self, i):
+        """Name of the i-th old file: log.i, or log.i.gz keeping the extension that marks compression."""
+        if self.log_file.endswith('.gz'):
+            return f"{self.log_file[:-3]}.{i}.gz"
+        return f"{self.log_file}.{i}"
+
+    def _rotate(self):
+        self.writer.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup(i)):
+                os.replace(self._backup(i), self._backup(i + 1))
+        if self.backups > 0:
+            os.replace(self.log_file, self._backup(1))
+        self.writer = RecordWriter(self.log_file, header={"log": "p4runtime-requests"})
+
+    def _writer_loop(self):
+        while self.running or self.buffer:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            while self.buffer:
+                timestamp_ns, method_name, payload = self.buffer.popleft()
+                self.writer.write(payload, timestamp_ns, channel=method_name)
+                if self.writer.bytes >= self.max_bytes:
+                    self._rotate()
+            self.writer.flush()
+
+    def close(self):
+        """Writes what is buffered and closes the file."""
+        if not self.running:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.writer.close()
 
     def intercept_unary_unary(self, continuation, client_call_details, request):
         self.log_message(client_call_details.method, request)
@@ -275,7 +275,7 @@ class ExerciseRunner:
         runtime_json = sw_dict['runtime_json']
         self.logger('Configuring switch %s with id %s using P4Runtime with file %s' % (sw_name, device_id, runtime_json))
         with open(runtime_json, 'r') as sw_conf_file:
-            outfile = '%s/%s-p4runtime-requests.txt' %(self.log_dir, sw_name)
+            outfile = '%s/%s-p4runtime-requests.p4rtlog' %(self.log_dir, sw_name)
             p4runtime_lib.simple_controller.program_switch(
                 addr='127.0.0.1:%d' % grpc_port,
                 device_id=device_id,